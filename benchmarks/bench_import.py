@@ -0,0 +1,175 @@
+"""Benchmark the import times of the modules of the package epstan.
+
+usage: bench_import.py [-h] [--modules S [S ...]] [--forbidden S [S ...]]
+                       [--repeat N] [--max_time F] [--save FILE]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  --modules S [S ...]   imported modules, default epstan.util epstan.history
+                        epstan.profiling epstan.backends epstan.method
+  --forbidden S [S ...] modules that must not be imported as a side effect,
+                        default pystan
+  --repeat N            number of fresh interpreters for each module, default
+                        5
+  --max_time F          max allowed median import time of a module in
+                        seconds, default no limit
+  --save FILE           save the results into a JSON file
+
+Each module is imported in a fresh Python interpreter and the median of the
+import times over the repeats is printed, together with the modules of option
+--forbidden pulled in by the import. PyStan, for example, is slow to import
+and is needed only when the tilted distributions are sampled with Stan, so
+importing the utilities or the algorithm itself must not import it. The script
+exits with a non-zero status if a forbidden module is imported or if an import
+time exceeds option --max_time, so that it can be used as a check that the
+imports stay lazy.
+
+The most recent version of the code can be found on GitHub:
+https://github.com/gelman/ep-stan
+
+"""
+
+# Licensed under the 3-clause BSD license.
+# http://opensource.org/licenses/BSD-3-Clause
+#
+# Copyright (C) 2014 Tuomas Sivula
+# All rights reserved.
+
+
+import os
+import sys
+import time
+import json
+import argparse
+import platform
+import subprocess
+
+import numpy as np
+
+
+CUR_PATH = os.path.dirname(os.path.abspath(__file__))
+PARENT_PATH = os.path.abspath(os.path.join(CUR_PATH, os.pardir))
+
+DEFAULT_MODULES = [
+    'epstan.util',
+    'epstan.history',
+    'epstan.profiling',
+    'epstan.backends',
+    'epstan.method'
+]
+DEFAULT_FORBIDDEN = ['pystan']
+
+# Code run in the fresh interpreter: prints the import time and the names of
+# the imported modules as JSON
+IMPORT_CODE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps(dict(time=elapsed, modules=sorted(sys.modules))))
+"""
+
+
+def time_import(module, forbidden, repeat):
+    """Import the module in fresh interpreters.
+
+    Returns
+    -------
+    time : float
+        The median of the import times in seconds.
+
+    imported : list of str
+        The forbidden modules imported.
+
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [PARENT_PATH] + env.get('PYTHONPATH', '').split(os.pathsep))
+    times = []
+    imported = set()
+    for _ in range(repeat):
+        out = subprocess.check_output(
+            [sys.executable, '-c', IMPORT_CODE.format(module=module)],
+            env = env,
+            cwd = PARENT_PATH
+        )
+        res = json.loads(out.decode('utf-8').splitlines()[-1])
+        times.append(res['time'])
+        imported.update(
+            name for name in forbidden
+            if name in res['modules']
+        )
+    return float(np.median(times)), sorted(imported)
+
+
+def print_header():
+    print('{:24} {:>10}  {}'.format('module', 'time (ms)', 'forbidden'))
+    print(78*'-')
+
+
+def print_row(result):
+    print('{:24} {:>10.1f}  {}'.format(
+        result['module'],
+        result['time']*1e3,
+        ', '.join(result['forbidden']) or '-'
+    ))
+
+
+def _parse_positive_int(arg):
+    if arg.isalnum() and int(arg) > 0:
+        return int(arg)
+    else:
+       raise ValueError("Invalid integer option")
+
+def _parse_positive_float(arg):
+    f = float(arg)
+    if f <= 0.0:
+        raise ValueError("Invalid float option")
+    return f
+
+
+if __name__ == '__main__':
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description = __doc__.split('\n\n', 1)[0],
+        epilog = "See module docstring for more detailed info.",
+        formatter_class = argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--modules', nargs='+', default=DEFAULT_MODULES,
+                        metavar='S')
+    parser.add_argument('--forbidden', nargs='+', default=DEFAULT_FORBIDDEN,
+                        metavar='S')
+    parser.add_argument('--repeat', type=_parse_positive_int, default=5,
+                        metavar='N')
+    parser.add_argument('--max_time', type=_parse_positive_float,
+                        metavar='F')
+    parser.add_argument('--save', metavar='FILE')
+    args = parser.parse_args()
+
+    print_header()
+    results = []
+    failed = False
+    for module in args.modules:
+        t, imported = time_import(module, args.forbidden, args.repeat)
+        result = dict(module=module, time=t, forbidden=imported)
+        results.append(result)
+        print_row(result)
+        if imported or (args.max_time is not None and t > args.max_time):
+            failed = True
+
+    if args.save:
+        out = dict(
+            created = time.strftime('%Y-%m-%d %H:%M:%S'),
+            machine = platform.platform(),
+            python = platform.python_version(),
+            numpy = np.__version__,
+            results = results
+        )
+        with open(args.save, 'w') as f:
+            json.dump(out, f, indent=1)
+        print("Results saved into {}".format(args.save))
+
+    if failed:
+        print("Import check failed.")
+        sys.exit(1)
@@ -0,0 +1,469 @@
+"""Benchmark the numerical kernels of the distributed EP algorithm.
+
+usage: bench_kernels.py [-h] [--dphi P [P ...]] [--n P [P ...]]
+                        [--K P [P ...]] [--kernels S [S ...]]
+                        [--min_time F] [--save FILE] [--compare FILE]
+                        [--treshold F] [--seed N]
+
+optional arguments:
+  -h, --help           show this help message and exit
+  --dphi P [P ...]     dimensions of phi, default 4 16 64
+  --n P [P ...]        numbers of samples, default 200 1000 4000
+  --K P [P ...]        numbers of sites, default 4 16 64
+  --kernels S [S ...]  benchmarked kernels, default all
+  --min_time F         min total time of the timed calls of one case in
+                       seconds, default 0.2
+  --save FILE          save the results as a baseline JSON file
+  --compare FILE       compare the results to a baseline JSON file
+  --treshold F         slowdown ratio reported as a regression when comparing,
+                       default 1.25
+  --seed N             seed for the synthetic samples, default 0
+
+The benchmarked kernels (and the swept parameters) are:
+    invert_normal_params   (dphi)     util.invert_normal_params
+    olse                   (dphi, n)  util.olse
+    olse_batch             (dphi, K)  util.olse_batch with 1000 samples in
+                                      each site
+    cv_moments             (dphi, n)  util.cv_moments
+    prec_sample            (dphi, n)  QR-based precision estimate in
+                                      method.Worker.site_update
+    prec_olse              (dphi, n)  olse precision estimate in
+                                      method.Worker.site_update
+    tsqr                   (dphi, n)  util.tsqr with 4 blocks
+    copy_triu_to_tril      (dphi)     cython_util.copy_triu_to_tril
+    auto_outer             (dphi, n)  cython_util.auto_outer
+    damping                (dphi, K)  one damping step of method.Master: the
+                                      global update, its Cholesky and the
+                                      cavities of all the sites
+Stan is not needed as the kernels are run with synthetic Gaussian samples.
+
+For each case, the time per call and the throughput (calls per second) are
+printed. The results can be saved as a baseline with option --save, and later
+runs can be compared to it with option --compare, in which case the cases
+slower than the baseline by the ratio given in option --treshold are reported
+and the script exits with a non-zero status.
+
+The most recent version of the code can be found on GitHub:
+https://github.com/gelman/ep-stan
+
+"""
+
+# Licensed under the 3-clause BSD license.
+# http://opensource.org/licenses/BSD-3-Clause
+#
+# Copyright (C) 2014 Tuomas Sivula
+# All rights reserved.
+
+
+import os
+import sys
+import time
+import json
+import argparse
+import platform
+
+import numpy as np
+from scipy import linalg
+from scipy.stats import multivariate_normal
+
+
+# Add parent dir to sys.path if not present already. This is only done because
+# of easy importing of the package epstan. Adding the parent directory into the
+# PYTHONPATH works as well.
+CUR_PATH = os.path.dirname(os.path.abspath(__file__))
+PARENT_PATH = os.path.abspath(os.path.join(CUR_PATH, os.pardir))
+# Double check that the package is in the parent directory
+if os.path.exists(os.path.join(PARENT_PATH, 'epstan')):
+    if PARENT_PATH not in os.sys.path:
+        os.sys.path.insert(0, PARENT_PATH)
+
+from epstan.util import (
+    invert_normal_params, olse, olse_batch, cv_moments, tsqr)
+from epstan.cython_util import copy_triu_to_tril, auto_outer
+from epstan.method import Worker
+
+
+DEFAULT_DPHI = [4, 16, 64]
+DEFAULT_N = [200, 1000, 4000]
+DEFAULT_K = [4, 16, 64]
+
+
+# ------------------------------------------------------------------------------
+#     Synthetic distributions
+# ------------------------------------------------------------------------------
+
+def random_cov(d, rng):
+    """Random well conditioned covariance matrix in F-order."""
+    A = rng.randn(d, d) / np.sqrt(d)
+    S = A.dot(A.T) + np.eye(d)
+    return np.asfortranarray(S)
+
+
+def random_normal(d, rng):
+    """Random normal distribution (S, m, Q, r)."""
+    S = random_cov(d, rng)
+    m = rng.randn(d)
+    Q, r = invert_normal_params(S, m)
+    return S, m, Q, r
+
+
+def random_samples(d, n, rng, S=None, m=None):
+    """Samples from a normal distribution in F-order of shape (n, d)."""
+    if S is None:
+        S = random_cov(d, rng)
+    if m is None:
+        m = rng.randn(d)
+    samp = m + rng.randn(n, d).dot(linalg.cholesky(S))
+    return np.asfortranarray(samp)
+
+
+def make_worker(d, Q, r, Qi, ri):
+    """Worker with its cavity formed for the site update kernels."""
+    worker = Worker(0, None, d, np.zeros((1, d)), np.zeros(1))
+    if not worker.cavity(Q, r, Qi, ri):
+        raise ValueError("Cavity not pos.def.")
+    return worker
+
+
+# ------------------------------------------------------------------------------
+#     Kernels
+# ------------------------------------------------------------------------------
+# Each kernel is a function returning a tuple (setup, call), where setup is a
+# function preparing the (possibly overwritten) arguments and call is the timed
+# function called with the output of setup.
+
+def kernel_invert_normal_params(dphi, rng):
+    S, m, _, _ = random_normal(dphi, rng)
+    out_A = np.empty((dphi, dphi), order='F')
+    out_b = np.empty(dphi)
+    setup = lambda: None
+    call = lambda _: invert_normal_params(S, m, out_A=out_A, out_b=out_b)
+    return setup, call
+
+
+def kernel_olse(dphi, n, rng):
+    samp = random_samples(dphi, n, rng)
+    St = np.cov(samp, rowvar=0, bias=True)
+    _, _, P, _ = random_normal(dphi, rng)
+    out = np.empty((dphi, dphi), order='F')
+    setup = lambda: None
+    call = lambda _: olse(St, n, P=P, out=out)
+    return setup, call
+
+
+def kernel_olse_batch(dphi, K, rng):
+    n = 1000
+    St = np.array([
+        np.cov(random_samples(dphi, n, rng), rowvar=0, bias=True)
+        for _ in range(K)
+    ])
+    _, _, P, _ = random_normal(dphi, rng)
+    out = np.empty((K, dphi, dphi))
+    setup = lambda: None
+    call = lambda _: olse_batch(St, n, P=P, out=out)
+    return setup, call
+
+
+def kernel_cv_moments(dphi, n, rng):
+    S, m, _, _ = random_normal(dphi, rng)
+    samp = random_samples(dphi, n, rng, S=S, m=m)
+    lp = multivariate_normal.logpdf(samp, mean=m, cov=S)
+    # Control variate distribution near the target
+    S_tilde = S + 0.1*np.eye(dphi)
+    m_tilde = m + 0.1*rng.randn(dphi)
+    Q_tilde, r_tilde = invert_normal_params(S_tilde, m_tilde)
+    S_hat = np.empty((dphi, dphi), order='F')
+    m_hat = np.empty(dphi)
+    setup = lambda: None
+    call = lambda _: cv_moments(
+        samp, lp, Q_tilde, r_tilde,
+        S_tilde = S_tilde,
+        m_tilde = m_tilde,
+        S_hat = S_hat,
+        m_hat = m_hat
+    )
+    return setup, call
+
+
+def _kernel_prec(dphi, n, rng, prec_estim):
+    S, m, Q, r = random_normal(dphi, rng)
+    # Site with half of the precision
+    Qi = np.asfortranarray(0.5*Q)
+    ri = 0.5*r
+    worker = make_worker(dphi, Q, r, Qi, ri)
+    samp = random_samples(dphi, n, rng, S=S, m=m)
+    samp_work = np.empty_like(samp, order='F')
+    dQi = np.empty((dphi, dphi), order='F')
+    dri = np.empty(dphi)
+    def setup():
+        np.copyto(samp_work, samp)
+        return samp_work
+    call = lambda samp_work: worker.site_update(
+        samp_work, dQi, dri, prec_estim=prec_estim)
+    return setup, call
+
+
+def kernel_prec_sample(dphi, n, rng):
+    return _kernel_prec(dphi, n, rng, 'sample')
+
+
+def kernel_prec_olse(dphi, n, rng):
+    return _kernel_prec(dphi, n, rng, 'olse')
+
+
+def kernel_tsqr(dphi, n, rng):
+    samp = random_samples(dphi, n, rng)
+    samp -= np.mean(samp, axis=0)
+    out = np.empty((dphi, dphi), order='F')
+    setup = lambda: None
+    call = lambda _: tsqr(samp, 4, out=out)
+    return setup, call
+
+
+def kernel_copy_triu_to_tril(dphi, rng):
+    A = np.asfortranarray(rng.randn(dphi, dphi))
+    setup = lambda: None
+    call = lambda _: copy_triu_to_tril(A)
+    return setup, call
+
+
+def kernel_auto_outer(dphi, n, rng):
+    A = rng.randn(n, dphi)
+    out = np.empty((n, dphi*(dphi+1)//2))
+    setup = lambda: None
+    call = lambda _: auto_outer(A, out)
+    return setup, call
+
+
+def kernel_damping(dphi, K, rng):
+    # Global approximation from the prior and K sites
+    Q0 = np.asfortranarray(np.eye(dphi))
+    r0 = np.zeros(dphi)
+    Qi = np.empty((dphi, dphi, K), order='F')
+    ri = np.empty((dphi, K), order='F')
+    for k in range(K):
+        _, _, Qi[:,:,k], ri[:,k] = random_normal(dphi, rng)
+    Qi /= K
+    ri /= K
+    # Small site parameter updates
+    dQi = np.empty_like(Qi, order='F')
+    dri = 0.01*rng.randn(dphi, K)
+    for k in range(K):
+        A = 0.1*rng.randn(dphi, dphi)
+        dQi[:,:,k] = (A + A.T) / (2*K)
+    dri = np.asfortranarray(dri)
+    Qi2 = np.empty_like(Qi, order='F')
+    ri2 = np.empty_like(ri, order='F')
+    Q = np.empty((dphi, dphi), order='F')
+    r = np.empty(dphi)
+    cho_Q = np.empty((dphi, dphi), order='F')
+    workers = [
+        Worker(k, None, dphi, np.zeros((1, dphi)), np.zeros(1))
+        for k in range(K)
+    ]
+    df = 0.5
+    def call(_):
+        # As in the damping loop of Master.iterate
+        np.add(Qi, np.multiply(df, dQi, out=Qi2), out=Qi2)
+        np.add(ri, np.multiply(df, dri, out=ri2), out=ri2)
+        np.add(Qi2.sum(2, out=Q), Q0, out=Q)
+        np.add(ri2.sum(1, out=r), r0, out=r)
+        np.copyto(cho_Q, Q)
+        linalg.cho_factor(cho_Q, overwrite_a=True)
+        for k in range(K):
+            if not workers[k].cavity(Q, r, Qi2[:,:,k], ri2[:,k]):
+                raise ValueError("Cavity not pos.def.")
+    setup = lambda: None
+    return setup, call
+
+
+# Kernels and their swept parameters
+KERNELS = [
+    ('invert_normal_params', kernel_invert_normal_params, ('dphi',)),
+    ('olse',                 kernel_olse,                 ('dphi', 'n')),
+    ('olse_batch',           kernel_olse_batch,           ('dphi', 'K')),
+    ('cv_moments',           kernel_cv_moments,           ('dphi', 'n')),
+    ('prec_sample',          kernel_prec_sample,          ('dphi', 'n')),
+    ('prec_olse',            kernel_prec_olse,            ('dphi', 'n')),
+    ('tsqr',                 kernel_tsqr,                 ('dphi', 'n')),
+    ('copy_triu_to_tril',    kernel_copy_triu_to_tril,    ('dphi',)),
+    ('auto_outer',           kernel_auto_outer,           ('dphi', 'n')),
+    ('damping',              kernel_damping,              ('dphi', 'K')),
+]
+
+
+# ------------------------------------------------------------------------------
+#     Timing
+# ------------------------------------------------------------------------------
+
+def time_kernel(setup, call, min_time):
+    """Time the kernel calls.
+
+    The kernel is called until the total time of the timed calls exceeds
+    `min_time` (but at least three times), and the median of the times of the
+    calls is returned. The setup is not included in the timing.
+
+    """
+    # Warm up
+    call(setup())
+    times = []
+    total = 0.0
+    while total < min_time or len(times) < 3:
+        args = setup()
+        start = time.perf_counter()
+        call(args)
+        elapsed = time.perf_counter() - start
+        times.append(elapsed)
+        total += elapsed
+    return float(np.median(times))
+
+
+def run_benchmarks(kernels, sweep, min_time, seed):
+    """Run the benchmarks.
+
+    Returns
+    -------
+    results : list of dict
+        Dicts with keys 'kernel', 'params' and 'time' (seconds per call).
+
+    """
+    results = []
+    for name, func, params in KERNELS:
+        if name not in kernels:
+            continue
+        # All combinations of the swept parameters
+        cases = [{}]
+        for param in params:
+            cases = [
+                dict(case, **{param: val})
+                for case in cases
+                for val in sweep[param]
+            ]
+        for case in cases:
+            rng = np.random.RandomState(seed)
+            setup, call = func(rng=rng, **case)
+            t = time_kernel(setup, call, min_time)
+            results.append(dict(kernel=name, params=case, time=t))
+            print_row(name, case, t)
+    return results
+
+
+def _case_key(result):
+    params = sorted(result['params'].items())
+    return '{}({})'.format(
+        result['kernel'],
+        ','.join('{}={}'.format(k, v) for k, v in params)
+    )
+
+
+def print_header():
+    print(('{:22}' + 3*' {:>6}' + 2*' {:>14}').format(
+        'kernel', 'dphi', 'n', 'K', 'time (us)', 'calls/s'))
+    print(78*'-')
+
+
+def print_row(name, case, t):
+    print(('{:22}' + 3*' {:>6}' + ' {:>14.2f} {:>14.1f}').format(
+        name,
+        case.get('dphi', ''),
+        case.get('n', ''),
+        case.get('K', ''),
+        t*1e6,
+        1/t
+    ))
+
+
+def compare(results, baseline, treshold):
+    """Compare the results to the baseline and print the regressions.
+
+    Returns
+    -------
+    regressions : list of str
+        The keys of the cases slower than the baseline by the ratio
+        `treshold`.
+
+    """
+    base_times = dict(
+        (_case_key(result), result['time']) for result in baseline['results'])
+    print()
+    print(('{:50}' + 3*' {:>8}').format('case', 'base', 'now', 'ratio'))
+    print(78*'-')
+    regressions = []
+    for result in results:
+        key = _case_key(result)
+        if key not in base_times:
+            continue
+        ratio = result['time'] / base_times[key]
+        flag = ''
+        if ratio > treshold:
+            regressions.append(key)
+            flag = ' REGRESSION'
+        print(('{:50}' + 2*' {:>8.1f}' + ' {:>8.2f}{}').format(
+            key, base_times[key]*1e6, result['time']*1e6, ratio, flag))
+    return regressions
+
+
+def _parse_positive_int(arg):
+    if arg.isalnum() and int(arg) > 0:
+        return int(arg)
+    else:
+       raise ValueError("Invalid integer option")
+
+def _parse_positive_float(arg):
+    f = float(arg)
+    if f <= 0.0:
+        raise ValueError("Invalid float option")
+    return f
+
+
+if __name__ == '__main__':
+
+    kernel_names = [name for name, _, _ in KERNELS]
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description = __doc__.split('\n\n', 1)[0],
+        epilog = "See module docstring for more detailed info.",
+        formatter_class = argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--dphi', nargs='+', type=_parse_positive_int,
+                        default=DEFAULT_DPHI, metavar='P')
+    parser.add_argument('--n', nargs='+', type=_parse_positive_int,
+                        default=DEFAULT_N, metavar='P')
+    parser.add_argument('--K', nargs='+', type=_parse_positive_int,
+                        default=DEFAULT_K, metavar='P')
+    parser.add_argument('--kernels', nargs='+', choices=kernel_names,
+                        default=kernel_names, metavar='S')
+    parser.add_argument('--min_time', type=_parse_positive_float, default=0.2,
+                        metavar='F')
+    parser.add_argument('--save', metavar='FILE')
+    parser.add_argument('--compare', metavar='FILE')
+    parser.add_argument('--treshold', type=_parse_positive_float,
+                        default=1.25, metavar='F')
+    parser.add_argument('--seed', type=int, default=0, metavar='N')
+    args = parser.parse_args()
+
+    sweep = dict(dphi=args.dphi, n=args.n, K=args.K)
+    print_header()
+    results = run_benchmarks(args.kernels, sweep, args.min_time, args.seed)
+
+    if args.save:
+        baseline = dict(
+            created = time.strftime('%Y-%m-%d %H:%M:%S'),
+            machine = platform.platform(),
+            python = platform.python_version(),
+            numpy = np.__version__,
+            results = results
+        )
+        with open(args.save, 'w') as f:
+            json.dump(baseline, f, indent=1)
+        print("Baseline saved into {}".format(args.save))
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.treshold)
+        if regressions:
+            print("{} regressions found".format(len(regressions)))
+            sys.exit(1)
+        print("No regressions found")
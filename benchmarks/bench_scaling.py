@@ -0,0 +1,220 @@
+"""Benchmark the scaling of the whole distributed EP algorithm.
+
+usage: bench_scaling.py [-h] [--K P [P ...]] [--dphi P [P ...]]
+                        [--n_site N] [--nsamp N] [--niter N]
+                        [--backend {gaussian,logistic}] [--max_mem F]
+                        [--save FILE] [--seed N]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  --K P [P ...]         numbers of sites, default 10 100 1000
+  --dphi P [P ...]      dimensions of phi, default 4 16 64
+  --n_site N            number of observations in each site, default 20
+  --nsamp N             number of tilted draws in each site, default 400 (at
+                        least 2*dphi draws are used)
+  --niter N             number of EP iterations, default 3
+  --backend {gaussian,logistic}
+                        tilted backend, default gaussian
+  --max_mem F           cases whose estimated memory usage exceeds this many
+                        gigabytes are skipped, default 4
+  --save FILE           save the results into a JSON file
+  --seed N              seed for the data and the sampling, default 0
+
+The whole pipeline of Master.run is timed with a synthetic linear or logistic
+regression model, whose tilted distributions are sampled with the NumPy
+backends in module epstan.backends. Stan is not needed, and the timings thus
+show the overhead of the algorithm itself, e.g. the precision estimates and
+the damping and cavity loops in the master, which are otherwise dominated by
+the Stan sampling. The parameter phi is the vector of the regression
+coefficients of length dphi, and each site has `n_site` observations.
+
+For each case, the time per iteration and its distribution into the stages
+recorded with epstan.profiling.Profiler are printed. The memory usage of the
+site parameters grows as K*dphi^2, and e.g. K=1e4 and dphi=1e3 would not fit
+in the memory of a single machine; such cases are skipped according to option
+--max_mem.
+
+The most recent version of the code can be found on GitHub:
+https://github.com/gelman/ep-stan
+
+"""
+
+# Licensed under the 3-clause BSD license.
+# http://opensource.org/licenses/BSD-3-Clause
+#
+# Copyright (C) 2014 Tuomas Sivula
+# All rights reserved.
+
+
+import os
+import time
+import json
+import argparse
+import platform
+
+import numpy as np
+
+
+# Add parent dir to sys.path if not present already. This is only done because
+# of easy importing of the package epstan. Adding the parent directory into the
+# PYTHONPATH works as well.
+CUR_PATH = os.path.dirname(os.path.abspath(__file__))
+PARENT_PATH = os.path.abspath(os.path.join(CUR_PATH, os.pardir))
+# Double check that the package is in the parent directory
+if os.path.exists(os.path.join(PARENT_PATH, 'epstan')):
+    if PARENT_PATH not in os.sys.path:
+        os.sys.path.insert(0, PARENT_PATH)
+
+from epstan.method import Master
+from epstan.backends import GaussianBackend, LogisticBackend
+from epstan.profiling import Profiler
+
+
+DEFAULT_K = [10, 100, 1000]
+DEFAULT_DPHI = [4, 16, 64]
+
+BACKENDS = {
+    'gaussian' : GaussianBackend,
+    'logistic' : LogisticBackend
+}
+
+# Stages shown in the output (see epstan.profiling)
+STAGES = ('backend', 'prec_estim', 'damping', 'cavity', 'moments')
+
+# Number of dphi x dphi matrices allocated for each site: the site parameters
+# Qi and Qi2 and their updates dQi in the master, and Mat and temp_M in the
+# worker
+MATS_PER_SITE = 5
+
+
+def estimate_mem(K, dphi):
+    """Estimated memory usage of the site parameters in gigabytes."""
+    return MATS_PER_SITE * 8 * dphi**2 * K / 1e9
+
+
+def make_data(K, dphi, n_site, backend, rng):
+    """Synthetic regression data of K sites."""
+    N = K * n_site
+    X = rng.randn(N, dphi)
+    phi = rng.randn(dphi) / np.sqrt(dphi)
+    eta = X.dot(phi)
+    if backend == 'gaussian':
+        y = eta + rng.randn(N)
+    else:
+        y = (rng.rand(N) < 1/(1 + np.exp(-eta))).astype(float)
+    return X, y
+
+
+def run_case(K, dphi, args):
+    """Run the algorithm once and return the timings of the stages."""
+    rng = np.random.RandomState(args.seed)
+    X, y = make_data(K, dphi, args.n_site, args.backend, rng)
+    nsamp = max(args.nsamp, 2*dphi)
+    profiler = Profiler()
+    master = Master(
+        None, X, y,
+        dphi = dphi,
+        site_sizes = np.full(K, args.n_site, dtype=np.int64),
+        backend = BACKENDS[args.backend](),
+        chains = 1,
+        iter = 2*nsamp,
+        warmup = nsamp,
+        profiler = profiler
+    )
+    start = time.time()
+    info, _ = master.run(args.niter, verbose=False, seed=args.seed)
+    total = time.time() - start
+    stats = profiler.stats()
+    stages = dict(
+        (name, stats[name][1] if name in stats else 0.0) for name in STAGES)
+    return dict(
+        K = K,
+        dphi = dphi,
+        nsamp = nsamp,
+        niter = args.niter,
+        info = int(info),
+        time = total / args.niter,
+        stages = dict((name, t / args.niter) for name, t in stages.items())
+    )
+
+
+def print_header():
+    print(('{:>6} {:>6} {:>10}' + len(STAGES)*' {:>10}').format(
+        'K', 'dphi', 's/iter', *STAGES))
+    print((30 + 11*len(STAGES))*'-')
+
+
+def print_row(result):
+    print(('{:>6} {:>6} {:>10.4f}' + len(STAGES)*' {:>9.1f}%').format(
+        result['K'],
+        result['dphi'],
+        result['time'],
+        *(100 * result['stages'][name] / result['time'] for name in STAGES)
+    ))
+
+
+def _parse_positive_int(arg):
+    if arg.isalnum() and int(arg) > 0:
+        return int(arg)
+    else:
+       raise ValueError("Invalid integer option")
+
+def _parse_positive_float(arg):
+    f = float(arg)
+    if f <= 0.0:
+        raise ValueError("Invalid float option")
+    return f
+
+
+if __name__ == '__main__':
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description = __doc__.split('\n\n', 1)[0],
+        epilog = "See module docstring for more detailed info.",
+        formatter_class = argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--K', nargs='+', type=_parse_positive_int,
+                        default=DEFAULT_K, metavar='P')
+    parser.add_argument('--dphi', nargs='+', type=_parse_positive_int,
+                        default=DEFAULT_DPHI, metavar='P')
+    parser.add_argument('--n_site', type=_parse_positive_int, default=20,
+                        metavar='N')
+    parser.add_argument('--nsamp', type=_parse_positive_int, default=400,
+                        metavar='N')
+    parser.add_argument('--niter', type=_parse_positive_int, default=3,
+                        metavar='N')
+    parser.add_argument('--backend', choices=sorted(BACKENDS),
+                        default='gaussian')
+    parser.add_argument('--max_mem', type=_parse_positive_float, default=4.0,
+                        metavar='F')
+    parser.add_argument('--save', metavar='FILE')
+    parser.add_argument('--seed', type=int, default=0, metavar='N')
+    args = parser.parse_args()
+
+    print_header()
+    results = []
+    for dphi in args.dphi:
+        for K in args.K:
+            if estimate_mem(K, dphi) > args.max_mem:
+                print("{:>6} {:>6}   skipped, estimated memory {:.1f} GB"
+                      .format(K, dphi, estimate_mem(K, dphi)))
+                continue
+            result = run_case(K, dphi, args)
+            results.append(result)
+            print_row(result)
+            if result['info'] != Master.INFO_OK:
+                print("       run ended with info {}".format(result['info']))
+
+    if args.save:
+        out = dict(
+            created = time.strftime('%Y-%m-%d %H:%M:%S'),
+            machine = platform.platform(),
+            python = platform.python_version(),
+            numpy = np.__version__,
+            backend = args.backend,
+            results = results
+        )
+        with open(args.save, 'w') as f:
+            json.dump(out, f, indent=1)
+        print("Results saved into {}".format(args.save))
@@ -0,0 +1,291 @@
+"""Benchmark the data simulation of the models of the experiment.
+
+usage: bench_simulate.py [-h] [--D P [P ...]] [--J P [P ...]] [--model S]
+                         [--kernels S [S ...]] [--min_time F]
+                         [--check_max_D N] [--save FILE] [--seed N]
+
+optional arguments:
+  -h, --help           show this help message and exit
+  --D P [P ...]        numbers of inputs, default 10 100 500 1000 2000
+  --J P [P ...]        numbers of groups, default 100 1000 10000 100000
+  --model S            model simulated in the kernels swept over the number
+                       of groups, default m4b
+  --kernels S [S ...]  benchmarked kernels, default all
+  --min_time F         min total time of the timed calls of one case in
+                       seconds, default 0.2
+  --check_max_D N      check the results against the reference
+                       implementations for the cases up to this number of
+                       inputs, default 100
+  --save FILE          save the results into a JSON file
+  --seed N             seed for the simulation, default 0
+
+The benchmarked kernels (and the swept parameters) are:
+    rand_corr_vine         (D)        models.common.rand_corr_vine
+    simulate_data          (J)        simulate_data of the model of option
+                                      --model with 8 inputs, 20 observations
+                                      per group and random input covariance
+    calc_uncertainty       (J)        models.common.data.calc_uncertainty of
+                                      the simulated data
+
+The reference implementation of rand_corr_vine is the direct triple loop of
+the vine recursion, which is too slow to be run for hundreds of inputs. With
+option --check_max_D, the outputs of the cases of at most the given number of
+inputs are checked against it and the script exits with a non-zero status if
+they differ.
+
+The most recent version of the code can be found on GitHub:
+https://github.com/gelman/ep-stan
+
+"""
+
+# Licensed under the 3-clause BSD license.
+# http://opensource.org/licenses/BSD-3-Clause
+#
+# Copyright (C) 2014 Tuomas Sivula
+# All rights reserved.
+
+
+import os
+import sys
+import time
+import json
+import argparse
+import platform
+
+import numpy as np
+
+
+# Add the experiment dir to sys.path in order to import the models.
+CUR_PATH = os.path.dirname(os.path.abspath(__file__))
+PARENT_PATH = os.path.abspath(os.path.join(CUR_PATH, os.pardir))
+EXP_PATH = os.path.join(PARENT_PATH, 'experiment')
+if EXP_PATH not in os.sys.path:
+    os.sys.path.insert(0, EXP_PATH)
+
+from models.common import rand_corr_vine
+
+
+DEFAULT_D = [10, 100, 500, 1000, 2000]
+DEFAULT_J = [100, 1000, 10000, 100000]
+DEFAULT_MODEL = 'm4b'
+
+# Number of inputs and observations per group in the simulated data
+SIM_D = 8
+SIM_NPG = 20
+
+
+# ------------------------------------------------------------------------------
+#     Reference implementations
+# ------------------------------------------------------------------------------
+
+def rand_corr_vine_loop(d, alpha=2, beta=2, pmin=-0.8, pmax=0.8, seed=None):
+    """The vine recursion of rand_corr_vine with scalar loops."""
+    if isinstance(seed, np.random.RandomState):
+        rand_state = seed
+    else:
+        rand_state = np.random.RandomState(seed)
+    P = np.empty((d,d))
+    uinds = np.triu_indices(d, 1)
+    betas = rand_state.beta(alpha, beta, size=len(uinds[0]))
+    betas *= pmax - pmin
+    betas += pmin
+    P[uinds] = betas
+    np.square(betas, out=betas)
+    P.T[uinds] = betas
+    C = np.eye(d)
+    for i in range(d-1):
+        for j in range(i+1,d):
+            cur = P[i,j]
+            for k in range(i-1,-1,-1):
+                cur *= np.sqrt((1 - P[i,k])*(1 - P[j,k]))
+                cur += P[k,i]*P[k,j]
+            C[i,j] = cur
+            C[j,i] = cur
+    perm = rand_state.permutation(d)
+    return C[np.ix_(perm,perm)]
+
+
+# ------------------------------------------------------------------------------
+#     Kernels
+# ------------------------------------------------------------------------------
+# Each kernel is a function returning a tuple (call, check), where call is the
+# timed function and check is a function returning the max abs difference of
+# the output to the reference implementation or None if there is no reference.
+
+def kernel_rand_corr_vine(D, model_name, seed):
+    call = lambda: rand_corr_vine(D, seed=seed)
+    check = lambda: np.max(np.abs(
+        rand_corr_vine(D, seed=seed) - rand_corr_vine_loop(D, seed=seed)))
+    return call, check
+
+
+def _simulation_model(J, model_name):
+    model_module = getattr(__import__('models.'+model_name), model_name)
+    return model_module.model(J, SIM_D, SIM_NPG)
+
+
+def kernel_simulate_data(J, model_name, seed):
+    model = _simulation_model(J, model_name)
+    call = lambda: model.simulate_data(Sigma_x='rand', rng=seed)
+    return call, None
+
+
+def kernel_calc_uncertainty(J, model_name, seed):
+    data = _simulation_model(J, model_name).simulate_data(
+        Sigma_x='rand', rng=seed)
+    return data.calc_uncertainty, None
+
+
+KERNELS = [
+    ('rand_corr_vine', kernel_rand_corr_vine, ('D',)),
+    ('simulate_data', kernel_simulate_data, ('J',)),
+    ('calc_uncertainty', kernel_calc_uncertainty, ('J',)),
+]
+
+# Max abs difference to the reference implementation
+CHECK_TOL = 1e-10
+
+
+# ------------------------------------------------------------------------------
+#     Timing
+# ------------------------------------------------------------------------------
+
+def time_kernel(call, min_time):
+    """Time the kernel calls.
+
+    The kernel is called until the total time of the timed calls exceeds
+    `min_time` (but at least three times), and the median of the times of the
+    calls is returned.
+
+    """
+    times = []
+    total = 0.0
+    while total < min_time or len(times) < 3:
+        start = time.perf_counter()
+        call()
+        elapsed = time.perf_counter() - start
+        times.append(elapsed)
+        total += elapsed
+    return float(np.median(times))
+
+
+def run_benchmarks(kernels, sweep, model_name, min_time, check_max_D, seed):
+    """Run the benchmarks.
+
+    Returns
+    -------
+    results : list of dict
+        Dicts with keys 'kernel', 'params', 'time' (seconds per call) and
+        'error' (max abs difference to the reference implementation or None if
+        not checked).
+
+    """
+    results = []
+    for name, func, params in KERNELS:
+        if name not in kernels:
+            continue
+        # All combinations of the swept parameters
+        cases = [{}]
+        for param in params:
+            cases = [
+                dict(case, **{param: val})
+                for case in cases
+                for val in sweep[param]
+            ]
+        for case in cases:
+            call, check = func(model_name=model_name, seed=seed, **case)
+            t = time_kernel(call, min_time)
+            error = None
+            if check is not None and case.get('D', 0) <= check_max_D:
+                error = float(check())
+            results.append(dict(kernel=name, params=case, time=t, error=error))
+            print_row(name, case, t, error)
+    return results
+
+
+def print_header():
+    print(('{:22}' + 2*' {:>6}' + 2*' {:>14}').format(
+        'kernel', 'D', 'J', 'time (ms)', 'max abs error'))
+    print(78*'-')
+
+
+def print_row(name, case, t, error):
+    print(('{:22}' + 2*' {:>6}' + ' {:>14.2f} {:>14}').format(
+        name,
+        case.get('D', ''),
+        case.get('J', ''),
+        t*1e3,
+        '-' if error is None else '{:.2e}'.format(error)
+    ))
+
+
+def _parse_positive_int(arg):
+    if arg.isalnum() and int(arg) > 0:
+        return int(arg)
+    else:
+       raise ValueError("Invalid integer option")
+
+def _parse_nonnegative_int(arg):
+    if arg.isalnum() and int(arg) >= 0:
+        return int(arg)
+    else:
+       raise ValueError("Invalid integer option")
+
+def _parse_positive_float(arg):
+    f = float(arg)
+    if f <= 0.0:
+        raise ValueError("Invalid float option")
+    return f
+
+
+if __name__ == '__main__':
+
+    kernel_names = [name for name, _, _ in KERNELS]
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description = __doc__.split('\n\n', 1)[0],
+        epilog = "See module docstring for more detailed info.",
+        formatter_class = argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--D', nargs='+', type=_parse_positive_int,
+                        default=DEFAULT_D, metavar='P')
+    parser.add_argument('--J', nargs='+', type=_parse_positive_int,
+                        default=DEFAULT_J, metavar='P')
+    parser.add_argument('--model', default=DEFAULT_MODEL, metavar='S')
+    parser.add_argument('--kernels', nargs='+', choices=kernel_names,
+                        default=kernel_names, metavar='S')
+    parser.add_argument('--min_time', type=_parse_positive_float, default=0.2,
+                        metavar='F')
+    parser.add_argument('--check_max_D', type=_parse_nonnegative_int,
+                        default=100, metavar='N')
+    parser.add_argument('--save', metavar='FILE')
+    parser.add_argument('--seed', type=int, default=0, metavar='N')
+    args = parser.parse_args()
+
+    sweep = dict(D=args.D, J=args.J)
+    print_header()
+    results = run_benchmarks(
+        args.kernels, sweep, args.model, args.min_time, args.check_max_D,
+        args.seed)
+
+    if args.save:
+        out = dict(
+            created = time.strftime('%Y-%m-%d %H:%M:%S'),
+            machine = platform.platform(),
+            python = platform.python_version(),
+            numpy = np.__version__,
+            model = args.model,
+            results = results
+        )
+        with open(args.save, 'w') as f:
+            json.dump(out, f, indent=1)
+        print("Results saved into {}".format(args.save))
+
+    failed = [
+        result for result in results
+        if result['error'] is not None and not result['error'] <= CHECK_TOL
+    ]
+    if failed:
+        print("{} cases differ from the reference".format(len(failed)))
+        sys.exit(1)
@@ -0,0 +1,1041 @@
+"""Sampler backends for the tilted distributions of the distributed EP.
+
+A backend draws samples from the tilted distribution of a site, i.e. from the
+product of the cavity distribution N(mu_phi, Omega_phi^-1) and the likelihood
+of the site data. By default, the workers sample the tilted distributions with
+PyStanBackend using the Stan model given for the master, but another backend
+can be given for the master with the keyword argument `backend`, in which case
+the site model is not used. The available backends are:
+    PyStanBackend   : PyStan 2 model in the same process or in a subprocess
+    CmdStanBackend  : compiled CmdStan executable communicating via files
+    GaussianBackend : linear regression with known noise, exact sampling
+    LogisticBackend : logistic regression, importance sampling
+
+The NumPy backends GaussianBackend and LogisticBackend work with the site data
+`X` and `y` and a parameter vector phi of the length of the number of columns
+in `X`. They do not require a Stan model or a compiler, which makes them
+suitable e.g. for benchmarking the scaling of the algorithm itself.
+
+The backends provide the samples either as a sample matrix (method sample)
+or as their moments accumulated one chain or chunk at a time (method
+sample_moments), so that the whole sample matrix is not held in the memory.
+
+New backends can be implemented by subclassing TiltedBackend.
+
+The most recent version of the code can be found on GitHub:
+https://github.com/gelman/ep-stan
+
+"""
+
+# Licensed under the 3-clause BSD license.
+# http://opensource.org/licenses/BSD-3-Clause
+#
+# Copyright (C) 2014 Tuomas Sivula
+# All rights reserved.
+
+
+__all__ = [
+    'TiltedBackend', 'PyStanBackend', 'CmdStanBackend', 'GaussianBackend',
+    'LogisticBackend'
+]
+
+
+import os
+import re
+import time
+import json
+import shutil
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+from scipy import linalg
+
+from .profiling import Profiler, NULL_PROFILER
+from .util import (
+    MomentAccumulator,
+    get_last_fit_sample,
+    load_stan,
+    copy_fit_samples,
+    add_fit_samples,
+    stan_sample_time,
+    split_rhat_ess,
+    redirect_stdout_stderr_deep
+)
+
+
+class TiltedBackend(object):
+    """Base class for the tilted distribution sampler backends."""
+
+    # Upper limit (exclusive) for the seeds given for method sample, equal to
+    # pystan.constants.MAX_UINT
+    MAX_SEED = 2**31 - 1
+
+    # If True, the methods may be called concurrently from several threads
+    THREAD_SAFE = True
+
+    def sample(self, data, cavity, seed, init=None, params=None,
+               save_samples=None, profiler=None):
+        """Draw samples from the tilted distribution of a site.
+
+        Parameters
+        ----------
+        data : dict
+            The data of the site as provided for the site model, including the
+            cavity distribution parameters `mu_phi` and `Omega_phi`.
+
+        cavity : 2-tuple of ndarray
+            Mean and precision matrix (F-order) of the cavity distribution.
+
+        seed : int
+            Seed for the sampling.
+
+        init : optional
+            The initialisation of the sampler, e.g. the last draw returned
+            from the previous call for the same site.
+
+        params : dict, optional
+            The sampling parameters 'chains', 'iter', 'warmup' and 'thin' as
+            provided for the worker. The number of returned draws is given by
+            function n_draws.
+
+        save_samples : sequence of str, optional
+            Additional parameter names whose samples are returned.
+
+        profiler : profiling.Profiler, optional
+            Profiler into which the stages of the sampling are recorded. By
+            default, nothing is recorded.
+
+        Returns
+        -------
+        samp : ndarray
+            The samples of phi of shape (nsamp, dphi) in F-order. The caller
+            may overwrite the array.
+
+        last : object
+            The last draw for initialising the next call, or None.
+
+        diag : dict
+            Diagnostics of the sampling with keys 'time' (sampling time),
+            'warmup_time', 'stepsize', 'rhat' and 'ess' (nan if not
+            available) and 'samples' (the additional samples requested in
+            `save_samples`).
+
+        """
+        raise NotImplementedError
+
+    def sample_moments(self, data, cavity, seed, init=None, params=None,
+                       save_samples=None, profiler=None):
+        """Draw samples from the tilted distribution and return their moments.
+
+        Similar to method sample but the samples of phi are returned as their
+        mean and scatter matrix accumulated one chain or one chunk of draws at
+        a time. By default, the draws of method sample are added chain by
+        chain. The backends override this so that the samples of all the
+        chains are not held at once.
+
+        Parameters
+        ----------
+        data, cavity, seed, init, params, save_samples, profiler
+            See method sample.
+
+        Returns
+        -------
+        moments : util.MomentAccumulator
+            The accumulated moments of the samples of phi.
+
+        last, diag
+            See method sample.
+
+        """
+        samp, last, diag = self.sample(
+            data, cavity, seed, init=init, params=params,
+            save_samples=save_samples, profiler=profiler)
+        moments = MomentAccumulator(samp.shape[1])
+        for chunk in _chain_chunks(samp.shape[0], params):
+            moments.add(samp[chunk])
+        return moments, last, diag
+
+    def laplace(self, data, cavity, seed=None, init=None):
+        """Gaussian approximation of the tilted distribution at its mode.
+
+        Optional for the backends. Used by the workers with the tilted
+        estimate method 'laplace' instead of method sample.
+
+        Parameters
+        ----------
+        data, cavity, seed, init
+            See method sample.
+
+        Returns
+        -------
+        mode : ndarray
+            The mode of the tilted distribution of phi.
+
+        prec : ndarray
+            The precision matrix of the approximation, i.e. the negative
+            Hessian of the (marginal) tilted log density at the mode.
+
+        Raises
+        ------
+        LinAlgError
+            If the Hessian is not negative definite.
+
+        """
+        raise NotImplementedError(
+            "{} does not implement the Laplace approximation"
+            .format(type(self).__name__))
+
+    def has_laplace(self):
+        """Return True if the backend implements method laplace."""
+        return type(self).laplace is not TiltedBackend.laplace
+
+
+def n_draws(params):
+    """Number of draws corresponding to the sampling parameters."""
+    if params is None:
+        params = {}
+    chains = params.get('chains', 4)
+    iter_ = params.get('iter', 1000)
+    warmup = params.get('warmup')
+    if warmup is None:
+        warmup = iter_ // 2
+    thin = params.get('thin', 1)
+    return chains * ((iter_ - warmup + thin - 1) // thin)
+
+
+def _chain_chunks(nsamp, params):
+    """Slices of the draws of each chain in the stacked samples."""
+    chains = 4 if params is None else params.get('chains', 4)
+    if chains < 1 or nsamp % chains:
+        # Not stacked chains, one chunk
+        return [slice(0, nsamp)]
+    n = nsamp // chains
+    return [slice(c*n, (c+1)*n) for c in range(chains)]
+
+
+def _diag(start, ess):
+    return dict(
+        time = time.time() - start,
+        warmup_time = 0.0,
+        stepsize = np.nan,
+        rhat = np.nan,
+        ess = ess,
+        samples = None
+    )
+
+
+def _check_save_samples(save_samples):
+    if save_samples:
+        raise ValueError("Saving additional samples is not supported by the "
+                         "NumPy backends")
+
+
+def _draw_normal(mean, cho_prec, n, rng):
+    """Draw samples from N(mean, Q^-1) given upper Cholesky of Q."""
+    z = rng.randn(len(mean), n)
+    z = linalg.solve_triangular(cho_prec, z, overwrite_b=True,
+                                check_finite=False)
+    # Transpose into F-order with shape (n, dphi)
+    samp = np.asfortranarray(z.T)
+    samp += mean
+    return samp
+
+
+# ------------------------------------------------------------------------------
+#     PyStan
+# ------------------------------------------------------------------------------
+
+def _sample_stan(queue, path, data, stan_params, other_params=None,
+                 profile=False, moments=False):
+    """Load and fit Stan model in a subprocess.
+
+    Implemented for multiprocesing.
+
+    Parameters
+    ----------
+    queue : multiprocessing.Queue
+        Queue into which the results are put (see Returns).
+
+    path : str
+        Path to the stan model.
+
+    data : dict
+        Data for the sampling.
+
+    stan_params : dict
+        Keyword arguments passed to the Stan.
+
+    other_params : sequence of str, optional
+        List of additional parameter names. If provided, the associated samples
+        are also returned.
+
+    profile : bool, optional
+        If True, the stages are timed and returned in `events`.
+
+    moments : bool, optional
+        If True, the moments of the samples of phi are returned instead of
+        the samples, so that only the moments are transferred.
+
+    Returns
+    -------
+    samps : ndarray or util.MomentAccumulator
+        samples of phi, or their moments if `moments` is True
+
+    lastsamp : dict
+        the last sample of the chains for next iteration initialisation
+
+    duration : float
+        sampling time
+
+    warmup_duration : float
+        warm-up time
+
+    msteps : float
+        mean stepsize
+
+    mrhat : float
+        max Rhat
+
+    mess : float
+        min effective sample size
+
+    events : list
+        the timed stages (see profiling.Profiler), empty if not `profile`
+
+    put_time : float
+        the start time of the transfer of the results
+
+    other_samp : dict
+        additional requested samples (returned only if such are requested)
+
+    """
+    profiler = Profiler() if profile else NULL_PROFILER
+
+    # Sample from the model
+    with profiler.stage('load_model'):
+        sm = load_stan(path)
+    start = time.time()
+    fit, duration, warmup_duration = stan_sample_time(
+        sm, data=data, return_warmup_time=True, **stan_params)
+    _record_stan_stages(
+        profiler, start, time.time() - start, duration, warmup_duration)
+
+    with profiler.stage('extract'):
+        # Extract samples
+        if moments:
+            samp = _fit_moments(fit)
+        else:
+            samp = copy_fit_samples(fit, 'phi')
+
+        # Get the last sample of all
+        lastsamp = get_last_fit_sample(fit)
+
+        # Mean stepsize
+        msteps = np.mean([
+            np.mean(p['stepsize__'])
+            for p in fit.get_sampler_params()
+        ])
+
+    with profiler.stage('summary'):
+        summary = fit.summary()['summary']
+    # Max Rhat (from all but last row in the last column)
+    mrhat = np.max(summary[:-1,-1])
+    # Min n_eff (from all but last row in the second last column)
+    mess = np.min(summary[:-1,-2])
+
+    # Extract other params
+    if other_params:
+        with profiler.stage('extract'):
+            other_samp = {
+                par : fit.extract(pars=par)[par]
+                for par in other_params
+            }
+
+    # Returned values
+    ret = [samp, lastsamp, duration, warmup_duration, msteps, mrhat, mess,
+           profiler.events if profile else [], time.time()]
+    if other_params:
+        ret.append(other_samp)
+
+    # Put returns into the queue
+    queue.put(ret)
+
+
+def _fit_moments(fit):
+    """Moments of the samples of phi in a PyStan fit object."""
+    dims = fit.par_dims[fit.model_pars.index('phi')]
+    moments = MomentAccumulator(int(np.prod(dims)))
+    add_fit_samples(fit, 'phi', moments)
+    return moments
+
+
+def _record_stan_stages(profiler, start, wall_time, time, warmup_time, **args):
+    """Record the Stan sampling stages into the profiler.
+
+    The call to Stan is recorded as stage 'stan' and its warm-up and sampling
+    parts as stages 'stan_warmup' and 'stan_sampling' according to the max
+    times of the chains reported by Stan.
+
+    """
+    profiler.record('stan', start, wall_time, **args)
+    profiler.record('stan_warmup', start, warmup_time, **args)
+    profiler.record(
+        'stan_sampling', start + warmup_time, time - warmup_time, **args)
+
+
+class PyStanBackend(TiltedBackend):
+    """Tilted distribution sampling with a PyStan 2 model.
+
+    Parameters
+    ----------
+    model : StanModel or str
+        The StanModel instance, which is sampled in the same process, or a
+        path to a pickled model or Stan source code (see util.load_stan), in
+        which case the model is loaded and sampled in a subprocess.
+
+    fd_step : float, optional
+        Relative step of the finite differences of the gradients forming the
+        Hessian in method laplace. Default is 1e-4.
+
+    newton_iter : int, optional
+        Maximum number of Newton iterations refining the mode in method
+        laplace. Default is 10.
+
+    newton_tol : float, optional
+        Tolerance for the max abs Newton step. Default is 1e-6.
+
+    Notes
+    -----
+    In method laplace, the mode is found with the optimizer of Stan and refined
+    with Newton's method in the unconstrained space (including the Jacobian of
+    the transformations), where the Hessian is formed by finite differences of
+    the gradients of the log density of the model. The precision of phi is
+    then obtained by marginalising over the other parameters. This requires
+    that phi is the first parameter of the model and unconstrained, as in the
+    bundled models.
+
+    The in-process Stan calls redirect the process-wide output streams and
+    load the model lazily, and thus the instances are not thread-safe.
+
+    """
+
+    THREAD_SAFE = False
+
+    def __init__(self, model, fd_step=1e-4, newton_iter=10, newton_tol=1e-6):
+        self.model = model
+        self.fd_step = fd_step
+        self.newton_iter = newton_iter
+        self.newton_tol = newton_tol
+        # Model loaded in this process for method laplace
+        self._loaded_model = None
+
+    def sample(self, data, cavity, seed, init=None, params=None,
+               save_samples=None, profiler=None):
+        return self._sample(
+            data, seed, init, params, save_samples, profiler, False)
+
+    def sample_moments(self, data, cavity, seed, init=None, params=None,
+                       save_samples=None, profiler=None):
+        return self._sample(
+            data, seed, init, params, save_samples, profiler, True)
+
+    def _sample(self, data, seed, init, params, save_samples, profiler,
+                moments):
+        """Sample the model and return the samples or their moments."""
+        stan_params = dict(params) if params is not None else {}
+        stan_params['seed'] = seed
+        if init is not None:
+            stan_params['init'] = init
+        if profiler is None:
+            profiler = NULL_PROFILER
+        diag = dict(samples=None)
+
+        if isinstance(self.model, str):
+            # run in a subprocess
+            q = multiprocessing.Queue()
+            args = [q, self.model, data, stan_params]
+            if save_samples:
+                args.append(save_samples)
+            p = multiprocessing.Process(
+                target=_sample_stan, args=args,
+                kwargs=dict(profile=profiler.enabled, moments=moments))
+            with profiler.stage('spawn'):
+                p.start()
+            ret = q.get()
+            get_time = time.time()
+            (samp, lastsamp, dur, wdur, msteps, mrhat, mess, events,
+             put_time) = ret[:9]
+            if save_samples:
+                diag['samples'] = ret[9]
+            # Stages in the subprocess
+            for event in events:
+                profiler.record(
+                    event['name'], event['start'], event['duration'],
+                    pid=event['pid'], tid=event['tid'], **event['args'])
+            profiler.record('transfer', put_time, get_time - put_time)
+            if not moments:
+                # Needs to be copied for `owndata`
+                samp = np.copy(samp, order='F')
+            p.join()
+
+        else:
+            # run in the same process
+            start = time.time()
+            fit, dur, wdur = stan_sample_time(
+                self.model, data=data, return_warmup_time=True, **stan_params)
+            _record_stan_stages(
+                profiler, start, time.time() - start, dur, wdur)
+            with profiler.stage('extract'):
+                # mean stepsize
+                msteps = np.mean([
+                    np.mean(p['stepsize__'])
+                    for p in fit.get_sampler_params()
+                ])
+            with profiler.stage('summary'):
+                summary = fit.summary()['summary']
+            # max Rhat (from all but last row in the last column)
+            mrhat = np.max(summary[:-1,-1])
+            # min n_eff (from all but last row in the second last column)
+            mess = np.min(summary[:-1,-2])
+
+            with profiler.stage('extract'):
+                # Extract samples
+                if moments:
+                    samp = _fit_moments(fit)
+                else:
+                    samp = copy_fit_samples(fit, 'phi')
+                lastsamp = get_last_fit_sample(fit)
+                if save_samples:
+                    # Extract other params
+                    diag['samples'] = {
+                        par : fit.extract(pars=par)[par]
+                        for par in save_samples
+                    }
+
+            # Dereference the fit
+            fit = None
+
+        diag.update(
+            time = dur,
+            warmup_time = wdur,
+            stepsize = msteps,
+            rhat = mrhat,
+            ess = mess
+        )
+        return samp, lastsamp, diag
+
+
+    def _stan_model(self):
+        """The StanModel instance in this process."""
+        if not isinstance(self.model, str):
+            return self.model
+        if self._loaded_model is None:
+            self._loaded_model = load_stan(self.model)
+        return self._loaded_model
+
+    def laplace(self, data, cavity, seed=None, init=None):
+        model = self._stan_model()
+        stan_kwargs = dict(data=data)
+        if seed is not None:
+            stan_kwargs['seed'] = seed
+        if isinstance(init, (list, tuple)):
+            # The last draws of the chains, use the first one
+            init = init[0]
+        with redirect_stdout_stderr_deep():
+            opt = model.optimizing(
+                init = init if init is not None else 'random', **stan_kwargs)
+            # Fit object for evaluating the log density gradients
+            fit = model.sampling(
+                init=[opt], iter=1, chains=1, algorithm='Fixed_param',
+                **stan_kwargs)
+        grad = lambda u: np.asarray(
+            fit.grad_log_prob(u, adjust_transform=True))
+
+        # Refine the mode in the unconstrained space
+        u = np.asarray(fit.unconstrain_pars(opt), dtype=float)
+        for _ in range(self.newton_iter):
+            step = linalg.cho_solve(
+                linalg.cho_factor(_fd_neg_hessian(grad, u, self.fd_step)),
+                grad(u)
+            )
+            u += step
+            if np.max(np.abs(step)) < self.newton_tol:
+                break
+        H = _fd_neg_hessian(grad, u, self.fd_step)
+
+        # Marginal precision of phi, the first dphi parameters
+        dphi = len(cavity[0])
+        prec = H[:dphi,:dphi]
+        if H.shape[0] > dphi:
+            cho = linalg.cho_factor(H[dphi:,dphi:])
+            prec = prec - H[:dphi,dphi:].dot(
+                linalg.cho_solve(cho, H[dphi:,:dphi]))
+        # Check positive definiteness
+        linalg.cho_factor(prec)
+        return u[:dphi].copy(), np.asfortranarray(prec)
+
+
+def _fd_neg_hessian(grad, u, rel_step):
+    """Negative Hessian by central finite differences of the gradient."""
+    n = len(u)
+    H = np.empty((n, n))
+    x = u.copy()
+    for j in range(n):
+        h = rel_step * max(1.0, abs(u[j]))
+        x[j] = u[j] - h
+        g_minus = grad(x)
+        x[j] = u[j] + h
+        H[:,j] = (g_minus - grad(x)) / (2*h)
+        x[j] = u[j]
+    # Symmetrise
+    H += H.T
+    H *= 0.5
+    return H
+
+
+# ------------------------------------------------------------------------------
+#     CmdStan
+# ------------------------------------------------------------------------------
+
+def _json_default(obj):
+    """Convert NumPy objects for json.dumps."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError("Object of type {} is not JSON serializable"
+                    .format(type(obj).__name__))
+
+
+def _read_stan_csv(filename):
+    """Read a Stan CSV output file.
+
+    Returns
+    -------
+    header : list of str
+        The column names.
+
+    draws : ndarray
+        The draws of shape (ndraws, ncolumns).
+
+    comments : str
+        The comment lines, containing e.g. the elapsed times.
+
+    """
+    header = None
+    rows = []
+    comments = []
+    with open(filename, 'r') as f:
+        for line in f:
+            if line.startswith('#'):
+                comments.append(line)
+            elif header is None:
+                header = line.strip().split(',')
+            elif line.strip():
+                rows.append(line)
+    if header is None:
+        raise RuntimeError("No output in {}".format(filename))
+    draws = np.loadtxt(rows, delimiter=',', ndmin=2)
+    return header, draws, ''.join(comments)
+
+
+def _stan_columns(header):
+    """Group the Stan CSV columns by the parameter names.
+
+    Returns
+    -------
+    params : dict
+        Dict {name: (columns, shape)}, where columns is an array of the column
+        indices of the elements of the parameter in F-order, and shape is the
+        shape of the parameter. The sampler diagnostic columns (ending with
+        `__`) are excluded.
+
+    """
+    elems = {}
+    for j, col in enumerate(header):
+        if col.endswith('__'):
+            continue
+        name, *idx = col.split('.')
+        elems.setdefault(name, []).append((tuple(int(i)-1 for i in idx), j))
+    params = {}
+    for name, lst in elems.items():
+        idx = np.array([i for i, _ in lst], dtype=np.intp)
+        idx = idx.reshape(len(lst), -1)
+        shape = tuple(idx.max(axis=0) + 1) if idx.shape[1] else ()
+        columns = np.empty(len(lst), dtype=np.intp)
+        pos = (np.ravel_multi_index(idx.T, shape, order='F') if shape
+               else np.zeros(1, dtype=np.intp))
+        columns[pos] = [j for _, j in lst]
+        params[name] = (columns, shape)
+    return params
+
+
+class CmdStanBackend(TiltedBackend):
+    """Tilted distribution sampling with a compiled CmdStan executable.
+
+    The chains are run in parallel as separate processes of the executable,
+    which communicate via files in a working directory. The data of each site
+    except the cavity distribution is serialised only once, after which only
+    the cavity distribution is converted for each call. The executable is
+    compiled once beforehand, e.g. with `make path/to/model` in the CmdStan
+    directory, so that no compiler or PyStan pickling is involved in the
+    sampling.
+
+    Parameters
+    ----------
+    exe : str
+        Path to the compiled model executable.
+
+    work_dir : str, optional
+        Directory for the data, initialisation and output files. By default,
+        a temporary directory is created, which is removed in method close.
+
+    extra_args : sequence of str, optional
+        Additional arguments for the method `sample` of the executable, e.g.
+        ['adapt', 'delta=0.9'].
+
+    """
+
+    def __init__(self, exe, work_dir=None, extra_args=()):
+        if not os.path.isfile(exe) or not os.access(exe, os.X_OK):
+            raise ValueError("Arg. `exe` is not an executable file")
+        self.exe = os.path.abspath(exe)
+        if work_dir is None:
+            self.work_dir = tempfile.mkdtemp(prefix='epstan_cmdstan_')
+            self._temp_dir = True
+        else:
+            if not os.path.exists(work_dir):
+                os.makedirs(work_dir)
+            self.work_dir = work_dir
+            self._temp_dir = False
+        self.extra_args = list(extra_args)
+        # Serialised static data and the directory of each site
+        self._sites = {}
+
+    def _site(self, data):
+        """The directory and the serialised data of the site."""
+        site = self._sites.get(id(data))
+        if site is None or site[0] is not data['X']:
+            static = dict(
+                (key, val) for key, val in data.items()
+                if key not in ('mu_phi', 'Omega_phi')
+            )
+            prefix = json.dumps(static, default=_json_default)[:-1]
+            if static:
+                prefix += ', '
+            path = os.path.join(
+                self.work_dir, 'site_{}'.format(len(self._sites)))
+            if not os.path.exists(path):
+                os.makedirs(path)
+            site = (data['X'], path, prefix)
+            self._sites[id(data)] = site
+        return site[1:]
+
+    def _init_args(self, init, path, chain):
+        if init is None or isinstance(init, str) and init == 'random':
+            return []
+        if isinstance(init, (str, int, float)):
+            return ['init={}'.format(init)]
+        # Initial values of each chain
+        filename = os.path.join(path, 'init_{}.json'.format(chain))
+        with open(filename, 'w') as f:
+            json.dump(init[chain], f, default=_json_default)
+        return ['init={}'.format(filename)]
+
+    def sample(self, data, cavity, seed, init=None, params=None,
+               save_samples=None, profiler=None):
+        return self._sample(
+            data, cavity, seed, init, params, save_samples, profiler, False)
+
+    def sample_moments(self, data, cavity, seed, init=None, params=None,
+                       save_samples=None, profiler=None):
+        return self._sample(
+            data, cavity, seed, init, params, save_samples, profiler, True)
+
+    def _sample(self, data, cavity, seed, init, params, save_samples,
+                profiler, moments):
+        """Run the chains and return the samples or their moments."""
+        params = {} if params is None else params
+        chains = params.get('chains', 4)
+        iter_ = params.get('iter', 1000)
+        warmup = params.get('warmup')
+        if warmup is None:
+            warmup = iter_ // 2
+        thin = params.get('thin', 1)
+        if profiler is None:
+            profiler = NULL_PROFILER
+
+        path, prefix = self._site(data)
+        data_file = os.path.join(path, 'data.json')
+        with profiler.stage('write_data'):
+            m, Q = cavity
+            with open(data_file, 'w') as f:
+                f.write(prefix)
+                f.write('"mu_phi": ')
+                json.dump(m.tolist(), f)
+                f.write(', "Omega_phi": ')
+                json.dump(Q.tolist(), f)
+                f.write('}')
+
+        # Run the chains
+        start = time.time()
+        procs = []
+        for c in range(chains):
+            output = os.path.join(path, 'output_{}.csv'.format(c))
+            args = (
+                [self.exe, 'sample',
+                 'num_samples={}'.format(iter_ - warmup),
+                 'num_warmup={}'.format(warmup),
+                 'thin={}'.format(thin)]
+                + self.extra_args
+                + ['id={}'.format(c + 1),
+                   'data', 'file={}'.format(data_file)]
+                + self._init_args(init, path, c)
+                + ['random', 'seed={}'.format(seed),
+                   'output', 'file={}'.format(output), 'refresh=0']
+            )
+            log = open(os.path.join(path, 'log_{}.txt'.format(c)), 'w+')
+            procs.append((subprocess.Popen(
+                args, stdout=log, stderr=subprocess.STDOUT), log, output))
+        results = []
+        for proc, log, output in procs:
+            ret = proc.wait()
+            log.seek(0)
+            msg = log.read()
+            log.close()
+            if ret != 0:
+                raise RuntimeError(
+                    "CmdStan failed with return code {}:\n{}"
+                    .format(ret, msg[-2000:]))
+            results.append(_read_stan_csv(output))
+        wall_time = time.time() - start
+
+        with profiler.stage('extract'):
+            header = results[0][0]
+            columns = _stan_columns(header)
+            draws = np.stack([draws for _, draws, _ in results])
+            warmup_times = [
+                float(t) for _, _, comments in results
+                for t in re.findall(r'([0-9.]+)(?= seconds \(Warm-up\))',
+                                    comments)
+            ]
+            total_times = [
+                float(t) for _, _, comments in results
+                for t in re.findall(r'([0-9.]+)(?= seconds \(Total\))',
+                                    comments)
+            ]
+            dur = max(total_times) if total_times else wall_time
+            wdur = max(warmup_times) if warmup_times else np.nan
+            _record_stan_stages(profiler, start, wall_time, dur, wdur)
+
+            # Samples of phi from all the chains
+            cols, _ = columns['phi']
+            if moments:
+                samp = MomentAccumulator(len(cols))
+                for c in range(chains):
+                    samp.add(draws[c][:, cols])
+            else:
+                samp = draws[:, :, cols].reshape(-1, len(cols))
+                samp = np.asfortranarray(samp)
+            # The last draw of each chain
+            lastsamp = [
+                dict(
+                    (name, draws[c, -1, cols].reshape(shape, order='F'))
+                    for name, (cols, shape) in columns.items()
+                )
+                for c in range(chains)
+            ]
+            samples = None
+            if save_samples:
+                samples = {}
+                for name in save_samples:
+                    cols, shape = columns[name]
+                    samples[name] = draws[:, :, cols].reshape(
+                        -1, len(cols)).reshape((-1,) + shape, order='F')
+            msteps = np.mean(draws[:, :, header.index('stepsize__')])
+
+        with profiler.stage('summary'):
+            param_cols = np.concatenate(
+                [cols for cols, _ in columns.values()])
+            rhat, ess = split_rhat_ess(draws[:, :, param_cols])
+
+        diag = dict(
+            time = dur,
+            warmup_time = wdur,
+            stepsize = msteps,
+            rhat = np.nanmax(rhat) if np.any(np.isfinite(rhat)) else np.nan,
+            ess = np.nanmin(ess) if np.any(np.isfinite(ess)) else np.nan,
+            samples = samples
+        )
+        return samp, lastsamp, diag
+
+    def close(self):
+        """Remove the temporary working directory."""
+        if self._temp_dir and os.path.exists(self.work_dir):
+            shutil.rmtree(self.work_dir)
+        self._sites = {}
+
+
+# ------------------------------------------------------------------------------
+#     NumPy
+# ------------------------------------------------------------------------------
+
+class GaussianBackend(TiltedBackend):
+    """Exact tilted distribution of a linear regression with known noise.
+
+    The site likelihood is N(y | X phi, `noise_std`^2 I), which makes the
+    tilted distribution normal. Its draws are sampled exactly.
+
+    Parameters
+    ----------
+    noise_std : float, optional
+        The standard deviation of the noise. Default is 1.
+
+    """
+
+    def __init__(self, noise_std=1.0):
+        self.noise_std = noise_std
+        # Natural parameters of the site likelihoods
+        self._site_params = {}
+
+    def _site_natural(self, data):
+        X = data['X']
+        cached = self._site_params.get(id(X))
+        if cached is None or cached[0] is not X:
+            prec = 1 / self.noise_std**2
+            cached = (
+                X,
+                np.asfortranarray(prec * X.T.dot(X)),
+                prec * X.T.dot(data['y'])
+            )
+            self._site_params[id(X)] = cached
+        return cached[1:]
+
+    def laplace(self, data, cavity, seed=None, init=None):
+        m, Omega = cavity
+        Lk, lk = self._site_natural(data)
+        prec = Omega + Lk
+        mode = linalg.cho_solve(linalg.cho_factor(prec), Omega.dot(m) + lk)
+        return mode, prec
+
+    def sample(self, data, cavity, seed, init=None, params=None,
+               save_samples=None, profiler=None):
+        _check_save_samples(save_samples)
+        start = time.time()
+        rng = np.random.RandomState(seed)
+        mode, prec = self.laplace(data, cavity)
+        nsamp = n_draws(params)
+        cho = linalg.cholesky(prec, overwrite_a=True, check_finite=False)
+        samp = _draw_normal(mode, cho, nsamp, rng)
+        return samp, None, _diag(start, float(nsamp))
+
+    def sample_moments(self, data, cavity, seed, init=None, params=None,
+                       save_samples=None, profiler=None):
+        # The draws of each chain are drawn and added separately, and thus
+        # they differ from the ones of method sample with the same seed
+        _check_save_samples(save_samples)
+        start = time.time()
+        rng = np.random.RandomState(seed)
+        mode, prec = self.laplace(data, cavity)
+        nsamp = n_draws(params)
+        cho = linalg.cholesky(prec, overwrite_a=True, check_finite=False)
+        moments = MomentAccumulator(len(mode))
+        for chunk in _chain_chunks(nsamp, params):
+            moments.add(
+                _draw_normal(mode, cho, chunk.stop - chunk.start, rng))
+        return moments, None, _diag(start, float(nsamp))
+
+
+class LogisticBackend(TiltedBackend):
+    """Logistic regression tilted distribution by importance sampling.
+
+    The site likelihood is prod Bernoulli(y | logit^-1(X phi)). The draws are
+    obtained by importance resampling from the Gaussian approximation at the
+    mode of the tilted distribution found with Newton's method.
+
+    Parameters
+    ----------
+    oversample : int, optional
+        The number of proposal draws per returned draw. Default is 4.
+
+    newton_iter : int, optional
+        Maximum number of Newton iterations. Default is 50.
+
+    newton_tol : float, optional
+        Tolerance for the max abs Newton step. Default is 1e-8.
+
+    """
+
+    def __init__(self, oversample=4, newton_iter=50, newton_tol=1e-8):
+        self.oversample = oversample
+        self.newton_iter = newton_iter
+        self.newton_tol = newton_tol
+
+    def laplace(self, data, cavity, seed=None, init=None):
+        m, Omega = cavity
+        X = data['X']
+        y = data['y']
+        phi = m.copy()
+        for _ in range(self.newton_iter):
+            p = 1 / (1 + np.exp(-X.dot(phi)))
+            grad = X.T.dot(y - p) - Omega.dot(phi - m)
+            prec = Omega + (X.T * (p * (1 - p))).dot(X)
+            step = linalg.cho_solve(linalg.cho_factor(prec), grad)
+            phi += step
+            if np.max(np.abs(step)) < self.newton_tol:
+                break
+        p = 1 / (1 + np.exp(-X.dot(phi)))
+        prec = np.asfortranarray(Omega + (X.T * (p * (1 - p))).dot(X))
+        return phi, prec
+
+    def _log_tilted(self, samp, data, cavity):
+        """Unnormalised tilted log density at the samples."""
+        m, Omega = cavity
+        X = data['X']
+        y = data['y']
+        eta = samp.dot(X.T)
+        # Bernoulli-logit log likelihood: y*eta - log(1 + exp(eta))
+        lp = (eta * y).sum(axis=1) - np.logaddexp(0, eta).sum(axis=1)
+        d = samp - m
+        lp -= 0.5 * np.einsum('ij,ij->i', d.dot(Omega), d)
+        return lp
+
+    def sample(self, data, cavity, seed, init=None, params=None,
+               save_samples=None, profiler=None):
+        _check_save_samples(save_samples)
+        start = time.time()
+        prop, ind, ess = self._resample(data, cavity, seed, params)
+        samp = np.asfortranarray(prop[ind])
+        return samp, None, _diag(start, ess)
+
+    def sample_moments(self, data, cavity, seed, init=None, params=None,
+                       save_samples=None, profiler=None):
+        _check_save_samples(save_samples)
+        start = time.time()
+        prop, ind, ess = self._resample(data, cavity, seed, params)
+        # Same draws as in method sample, added one chain at a time
+        moments = MomentAccumulator(prop.shape[1])
+        for chunk in _chain_chunks(len(ind), params):
+            moments.add(prop[ind[chunk]])
+        return moments, None, _diag(start, ess)
+
+    def _resample(self, data, cavity, seed, params):
+        """The proposal draws, the resampled indices and the ESS."""
+        rng = np.random.RandomState(seed)
+        mode, prec = self.laplace(data, cavity)
+        nsamp = n_draws(params)
+        nprop = self.oversample * nsamp
+        cho = linalg.cholesky(prec, check_finite=False)
+        prop = _draw_normal(mode, cho, nprop, rng)
+        # Importance log weights (proposal log density up to a constant)
+        z = (prop - mode).dot(cho.T)
+        lw = self._log_tilted(prop, data, cavity) + 0.5*np.sum(z**2, axis=1)
+        w = np.exp(lw - lw.max())
+        w /= w.sum()
+        ess = 1 / np.sum(w**2)
+        # Systematic resampling
+        cw = np.cumsum(w)
+        cw[-1] = 1.0
+        ind = np.searchsorted(cw, (rng.rand() + np.arange(nsamp)) / nsamp)
+        return prop, ind, ess
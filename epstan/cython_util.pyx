@@ -1,4 +1,12 @@
-"""This module contains some Cython utilities."""
+"""This module contains some Cython utilities.
+
+The functions operate on typed memoryviews of float64 arrays of any memory
+layout and release the GIL during the computation, so that they can be run
+concurrently from multiple threads, e.g. from a thread pool in the master. The
+loops of the larger problems are parallelised with OpenMP if the module is
+compiled with OpenMP support (see setup.py); otherwise they are run serially.
+
+"""
 
 # Licensed under the 3-clause BSD license.
 # http://opensource.org/licenses/BSD-3-Clause
@@ -6,15 +14,21 @@
 # Copyright (C) 2014 Tuomas Sivula
 # All rights reserved.
 
-import numpy as np
 cimport cython
-cimport numpy as np
-ctypedef np.float64_t DTYPE_t
+from cython.parallel cimport prange
+
+
+cdef enum:
+    # Minimum number of elements processed in a parallel loop; smaller
+    # problems are processed serially as the thread overhead would dominate
+    PARALLEL_MIN = 32768
+    # Block size in the blocked triangular copy
+    TRI_BLOCK = 64
 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def fro_norm_squared(np.ndarray[DTYPE_t, ndim=2] A):
+def fro_norm_squared(const double[:,:] A):
     """Squared Frobenius norm of matrix.
     
     Parameters
@@ -31,18 +45,37 @@ def fro_norm_squared(np.ndarray[DTYPE_t, ndim=2] A):
     cdef Py_ssize_t n = A.shape[0]
     cdef Py_ssize_t d = A.shape[1]
     cdef Py_ssize_t x, y
-    cdef DTYPE_t cur
-    cdef DTYPE_t tot = 0
-    for x in range(n):
-        for y in range(d):
-            cur = A[x,y]
-            tot += cur*cur
+    cdef double cur
+    cdef double tot = 0
+    # The sum is kept serial so that the result does not depend on the number
+    # of threads (the order of the additions of a parallel reduction does)
+    with nogil:
+        for x in range(n):
+            for y in range(d):
+                cur = A[x,y]
+                tot += cur*cur
     return tot
 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def auto_outer(np.ndarray[DTYPE_t, ndim=2] A, np.ndarray[DTYPE_t, ndim=2] out):
+cdef inline void _auto_outer_row(
+        const double[:,:] A, double[:,:] out, Py_ssize_t z) noexcept nogil:
+    """Outer product of row `z` of `A` with itself into row `z` of `out`."""
+    cdef Py_ssize_t d = A.shape[1]
+    cdef Py_ssize_t x, y
+    cdef Py_ssize_t c = 0
+    cdef double a
+    for x in range(d):
+        a = A[z,x]
+        for y in range(x,d):
+            out[z,c] = a * A[z,y]
+            c += 1
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def auto_outer(const double[:,:] A, double[:,:] out):
     """Outer product with itself.
     
     Calculates the outer product of each row of `A` with itself. Each row of the
@@ -56,7 +89,8 @@ def auto_outer(np.ndarray[DTYPE_t, ndim=2] A, np.ndarray[DTYPE_t, ndim=2] out):
         The input array of shape (n,d).
     
     out : ndarray
-        Output array of shape (n,d'), where d' = d+1 choose 2 = d*(d+1)/2.
+        Output array of shape (n,d'), where d' = d+1 choose 2 = d*(d+1)/2. Works
+        faster if this is C-contiguous.
     
     """
     cdef Py_ssize_t n = A.shape[0]
@@ -72,18 +106,35 @@ def auto_outer(np.ndarray[DTYPE_t, ndim=2] A, np.ndarray[DTYPE_t, ndim=2] out):
     if out.shape[0] != n or out.shape[1] != d2:
         raise ValueError("Shapes of `A` and `out` does not match")
     # Calculate
-    cdef Py_ssize_t x, y, z, c
-    for z in range(n):
-        c = 0
-        for x in range(d):
-            for y in range(x,d):
-                out[z,c] = A[z,x] * A[z,y]
-                c += 1
+    cdef Py_ssize_t z
+    with nogil:
+        if n*d2 < PARALLEL_MIN:
+            for z in range(n):
+                _auto_outer_row(A, out, z)
+        else:
+            for z in prange(n, schedule='static'):
+                _auto_outer_row(A, out, z)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline void _copy_block(
+        double[:,:] A, Py_ssize_t bx, Py_ssize_t by) noexcept nogil:
+    """Copy block (bx,by) of the upper triangular into the lower triangular."""
+    cdef Py_ssize_t n = A.shape[0]
+    cdef Py_ssize_t x0 = bx*TRI_BLOCK
+    cdef Py_ssize_t x1 = min(x0 + TRI_BLOCK, n)
+    cdef Py_ssize_t y0 = by*TRI_BLOCK
+    cdef Py_ssize_t y1 = min(y0 + TRI_BLOCK, n)
+    cdef Py_ssize_t x, y
+    for x in range(x0, x1):
+        for y in range(max(y0, x+1), y1):
+            A[y,x] = A[x,y]
 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def copy_triu_to_tril(np.ndarray[DTYPE_t, ndim=2] A):
+def copy_triu_to_tril(double[:,:] A):
     """Copy upper triangular into the lower triangular.
     
     Parameters
@@ -94,21 +145,36 @@ def copy_triu_to_tril(np.ndarray[DTYPE_t, ndim=2] A):
     Notes
     -----
     Works slightly faster with either C of F -contiguous arrays depending on the
-    system and the size of the array. 
+    system and the size of the array. Large matrices are copied in square
+    blocks, which keeps both the read and the written elements in the cache,
+    and the block rows are processed in parallel.
     
     """
     cdef Py_ssize_t n = A.shape[0]
     if n != A.shape[1]:
         raise ValueError("Input array is not square")
     cdef Py_ssize_t x, y
-    for x in range(n-1):
-        for y in range(x+1,n):
-            A[y,x] = A[x,y]
+    cdef Py_ssize_t nb = (n + TRI_BLOCK - 1) // TRI_BLOCK
+    cdef Py_ssize_t bx, by
+    with nogil:
+        if nb == 1:
+            for x in range(n-1):
+                for y in range(x+1,n):
+                    A[y,x] = A[x,y]
+        elif n*n < 2*PARALLEL_MIN:
+            for bx in range(nb):
+                for by in range(bx, nb):
+                    _copy_block(A, bx, by)
+        else:
+            # Dynamic schedule as the block rows have different lengths
+            for bx in prange(nb, schedule='dynamic'):
+                for by in range(bx, nb):
+                    _copy_block(A, bx, by)
 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def ravel_triu(np.ndarray[DTYPE_t, ndim=2] A, np.ndarray[DTYPE_t, ndim=1] out):
+def ravel_triu(const double[:,:] A, double[:] out):
     """Extract the upper triangular into one dimensional array.
     
     Parameters
@@ -137,15 +203,16 @@ def ravel_triu(np.ndarray[DTYPE_t, ndim=2] A, np.ndarray[DTYPE_t, ndim=1] out):
     # Copy the values
     cdef Py_ssize_t x, y
     cdef Py_ssize_t c = 0
-    for x in range(d):
-        for y in range(x,d):
-            out[c] = A[x,y]
-            c += 1
+    with nogil:
+        for x in range(d):
+            for y in range(x,d):
+                out[c] = A[x,y]
+                c += 1
 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def unravel_triu(np.ndarray[DTYPE_t, ndim=1] a, np.ndarray[DTYPE_t, ndim=2] out):
+def unravel_triu(const double[:] a, double[:,:] out):
     """Form square matrix from one dimensional array extracted by ravel_triu.
     
     Parameters
@@ -174,13 +241,12 @@ def unravel_triu(np.ndarray[DTYPE_t, ndim=1] a, np.ndarray[DTYPE_t, ndim=2] out)
     # Copy the values
     cdef Py_ssize_t x, y
     cdef Py_ssize_t c = 0
-    for x in range(d):
-        out[x,x] = a[c]
-        c += 1
-        for y in range(x+1,d):
-            out[x,y] = a[c]
-            out[y,x] = a[c]
+    with nogil:
+        for x in range(d):
+            out[x,x] = a[c]
             c += 1
-
-
+            for y in range(x+1,d):
+                out[x,y] = a[c]
+                out[y,x] = a[c]
+                c += 1
 
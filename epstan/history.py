@@ -0,0 +1,317 @@
+"""On-disk iteration history of the distributed EP algorithm.
+
+The history is stored into a directory containing one raw binary file for
+each array and a small JSON metadata file. The binary files are appended to
+and flushed every iteration so that only one iteration has to be kept in the
+memory while running and the history written until a possible failure of the
+process is retained. The files are synchronised to the disk only in methods
+`flush` and `close`. The saved history can be opened lazily as memory-mapped
+arrays.
+
+The most recent version of the code can be found on GitHub:
+https://github.com/gelman/ep-stan
+
+"""
+
+# Licensed under the 3-clause BSD license.
+# http://opensource.org/licenses/BSD-3-Clause
+#
+# Copyright (C) 2014 Tuomas Sivula
+# All rights reserved.
+
+
+__all__ = ['History', 'open_history']
+
+
+import os
+import json
+import numpy as np
+
+from .cython_util import ravel_triu, unravel_triu
+
+
+class History(object):
+    """Appendable memory-mapped store of the distributed EP iterations.
+
+    Stores the mean and optionally the covariance of the posterior
+    approximation and the analytics listed in History.ANALYTICS of each
+    iteration into the directory `path`. After each call to method `append`,
+    the data is flushed into the files and the metadata file is updated, so
+    that the history can be read at any time. The arrays are memory-mapped
+    lazily when accessed and remapped only if the history has grown since.
+
+    Parameters
+    ----------
+    path : str
+        Path to the history directory.
+
+    dphi : int, optional
+        Dimension of the approximated parameter. Required when a new history
+        is created.
+
+    mode : {'w', 'a', 'r'}, optional
+        In mode 'w' a new history is created (an existing one is overwritten),
+        in mode 'a' an existing history is appended to (or a new one created if
+        it does not exist), and in mode 'r' an existing history is opened for
+        reading only. Default is 'w'.
+
+    cov : bool, optional
+        If True, the covariance matrices are stored. Default is True.
+
+    packed : bool, optional
+        If True, only the upper triangular of the covariance matrices is
+        stored (see cython_util.ravel_triu), which approximately halves the
+        required disk space. Default is False.
+
+    Attributes
+    ----------
+    m : ndarray
+        Memory-mapped array of the means of shape (n, dphi).
+
+    S : {ndarray, sequence, None}
+        Memory-mapped array of the covariance matrices of shape
+        (n, dphi, dphi), or a read-only sequence forming the full matrices
+        from the packed ones when indexed, or None if not stored.
+
+    analytics : ndarray
+        Memory-mapped structured array of the analytics of shape (n,).
+
+    """
+
+    VERSION = 1
+
+    # Analytics stored for each iteration
+    ANALYTICS = ('time', 'mstep', 'mrhat', 'othertime', 'df')
+
+    DTYPE = np.dtype('<f8')
+
+    MODES = ('w', 'a', 'r')
+
+    def __init__(self, path, dphi=None, mode='w', cov=True, packed=False):
+        if mode not in self.MODES:
+            raise ValueError("Invalid arg. `mode`")
+        if mode == 'a' and not os.path.exists(self._meta_path(path)):
+            mode = 'w'
+        self.path = path
+        self.mode = mode
+        if mode == 'w':
+            if dphi is None:
+                raise ValueError("Arg. `dphi` required for a new history")
+            if not os.path.exists(path):
+                os.makedirs(path)
+            self.dphi = dphi
+            self.cov = cov
+            self.packed = cov and packed
+            self.n = 0
+        else:
+            with open(self._meta_path(path), 'r') as f:
+                meta = json.load(f)
+            if meta['version'] != self.VERSION:
+                raise ValueError(
+                    "Unsupported history version {}".format(meta['version']))
+            if dphi is not None and dphi != meta['dphi']:
+                raise ValueError("Arg. `dphi` does not match the history")
+            self.dphi = meta['dphi']
+            self.cov = meta['cov']
+            self.packed = meta['packed']
+            self.n = meta['n']
+        self._dtype_analytics = np.dtype(
+            [(name, self.DTYPE) for name in self.ANALYTICS])
+        self._files = None
+        # Number of iterations in the current memory maps
+        self._maps_n = None
+        if mode != 'r':
+            self._open_files()
+
+    @staticmethod
+    def _meta_path(path):
+        return os.path.join(path, 'meta.json')
+
+    def _arrays(self):
+        """Names and record shapes of the stored arrays."""
+        arrays = [('m', (self.dphi,))]
+        if self.cov:
+            if self.packed:
+                arrays.append(('S', (self.dphi*(self.dphi+1)//2,)))
+            else:
+                arrays.append(('S', (self.dphi, self.dphi)))
+        return arrays
+
+    def _open_files(self):
+        """Open the binary files for appending."""
+        fmode = 'wb' if self.mode == 'w' else 'r+b'
+        self._files = {}
+        for name, shape in self._arrays():
+            f = open(os.path.join(self.path, name + '.bin'), fmode)
+            # Discard a possible partially written record
+            f.truncate(self.n * int(np.prod(shape)) * self.DTYPE.itemsize)
+            f.seek(0, os.SEEK_END)
+            self._files[name] = f
+        f = open(os.path.join(self.path, 'analytics.bin'), fmode)
+        f.truncate(self.n * self._dtype_analytics.itemsize)
+        f.seek(0, os.SEEK_END)
+        self._files['analytics'] = f
+        self._write_meta()
+
+    def _write_meta(self, sync=True):
+        """Write the metadata file atomically."""
+        meta = dict(
+            version = self.VERSION,
+            dphi = self.dphi,
+            cov = self.cov,
+            packed = self.packed,
+            n = self.n,
+            dtype = self.DTYPE.str,
+            analytics = list(self.ANALYTICS)
+        )
+        tmp_path = self._meta_path(self.path) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self._meta_path(self.path))
+
+    def _memmap(self, name, dtype, shape):
+        if self.n == 0:
+            return np.empty((0,) + shape, dtype=dtype)
+        return np.memmap(
+            os.path.join(self.path, name + '.bin'),
+            dtype = dtype,
+            mode = 'r',
+            shape = (self.n,) + shape
+        )
+
+    def _update_maps(self):
+        """Map the stored arrays for reading if not mapped up to date."""
+        if self._maps_n == self.n:
+            return
+        for name, shape in self._arrays():
+            setattr(self, '_map_' + name, self._memmap(name, self.DTYPE, shape))
+        if not self.cov:
+            self._map_S = None
+        self._map_analytics = self._memmap(
+            'analytics', self._dtype_analytics, ())
+        self._maps_n = self.n
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def m(self):
+        self._update_maps()
+        return self._map_m
+
+    @property
+    def S(self):
+        self._update_maps()
+        if self.packed:
+            return _PackedCov(self._map_S, self.dphi)
+        return self._map_S
+
+    @property
+    def analytics(self):
+        self._update_maps()
+        return self._map_analytics
+
+    def append(self, m, S=None, **analytics):
+        """Append one iteration into the history.
+
+        Parameters
+        ----------
+        m : ndarray
+            The mean of the posterior approximation.
+
+        S : ndarray, optional
+            The covariance of the posterior approximation. Required if the
+            covariance matrices are stored.
+
+        time, mstep, mrhat, othertime, df : float, optional
+            The analytics of the iteration. The missing ones are stored as
+            nan.
+
+        """
+        if self.mode == 'r':
+            raise ValueError("History is opened for reading only")
+        for name in analytics:
+            if name not in self.ANALYTICS:
+                raise TypeError("Unexpected analytic {}".format(name))
+        m = np.asarray(m, dtype=self.DTYPE)
+        if m.shape != (self.dphi,):
+            raise ValueError("Invalid shape of arg. `m`")
+        self._files['m'].write(m.tobytes())
+        if self.cov:
+            if S is None:
+                raise ValueError("Arg. `S` required")
+            S = np.asarray(S, dtype=self.DTYPE)
+            if S.shape != (self.dphi, self.dphi):
+                raise ValueError("Invalid shape of arg. `S`")
+            if self.packed:
+                S_packed = np.empty(self.dphi*(self.dphi+1)//2)
+                ravel_triu(np.ascontiguousarray(S), S_packed)
+                S = S_packed
+            self._files['S'].write(np.ascontiguousarray(S).tobytes())
+        rec = np.empty((), dtype=self._dtype_analytics)
+        for name in self.ANALYTICS:
+            val = analytics.get(name)
+            rec[name] = np.nan if val is None else val
+        self._files['analytics'].write(rec.tobytes())
+        for f in self._files.values():
+            f.flush()
+        self.n += 1
+        self._write_meta(sync=False)
+
+    def append_record(self, rec):
+        """Append an iteration record yielded by Master.iterate."""
+        self.append(
+            rec['m'],
+            S = rec['S'],
+            time = rec['stime'],
+            mstep = rec['mstep'],
+            mrhat = rec['mrhat'],
+            othertime = rec['othertime'],
+            df = rec['df']
+        )
+
+    def flush(self):
+        """Synchronise the appended data into the disk."""
+        if self._files is not None:
+            for f in self._files.values():
+                f.flush()
+                os.fsync(f.fileno())
+            self._write_meta()
+
+    def close(self):
+        """Synchronise and close the files opened for appending."""
+        if self._files is not None:
+            self.flush()
+            for f in self._files.values():
+                f.close()
+            self._files = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _PackedCov(object):
+    """Read-only sequence of full covariance matrices from packed ones."""
+
+    def __init__(self, packed, dphi):
+        self.packed = packed
+        self.dphi = dphi
+
+    def __len__(self):
+        return len(self.packed)
+
+    def __getitem__(self, i):
+        out = np.empty((self.dphi, self.dphi))
+        unravel_triu(np.asarray(self.packed[i]), out)
+        return out
+
+
+def open_history(path):
+    """Open a saved history lazily for reading, see class History."""
+    return History(path, mode='r')
@@ -19,103 +19,37 @@ https://github.com/gelman/ep-stan
 __all__ = ['Worker', 'Master']
 
 
+import os
 import sys
 import time
-import multiprocessing
+import shutil
+import pickle
+import warnings
+from multiprocessing.pool import ThreadPool
 import numpy as np
 from scipy import linalg
 
 # LAPACK qr routine
 dgeqrf_routine = linalg.get_lapack_funcs('geqrf')
 
+from .profiling import NULL_PROFILER
+from .backends import TiltedBackend, PyStanBackend
 from .util import (
-    invert_normal_params,
-    olse,
-    get_last_fit_sample,
-    load_stan,
-    copy_fit_samples,
-    stan_sample_time
-)
+    invert_normal_params, olse, olse_batch, tsqr, MomentAccumulator)
 
-from pystan.constants import MAX_UINT as pystan_max_uint
 
-
-def _sample_stan(queue, path, data, stan_params, other_params=None):
-    """Load and fit Stan model in a subprocess.
-
-    Implemented for multiprocesing.
-
-    Parameters
-    ----------
-    queue : multiprocessing.Queue
-        Queue into which the results are put (see Returns).
-
-    path : str
-        Path to the stan model.
-
-    data : dict
-        Data for the sampling.
-
-    stan_params : dict
-        Keyword arguments passed to the Stan.
-
-    other_params : sequence of str, optional
-        List of additional parameter names. If provided, the associated samples
-        are also returned.
-
-    Returns
-    -------
-    samps : ndarray
-        samples of phi
-
-    lastsamp : dict
-        the last sample of the chains for next iteration initialisation
-
-    duration : float
-        sampling time
-
-    msteps : float
-        mean stepsize
-
-    mrhat : float
-        max Rhat
-
-    other_samp : dict
-        additional requested samples (returned only if such are requested)
-
-    """
-    # Sample from the model
-    sm = load_stan(path)
-    fit, duration = stan_sample_time(sm, data=data, **stan_params)
-
-    # Extract samples
-    dphi = data['mu_phi'].shape[0]
-    samp = copy_fit_samples(fit, 'phi')
-
-    # Get the last sample of all
-    lastsamp = get_last_fit_sample(fit)
-
-    # Mean stepsize
-    msteps = np.mean([
-        np.mean(p['stepsize__'])
-        for p in fit.get_sampler_params()
-    ])
-    # Max Rhat (from all but last row in the last column)
-    mrhat = np.max(fit.summary()['summary'][:-1,-1])
-
-    # Returned values
-    ret = [samp, lastsamp, duration, msteps, mrhat]
-
-    # Extract other params
-    if other_params:
-        other_samp = {
-            par : fit.extract(pars=par)[par]
-            for par in other_params
-        }
-        ret.append(other_samp)
-
-    # Put returns into the queue
-    queue.put(ret)
+def _save_memmap(filename, arr):
+    """Write an array into a `.npy` file through a memory-mapped array."""
+    out = np.lib.format.open_memmap(
+        filename,
+        mode='w+',
+        dtype=arr.dtype,
+        shape=arr.shape,
+        fortran_order=arr.flags.f_contiguous and not arr.flags.c_contiguous
+    )
+    np.copyto(out, arr)
+    out.flush()
+    del out
 
 
 class Worker(object):
@@ -127,7 +61,8 @@ class Worker(object):
         The index of this site
 
     stan_model : StanModel or str
-        The StanModel instance responsible for the MCMC sampling.
+        The StanModel instance responsible for the MCMC sampling (see
+        backends.PyStanBackend). Not used if option `backend` is provided.
 
     dphi : int
         The length of the parameter vector phi.
@@ -145,9 +80,14 @@ class Worker(object):
     """
 
     DEFAULT_OPTIONS = {
+        'backend'         : None,
         'init_prev'       : True,
         'prec_estim'      : 'sample',
         'prec_estim_skip' : 0,
+        'profiler'        : None,
+        'qr_blocks'       : 1,
+        'stream_moments'  : True,
+        'tilted_estim'    : 'sample',
         'verbose'         : False
     }
 
@@ -162,8 +102,16 @@ class Worker(object):
     # Available values for option `prec_estim`
     PREC_ESTIM_OPTIONS = ('sample', 'olse')
 
+    # Available values for option `tilted_estim`
+    TILTED_ESTIM_OPTIONS = ('sample', 'laplace')
+
     RESERVED_STAN_PARAMETER_NAMES = ['X', 'y', 'N', 'D', 'mu_phi', 'Omega_phi']
 
+    # Minimum size n*d of the (n, d) sample matrix for the blocked QR
+    # decomposition with option `qr_blocks`, below which the overhead of the
+    # thread pool exceeds the gain
+    TSQR_MIN_SIZE = 400000
+
     def __init__(
             self, index, stan_model, dphi, X, y, A=None, **options):
 
@@ -204,6 +152,9 @@ class Worker(object):
         # indicates how many samples has contributed into the unnormalised
         # covariance matrix in self.Mat
         self.nsamp = None
+        # Indicates if the 'olse' estimate of the last tilted distribution is
+        # left to be finished with the method site_update_olse
+        self.olse_pending = False
 
         # Current iteration global approximations
         self.Q = None
@@ -229,13 +180,19 @@ class Worker(object):
         # Store other instance variables
         self.index = index
         self.stan_model = stan_model
+        if options['backend'] is None:
+            self.backend = PyStanBackend(stan_model)
+        else:
+            self.backend = options['backend']
         self.dphi = dphi
         self.iteration = 0
 
         # The last elapsed time
         self.last_time = None
+        self.last_warmup_time = None
         self.last_msteps = None
         self.last_mrhat = None
+        self.last_mess = None
 
         # The samples saved from the last fit
         self.saved_samples = None
@@ -260,6 +217,24 @@ class Worker(object):
         else:
             self.prec_estim_skip = 0
 
+        # Number of blocks in the QR decomposition of the samples
+        self.qr_blocks = options['qr_blocks']
+
+        # Use the moments of the samples accumulated in the backend instead of
+        # the sample matrix
+        self.stream_moments = options['stream_moments']
+
+        # Tilted distribution estimate method
+        self.tilted_estim = options['tilted_estim']
+        if not self.tilted_estim in self.TILTED_ESTIM_OPTIONS:
+            raise ValueError("Invalid value for option `tilted_estim`")
+
+        # Profiler for the stages
+        if options['profiler'] is None:
+            self.profiler = NULL_PROFILER
+        else:
+            self.profiler = options['profiler']
+
         # Verbose option
         self.verbose = options['verbose']
 
@@ -302,7 +277,8 @@ class Worker(object):
             return True
 
 
-    def tilted(self, dQi, dri, save_samples=None, seed=None):
+    def tilted(self, dQi, dri, save_samples=None, seed=None, stan_params=None,
+               prec_estim=None, tilted_estim=None, defer_olse=False):
         """Estimate the tilted distribution parameters.
 
         This method estimates the tilted distribution parameters and calculates
@@ -313,7 +289,9 @@ class Worker(object):
         After calling this method the instance variables self.Mat and self.vec
         hold the tilted distribution moment parameters (note however that the
         covariance matrix is unnormalised and the number of samples contributing
-        to this matrix is stored in the instance variable self.nsamp).
+        to this matrix is stored in the instance variable self.nsamp). With the
+        tilted estimate method 'laplace', self.Mat holds the precision matrix
+        and self.nsamp is None (see method site_update_laplace).
 
         Parameters
         ----------
@@ -325,7 +303,29 @@ class Worker(object):
             instance variable `saved_samples` (dict with {pname:samples}).
 
         seed : np.random.RandomState or int, optional
-            Seed for the Stan sampling
+            Seed for the sampling
+
+        stan_params : dict, optional
+            Stan parameters overriding the ones of the worker for this call
+            only, e.g. {'iter': 2000}.
+
+        prec_estim : {None, 'sample', 'olse'}, optional
+            Precision estimate method overriding the option `prec_estim` of the
+            worker for this call only. Option `prec_estim_skip` does not apply
+            if this is provided.
+
+        tilted_estim : {None, 'sample', 'laplace'}, optional
+            Tilted distribution estimate method overriding the option
+            `tilted_estim` of the worker for this call only. With 'laplace',
+            the tilted distribution is approximated with a normal distribution
+            at its mode (see method laplace of the backend) instead of sampling
+            from it.
+
+        defer_olse : bool, optional
+            If True and the precision estimate method of this call is 'olse',
+            only the moments of the samples are computed and the estimate is
+            left to be finished with the method site_update_olse, e.g. for all
+            the sites at once with util.olse_batch. Default is False.
 
         Returns
         -------
@@ -338,125 +338,108 @@ class Worker(object):
         if self.phase != 1:
             raise RuntimeError('Cavity has to be calculated before tilted.')
 
+        # Precision estimate method for this call
+        if prec_estim is None:
+            use_skip = self.prec_estim_skip > 0
+            prec_estim = 'sample' if use_skip else self.prec_estim
+        else:
+            if not prec_estim in self.PREC_ESTIM_OPTIONS:
+                raise ValueError("Invalid value for arg. `prec_estim`")
+            use_skip = False
+
+        # Stan parameters for this call
+        if stan_params is None:
+            stan_params = self.stan_params
+        else:
+            stan_params = dict(self.stan_params, **stan_params)
+
         # set next seed for the sampling
         if isinstance(seed, np.random.RandomState):
             rng = seed
         else:
             rng = np.random.RandomState(seed)
-        self.stan_params['seed'] = rng.randint(0, pystan_max_uint)
-
-        # Sample from the model
-        if isinstance(self.stan_model, str):
-            # run in a subprocess
-            q = multiprocessing.Queue()
-            args = [q, self.stan_model, self.data, self.stan_params]
-            if save_samples:
-                args.append(save_samples)
-            p = multiprocessing.Process(target=_sample_stan, args=args)
-            p.start()
-            if save_samples:
-                samp, lastsamp, dur, msteps, mrhat, saved_samp = q.get()
-                self.saved_samp = saved_samp
+        stan_params['seed'] = rng.randint(0, self.backend.MAX_SEED)
+
+        # Tilted distribution estimate method for this call
+        if tilted_estim is None:
+            tilted_estim = self.tilted_estim
+        elif not tilted_estim in self.TILTED_ESTIM_OPTIONS:
+            raise ValueError("Invalid value for arg. `tilted_estim`")
+
+        if tilted_estim == 'laplace':
+            # Normal approximation at the mode instead of sampling
+            start = time.time()
+            try:
+                with self.profiler.stage('laplace', site=self.index):
+                    mode, prec = self.backend.laplace(
+                        self.data,
+                        (self.vec, self.Mat),
+                        seed = stan_params['seed'],
+                        init = stan_params['init']
+                    )
+                    self.site_update_laplace(mode, prec, dQi, dri)
+            except NotImplementedError:
+                # Not a failure of the site but of the backend
+                raise
+            except (linalg.LinAlgError, RuntimeError):
+                # Mode not found or Hessian not negative definite
+                pos_def = False
+                self.phase = 0
+                dQi.fill(0)
+                dri.fill(0)
             else:
-                samp, lastsamp, dur, msteps, mrhat = q.get()
-            samp = np.copy(samp, order='F') # Needs to be copied for `owndata`
-            p.join()
+                pos_def = True
+                self.phase = 2
             # store info
-            self.last_time = dur
-            self.last_msteps = msteps
-            self.last_mrhat = mrhat
-
+            self.last_time = time.time() - start
+            self.last_warmup_time = 0.0
+            self.last_msteps = np.nan
+            self.last_mrhat = np.nan
+            self.last_mess = np.nan
+            if self.verbose:
+                print('\n   laplace runtime: {:.4}'.format(self.last_time))
+            self.iteration += 1
+            return pos_def
+
+        # Sample from the model, or only accumulate the moments of the samples
+        if self.stream_moments:
+            sample = self.backend.sample_moments
         else:
-            # run in the same process
-            fit, max_sampling_time = stan_sample_time(
-                self.stan_model, data=self.data, **self.stan_params)
-            time_start = timer()
-
-            # store info
-            # runtime
-            self.last_time = max_sampling_time
-            # mean stepsize
-            self.last_msteps = np.mean([
-                np.mean(p['stepsize__'])
-                for p in fit.get_sampler_params()
-            ])
-            # max Rhat (from all but last row in the last column)
-            self.last_mrhat = np.max(fit.summary()['summary'][:-1,-1])
-
-            # Extract samples
-            samp = copy_fit_samples(fit, 'phi')
-            lastsamp = get_last_fit_sample(fit)
-            if save_samples:
-                # Extract other params
-                self.saved_samp = {
-                    par : fit.extract(pars=par)[par]
-                    for par in save_samples
-                }
-
-            # Dereference the fit
-            fit = None
+            sample = self.backend.sample
+        with self.profiler.stage('backend', site=self.index):
+            samp, lastsamp, diag = sample(
+                self.data,
+                (self.vec, self.Mat),
+                stan_params['seed'],
+                init = stan_params['init'],
+                params = stan_params,
+                save_samples = save_samples,
+                profiler = self.profiler.bind(site=self.index)
+            )
+        if save_samples:
+            self.saved_samp = diag['samples']
+        # store info
+        self.last_time = diag['time']
+        self.last_warmup_time = diag['warmup_time']
+        self.last_msteps = diag['stepsize']
+        self.last_mrhat = diag['rhat']
+        self.last_mess = diag['ess']
 
         if self.verbose:
             print('\n   sampling runtime: {:.4}'.format(self.last_time))
             print('    mean stepsize: {:.4}'.format(self.last_msteps))
             print('    max Rhat: {:.4}'.format(self.last_mrhat))
+            print('    min n_eff: {:.4}'.format(self.last_mess))
 
-        if self.init_prev:
+        if self.init_prev and lastsamp is not None:
             # Store the last sample of each chain
             self.stan_params['init'] = lastsamp
 
-        self.nsamp = samp.shape[0]
-
         # Estimate precision matrix
+        start = time.time()
+        defer = defer_olse and prec_estim == 'olse'
         try:
-            # Basic sample estimate
-            if self.prec_estim == 'sample' or self.prec_estim_skip > 0:
-                # Mean
-                mt = np.mean(samp, axis=0, out=self.vec)
-                # Center samples
-                samp -= mt
-                # Use QR-decomposition for obtaining Cholesky of the scatter
-                # matrix (only R needed, Q-less algorithm would be nice)
-                _, _, _, info = dgeqrf_routine(samp, overwrite_a=True)
-                if info:
-                    raise linalg.LinAlgError(
-                        "dgeqrf LAPACK routine failed with error code {}"
-                        .format(info)
-                    )
-                # Copy the relevant part of the array into contiguous memory
-                np.copyto(self.Mat, samp[:self.dphi,:])
-                invert_normal_params(
-                    self.Mat, mt, out_A=dQi, out_b=dri,
-                    cho_form=True
-                )
-                # Unbiased (for normal distr.) natural parameter estimates
-                unbias_k = (self.nsamp - self.dphi - 2)
-                dQi *= unbias_k
-                dri *= unbias_k
-                if self.prec_estim_skip > 0:
-                    self.prec_estim_skip -= 1
-
-            # Optimal linear shrinkage estimate
-            elif self.prec_estim == 'olse':
-                # Mean
-                mt = np.mean(samp, axis=0, out=self.vec)
-                # Center samples
-                samp -= mt
-                # Sample covariance
-                np.dot(samp.T, samp, out=self.Mat.T)
-                # Normalise self.Mat into dQi
-                np.divide(self.Mat, self.nsamp, out=dQi)
-                # Estimate
-                olse(dQi, self.nsamp, P=self.Q, out='in-place')
-                np.dot(dQi, mt, out=dri)
-
-            else:
-                raise ValueError("Invalid value for option `prec_estim`")
-
-            # Calculate the difference into the output arrays
-            np.subtract(dQi, self.Q, out=dQi)
-            np.subtract(dri, self.r, out=dri)
-
+            self.site_update(samp, dQi, dri, prec_estim=prec_estim, defer=defer)
         except linalg.LinAlgError:
             # Precision estimate failed
             pos_def = False
@@ -465,26 +448,257 @@ class Worker(object):
             dri.fill(0)
             if self.init_prev:
                 # Reset initialisation method
-                self.init = self.init_orig
+                self.stan_params['init'] = self.init_orig
         else:
             # Set return and phase flag
             pos_def = True
             self.phase = 2
+            self.olse_pending = defer
+            if use_skip:
+                self.prec_estim_skip -= 1
+
+        self.profiler.record(
+            'prec_estim', start, time.time() - start, site=self.index,
+            method=prec_estim
+        )
 
         self.iteration += 1
         return pos_def
 
 
+    def site_update(self, samp, dQi, dri, prec_estim=None, defer=False):
+        """Estimate the site parameter updates from tilted distribution samples.
+
+        The tilted distribution natural parameters are estimated from the
+        samples and the current global approximation natural parameters are
+        subtracted from them. The cavity distribution has to be calculated
+        before this method is called.
+
+        The samples can be given as their moments accumulated in the backend
+        (see option `stream_moments`). With the precision estimate method
+        'sample', the Cholesky factor of the scatter matrix is then used in
+        place of the R factor of the QR decomposition of the centered samples.
+        The method 'olse' only needs the moments in any case.
+
+        Parameters
+        ----------
+        samp : ndarray or util.MomentAccumulator
+            The samples of phi of shape (nsamp, dphi) in F-order, or their
+            accumulated moments. An array may be overwritten.
+
+        dQi, dri : ndarray
+            Output arrays where the site parameter updates are placed.
+
+        prec_estim : {None, 'sample', 'olse'}, optional
+            Precision estimate method. By default, the option `prec_estim` of
+            the worker is used.
+
+        defer : bool, optional
+            If True with the method 'olse', only the sample mean and the
+            scatter matrix are computed into self.vec and self.Mat, and dQi and
+            dri are left untouched (see method site_update_olse). Default is
+            False.
+
+        Raises
+        ------
+        LinAlgError
+            If the estimate fails.
+
+        """
+        if prec_estim is None:
+            prec_estim = self.prec_estim
+        if isinstance(samp, MomentAccumulator):
+            moments = samp
+        elif prec_estim == 'olse':
+            # Only the moments are needed
+            moments = MomentAccumulator(self.dphi)
+            moments.add(samp)
+        else:
+            moments = None
+        if moments is not None:
+            self.nsamp = moments.n
+            mt = self.vec
+            np.copyto(mt, moments.mean)
+        else:
+            self.nsamp = samp.shape[0]
+
+        # Basic sample estimate
+        if prec_estim == 'sample':
+            if moments is not None:
+                # Cholesky of the scatter matrix
+                np.copyto(self.Mat, linalg.cholesky(
+                    moments.scatter, check_finite=False))
+            else:
+                # Mean
+                mt = np.mean(samp, axis=0, out=self.vec)
+                # Center samples
+                samp -= mt
+                # Use QR-decomposition for obtaining Cholesky of the scatter
+                # matrix (only R needed, Q-less algorithm would be nice)
+                if self.qr_blocks > 1 and samp.size >= self.TSQR_MIN_SIZE:
+                    # Blocked TSQR in parallel
+                    tsqr(samp, self.qr_blocks, out=self.Mat)
+                else:
+                    _, _, _, info = dgeqrf_routine(samp, overwrite_a=True)
+                    if info:
+                        raise linalg.LinAlgError(
+                            "dgeqrf LAPACK routine failed with error code {}"
+                            .format(info)
+                        )
+                    # Copy the relevant part of the array into contiguous
+                    # memory
+                    np.copyto(self.Mat, samp[:self.dphi,:])
+            invert_normal_params(
+                self.Mat, mt, out_A=dQi, out_b=dri,
+                cho_form=True
+            )
+            # Unbiased (for normal distr.) natural parameter estimates
+            unbias_k = (self.nsamp - self.dphi - 2)
+            dQi *= unbias_k
+            dri *= unbias_k
+
+        # Optimal linear shrinkage estimate
+        elif prec_estim == 'olse':
+            # Scatter matrix
+            np.copyto(self.Mat, moments.scatter)
+            if defer:
+                return
+            # Normalise self.Mat into dQi
+            np.divide(self.Mat, self.nsamp, out=dQi)
+            # Estimate
+            olse(dQi, self.nsamp, P=self.Q, out='in-place')
+            np.dot(dQi, mt, out=dri)
+
+        else:
+            raise ValueError("Invalid value for option `prec_estim`")
+
+        # Calculate the difference into the output arrays
+        np.subtract(dQi, self.Q, out=dQi)
+        np.subtract(dri, self.r, out=dri)
+
+
+    def site_update_olse(self, dQi, dri, prec=None):
+        """Finish a deferred 'olse' estimate of the site parameter updates.
+
+        The method tilted has to be called with `defer_olse` before this, so
+        that self.Mat and self.vec hold the tilted distribution moments.
+
+        Parameters
+        ----------
+        dQi, dri : ndarray
+            Output arrays where the site parameter updates are placed.
+
+        prec : ndarray, optional
+            The precision matrix estimate computed elsewhere, e.g. with
+            util.olse_batch for all the sites at once. By default, the estimate
+            is computed here with util.olse.
+
+        Returns
+        -------
+        pos_def
+            True if the estimate succeeded. False otherwise, in which case the
+            updates are set to zero.
+
+        """
+        if not self.olse_pending:
+            raise RuntimeError('No deferred olse estimate.')
+        self.olse_pending = False
+        if prec is None:
+            np.divide(self.Mat, self.nsamp, out=dQi)
+            try:
+                olse(dQi, self.nsamp, P=self.Q, out='in-place')
+            except linalg.LinAlgError:
+                # Precision estimate failed
+                self.phase = 0
+                dQi.fill(0)
+                dri.fill(0)
+                if self.init_prev:
+                    # Reset initialisation method
+                    self.stan_params['init'] = self.init_orig
+                return False
+        else:
+            np.copyto(dQi, prec)
+        np.dot(dQi, self.vec, out=dri)
+        # Calculate the difference into the output arrays
+        np.subtract(dQi, self.Q, out=dQi)
+        np.subtract(dri, self.r, out=dri)
+        return True
+
+
+    def site_update_laplace(self, mode, prec, dQi, dri):
+        """Site parameter updates from a normal approximation of the tilted.
+
+        The natural parameters of the normal approximation are formed from the
+        given mode and precision matrix, and the current global approximation
+        natural parameters are subtracted from them. The cavity distribution
+        has to be calculated before this method is called. After the call,
+        self.vec holds the mode and self.Mat the precision matrix.
+
+        Parameters
+        ----------
+        mode : ndarray
+            The mean of the approximation.
+
+        prec : ndarray
+            The precision matrix of the approximation.
+
+        dQi, dri : ndarray
+            Output arrays where the site parameter updates are placed.
+
+        """
+        np.subtract(prec, self.Q, out=dQi)
+        np.dot(prec, mode, out=dri)
+        np.subtract(dri, self.r, out=dri)
+        np.copyto(self.vec, mode)
+        np.copyto(self.Mat, prec)
+        self.nsamp = None
+
+
+    def get_state(self):
+        """Return the state of the worker needed for resuming the iterations.
+
+        Returns
+        -------
+        state : dict
+            The state of the worker, see method `set_state`.
+
+        """
+        return dict(
+            index = self.index,
+            iteration = self.iteration,
+            init = self.stan_params['init'],
+            prec_estim_skip = self.prec_estim_skip
+        )
+
+
+    def set_state(self, state):
+        """Restore the state obtained from the method `get_state`.
+
+        Parameters
+        ----------
+        state : dict
+            The state of the worker.
+
+        """
+        if state['index'] != self.index:
+            raise ValueError("The state does not belong to site {}"
+                             .format(self.index))
+        self.iteration = state['iteration']
+        self.stan_params['init'] = state['init']
+        self.prec_estim_skip = state['prec_estim_skip']
+
+
 class Master(object):
     """Manages the distributed EP algorithm.
 
     Parameters
     ----------
-    site_model : StanModel or string
+    site_model : StanModel or string or None
         Model for sampling from the tilted distribution of a site. Can be
         provided either directly as a PyStan model instance or as filename
         string pointing to a pickled model or stan source code. The model has a
-        restricted structure (see Notes).
+        restricted structure (see Notes). Can be None if option `backend` is
+        provided.
 
     X : ndarray
         Explanatory variable data in an ndarray of shape (N,D), where N is the
@@ -548,10 +762,22 @@ class Master(object):
 
     Other parameters
     ----------------
-    init_site : scalar or ndarray, optional
+    init_site : scalar or ndarray or 'laplace', optional
         The initial site precision matrix. If not provided, improper uniform
         N(0,inf I), i.e. Q is allzeroes, is used. If scalar, N(0,A^2/K I),
-        where A = `init_site`, is used.
+        where A = `init_site`, is used. If 'laplace', the initial site
+        parameters are formed from the Laplace approximation of the likelihood
+        of each site (see method laplace of the backend) with the prior
+        divided evenly among the sites as the cavity distribution. The sites
+        whose approximation fails are initialised to zero and a warning is
+        issued. A RuntimeError is raised if every site fails. The backend has
+        to implement method laplace.
+
+    init_site_threads : int, optional
+        Number of threads processing the sites in parallel with `init_site`
+        'laplace'. By default, the number of CPUs is used. Not used if the
+        backend is not thread-safe, e.g. with the default PyStan backend, in
+        which case the sites are processed serially.
 
     overwrite_model : bool, optional
         If a string for `site_model` is provided, the model is compiled even
@@ -610,10 +836,103 @@ class Master(object):
         The treshold value for the damping factor. If the damping factor decays
         below this value, the algorithm is stopped. Default is 1e-6.
 
+    max_recoveries : int, optional
+        The maximum number of recoveries in one iteration when the damping
+        factor has decayed below `df_treshold` even after forcing the sites
+        positive definite. In a recovery, the site parameters are rolled back to
+        the ones in the beginning of the iteration and the offending sites are
+        resampled with `recov_iter_mult` times more draws and with precision
+        estimate method `recov_prec_estim` before continuing the damping.
+        The total number of recoveries is stored in the attribute `recoveries`.
+        Default is 0, i.e. the algorithm is stopped instead.
+
+    batch_olse : bool, optional
+        If True, the 'olse' precision estimates of the tilted distributions are
+        computed in the master for all the sites at once with util.olse_batch
+        after the tilted distribution moments have been collected from the
+        workers, instead of each worker estimating its own. Default is False.
+
+    qr_blocks : int, optional
+        Number of row blocks, e.g. the number of chains, in the QR
+        decomposition of the tilted samples with the precision estimate method
+        'sample'. With more than one block, the blocks are decomposed in
+        parallel threads and their R factors are combined (see util.tsqr).
+        The blocks are used only if the number of elements n*d of the
+        samples is at least Worker.TSQR_MIN_SIZE (4e5); for smaller samples
+        the fixed cost of the thread pool (about 1.5 ms) exceeds the cost of
+        one LAPACK QR decomposition (e.g. 0.1 ms for 1000 samples of 10
+        parameters). Above this, the blocked decomposition is faster also on
+        a single core owing to the cache-sized blocks. Used only if
+        `stream_moments` is False. Default is 1.
+
+    stream_moments : bool, optional
+        If True, the backends accumulate the mean and the scatter matrix of
+        the tilted samples one chain or chunk at a time (see method
+        sample_moments of the backend and util.MomentAccumulator), so that
+        the whole sample matrix of a site is not held in the memory, nor
+        transferred from the sampling subprocess of PyStanBackend. The
+        precision estimate method 'sample' then uses the Cholesky factor of
+        the scatter matrix instead of the QR decomposition of the samples.
+        If False, the sample matrix is returned from the backend, and the QR
+        decomposition, which is numerically more robust for nearly singular
+        samples, is used. N.B. GaussianBackend draws different samples with
+        the same seed depending on this option. Default is True.
+
+    recov_iter_mult : int, optional
+        Multiplier for the Stan iterations in the recovery resampling. Default
+        is 2.
+
+    recov_prec_estim : {None, 'sample', 'olse'}, optional
+        Precision estimate method in the recovery resampling. Providing None
+        uses the option `prec_estim`. Default is 'olse', which provides a
+        shrinkage estimate.
+
+    tilted_estim : {'sample', 'laplace'}, optional
+        Tilted distribution estimate method. With 'sample', the moments of the
+        tilted distributions are estimated from the samples drawn with the
+        backend. With 'laplace', the tilted distributions are approximated
+        with a normal distribution at their mode, where the precision is given
+        by the negative Hessian of the log density (see method laplace of the
+        backend), which is much faster but exact only for normal tilted
+        distributions. The backend has to implement method laplace also with
+        options `laplace_iters` and `laplace_sites` (see
+        TiltedBackend.has_laplace). Default is 'sample'.
+
+    laplace_iters : int, optional
+        Number of the first iterations in which the tilted estimate method
+        'laplace' is used for all the sites before switching to option
+        `tilted_estim`. Default is 0.
+
+    laplace_sites : sequence of int, optional
+        Indices of the sites (e.g. ones known to have nearly normal tilted
+        distributions), for which the tilted estimate method 'laplace' is
+        always used. The recovery resampling uses always sampling.
+
+    backend : backends.TiltedBackend, optional
+        Backend for sampling the tilted distributions instead of `site_model`,
+        e.g. a compiled CmdStan executable (backends.CmdStanBackend) or one of
+        the Stan-free NumPy backends for synthetic models (see module
+        epstan.backends). The same instance is shared by all the sites. By
+        default, `site_model` is sampled with backends.PyStanBackend.
+
+    profiler : profiling.Profiler, optional
+        Profiler into which the durations of the stages of the iterations are
+        recorded, e.g. the sampling stages of each site, the precision
+        estimates, and the damping and cavity loops (see module
+        epstan.profiling). By default, nothing is recorded.
+
     Notes
     -----
     TODO: Describe the structure of the site model.
 
+    The sampling seeds of the sites are drawn from the random state of the
+    master at the start of each iteration (see method iterate), in the same
+    order as when all of them were drawn at the start of method run, so that a
+    given `seed` reproduces the seeds of the earlier versions. The resampling
+    of the recovery (option `max_recoveries`) draws its seeds from the same
+    stream after the ones of the iteration, and thus changes the seeds of the
+    subsequent iterations.
+
     """
 
     # Return codes for method run
@@ -627,6 +946,29 @@ class Master(object):
     MIN_EIG_TRESHOLD = 1e-5
     MIN_EIG = 0.5
 
+    # Version of the checkpoint format (see method save_checkpoint)
+    CHECKPOINT_VERSION = 1
+
+    # Available convergence criteria for method run
+    CONV_CRITERIA = ('kl', 'mean', 'update')
+
+    # Per-site telemetry recorded in each iteration (see attribute telemetry)
+    TELEMETRY_DTYPE = np.dtype([
+        ('iter',         np.int32),
+        ('site',         np.int32),
+        ('time',         np.float64),
+        ('warmup_time',  np.float64),
+        ('stepsize',     np.float64),
+        ('rhat',         np.float64),
+        ('ess',          np.float64),
+        ('tilted_ok',    np.bool_),
+        ('cavity_ok',    np.bool_),
+        ('damp_retries', np.int32),
+        ('forced',       np.bool_),
+        ('resampled',    np.bool_),
+        ('laplace',      np.bool_)
+    ])
+
     # List of constructor default keyword arguments
     DEFAULT_KWARGS = dict(
         A                 = {},
@@ -638,9 +980,16 @@ class Master(object):
         dphi              = None,
         prior             = None,
         init_site         = None,
+        init_site_threads = None,
         df0               = None,
         df_decay          = 0.8,
         df_treshold       = 1e-6,
+        max_recoveries    = 0,
+        recov_iter_mult   = 2,
+        recov_prec_estim  = 'olse',
+        laplace_iters     = 0,
+        laplace_sites     = None,
+        batch_olse        = False,
         overwrite_model   = False
     )
 
@@ -813,6 +1162,37 @@ class Master(object):
             # Use provided initial damping factor function
             self.df0 = kwargs['df0']
 
+        # Recovery
+        self.max_recoveries = kwargs['max_recoveries']
+        self.recov_iter_mult = kwargs['recov_iter_mult']
+        self.recov_prec_estim = kwargs['recov_prec_estim']
+        if (    self.recov_prec_estim is not None
+             and self.recov_prec_estim not in Worker.PREC_ESTIM_OPTIONS
+           ):
+            raise ValueError("Invalid value for arg. `recov_prec_estim`")
+        # Total number of recoveries
+        self.recoveries = 0
+
+        # Sites estimated with the tilted estimate method 'laplace'
+        self.laplace_iters = kwargs['laplace_iters']
+        self.laplace_sites = np.zeros(self.K, dtype=bool)
+        if kwargs['laplace_sites'] is not None:
+            self.laplace_sites[kwargs['laplace_sites']] = True
+
+        # Batched olse precision estimates in the master
+        self.batch_olse = kwargs['batch_olse']
+
+        # Profiler for the stages of the iterations (shared with the workers)
+        if self.worker_options['profiler'] is None:
+            self.profiler = NULL_PROFILER
+        else:
+            self.profiler = self.worker_options['profiler']
+
+        # Share one backend among the workers so that the model is loaded only
+        # once in this process
+        if self.worker_options['backend'] is None:
+            self.worker_options['backend'] = PyStanBackend(self.site_model)
+
         # Initialise the workers
         self.workers = []
         for k in range(self.K):
@@ -850,7 +1230,21 @@ class Master(object):
         self.dQi = np.zeros((self.dphi,self.dphi,self.K), order='F')
         self.dri = np.zeros((self.dphi,self.K), order='F')
 
-        if not kwargs['init_site'] is None:
+        # The tilted estimate method 'laplace' requires the backend support
+        if (    self.worker_options['tilted_estim'] == 'laplace'
+             or self.laplace_iters > 0
+             or np.any(self.laplace_sites)
+           ):
+            self._check_laplace_support(
+                "the tilted estimate method 'laplace'")
+
+        if isinstance(kwargs['init_site'], str):
+            if kwargs['init_site'] != 'laplace':
+                raise ValueError("Invalid value for arg. `init_site`")
+            self._check_laplace_support("init_site 'laplace'")
+            with self.profiler.stage('init_site'):
+                self._init_site_laplace(kwargs['init_site_threads'])
+        elif not kwargs['init_site'] is None:
             # Config initial site distributions
             if isinstance(kwargs['init_site'], np.ndarray):
                 for k in range(self.K):
@@ -863,6 +1257,15 @@ class Master(object):
         # Track iterations
         self.iter = 0
 
+        # Random state for the sampling seeds, set in the method run
+        self.rng = None
+
+        # The convergence criterion which stopped the last run
+        self.converged = None
+
+        # Per-site telemetry rows of each iteration
+        self._telemetry = []
+
         # Initial global approximation
         np.add(self.Qi.sum(axis=-1, out=self.Q), self.Q0, out=self.Q)
         np.add(self.ri.sum(axis=-1, out=self.r), self.r0, out=self.r)
@@ -881,6 +1284,68 @@ class Master(object):
             if not pos_def:
                 raise ValueError("Initial cavity is not pos.def.")
 
+    def _check_laplace_support(self, usage):
+        """Raise ValueError if a backend does not implement method laplace."""
+        for worker in self.workers:
+            if not worker.backend.has_laplace():
+                raise ValueError(
+                    "The backend {} does not implement method laplace "
+                    "required by {}".format(
+                        type(worker.backend).__name__, usage)
+                )
+
+    def _init_site_laplace(self, threads=None):
+        """Initialise the sites with the Laplace approximations.
+
+        The site parameters are set to the difference of the Laplace
+        approximation of the tilted distribution and the cavity distribution,
+        where the cavity of each site is the prior divided by K. The sites are
+        processed in parallel with a thread pool if the backend is thread-safe
+        (see TiltedBackend.THREAD_SAFE) and serially otherwise. The sites
+        whose approximation fails are set to zero with a warning. Raises
+        RuntimeError if every site fails.
+
+        """
+        Qc = np.asfortranarray(self.Q0 / self.K)
+        rc = self.r0 / self.K
+        zeros_Q = np.zeros((self.dphi,self.dphi), order='F')
+        zeros_r = np.zeros(self.dphi)
+
+        def init_site(k):
+            worker = self.workers[k]
+            if not worker.cavity(Qc, rc, zeros_Q, zeros_r):
+                return False
+            # Deterministic seed for the possible optimisation
+            return worker.tilted(
+                self.Qi[:,:,k], self.ri[:,k], seed=k, tilted_estim='laplace')
+
+        if threads is None:
+            threads = os.cpu_count() or 1
+        threads = min(threads, self.K)
+        if not all(worker.backend.THREAD_SAFE for worker in self.workers):
+            threads = 1
+        if threads > 1:
+            with ThreadPool(threads) as pool:
+                ok = pool.map(init_site, range(self.K))
+        else:
+            ok = [init_site(k) for k in range(self.K)]
+        failed = np.nonzero(np.logical_not(ok))[0]
+        if len(failed) == self.K:
+            raise RuntimeError(
+                "Laplace approximation failed in every site, cannot "
+                "initialise the sites with `init_site` 'laplace'"
+            )
+        if len(failed) > 0:
+            warnings.warn(
+                "Laplace approximation failed in {} of {} sites, sites {} are "
+                "initialised to zero".format(
+                    len(failed), self.K, failed.tolist())
+            )
+        for k in failed:
+            self.Qi[:,:,k] = 0.0
+            self.ri[:,k] = 0.0
+
+
     def cur_approx(self):
         """Returns the current marginal posterior approximation moments.
 
@@ -896,8 +1361,228 @@ class Master(object):
         return invert_normal_params(self.Q, self.r)
 
 
+    @property
+    def telemetry(self):
+        """Per-site telemetry of all the iterations.
+
+        Structured array of shape (niter, K) with fields:
+            'iter'         : index of the iteration
+            'site'         : index of the site
+            'time'         : sampling time, including the possible recovery
+            'warmup_time'  : warm-up part of the sampling time
+            'stepsize'     : mean stepsize
+            'rhat'         : max Rhat
+            'ess'          : min effective sample size
+            'tilted_ok'    : success of the tilted distribution estimate
+            'cavity_ok'    : positive definiteness of the last checked cavity
+                             distribution in the iteration
+            'damp_retries' : number of damping factor reductions caused by the
+                             cavity distribution of the site
+            'forced'       : site forced positive definite
+            'resampled'    : site resampled in a recovery
+        See also method save_telemetry.
+
+        """
+        if not self._telemetry:
+            return np.zeros((0, self.K), dtype=self.TELEMETRY_DTYPE)
+        return np.stack(self._telemetry)
+
+
+    def save_telemetry(self, filename):
+        """Save the per-site telemetry into a `.npy` file.
+
+        The saved structured array can be read with np.load, see attribute
+        telemetry.
+
+        """
+        np.save(filename, self.telemetry)
+
+
+    def _store_telemetry(self, tele, k):
+        """Store the sampling diagnostics of the last tilted of site `k`."""
+        worker = self.workers[k]
+        for field, val in (
+                ('time',        worker.last_time),
+                ('warmup_time', worker.last_warmup_time),
+                ('stepsize',    worker.last_msteps),
+                ('rhat',        worker.last_mrhat),
+                ('ess',         worker.last_mess)):
+            tele[field][k] = np.nan if val is None else val
+
+
+    def _batch_olse(self, dQi, dri, posdefs):
+        """Finish the deferred olse estimates of the sites at once.
+
+        The sample covariance matrices of the sites with a pending estimate are
+        stacked and estimated with util.olse_batch. If the batch fails, the
+        sites are estimated one by one so that only the failing ones are
+        discarded. The array `posdefs` is updated accordingly.
+
+        """
+        sites = [k for k in range(self.K)
+                 if posdefs[k] and self.workers[k].olse_pending]
+        if not sites:
+            return
+        start = time.time()
+        S = np.empty((len(sites), self.dphi, self.dphi))
+        n = np.empty(len(sites))
+        for i, k in enumerate(sites):
+            worker = self.workers[k]
+            n[i] = worker.nsamp
+            np.divide(worker.Mat, n[i], out=S[i])
+        try:
+            prec = olse_batch(S, n, P=self.Q, out=S)
+        except linalg.LinAlgError:
+            # Some of the sites failed, estimate separately
+            for k in sites:
+                posdefs[k] = self.workers[k].site_update_olse(
+                    dQi[:,:,k], dri[:,k])
+        else:
+            for i, k in enumerate(sites):
+                self.workers[k].site_update_olse(
+                    dQi[:,:,k], dri[:,k], prec=prec[i])
+        self.profiler.record(
+            'prec_estim', start, time.time() - start, method='olse_batch',
+            sites=len(sites)
+        )
+
+
+    def save_checkpoint(self, path):
+        """Save the current state of the algorithm into a checkpoint.
+
+        The checkpoint is a directory containing the site parameters in
+        `.npy` files and the rest of the state (iteration counter, random state
+        and the states of the workers) in a pickle file. The site parameter
+        arrays are written through memory-mapped files so that the possibly
+        large arrays are not copied. The checkpoint is first written into a
+        temporary directory, which then replaces the old checkpoint, so that an
+        interrupted write does not corrupt the existing checkpoint.
+
+        Parameters
+        ----------
+        path : str
+            Path of the checkpoint directory.
+
+        """
+        path = os.path.abspath(path)
+        path_tmp = path + '.tmp'
+        path_old = path + '.old'
+        if os.path.exists(path_tmp):
+            shutil.rmtree(path_tmp)
+        os.makedirs(path_tmp)
+        # Site parameters
+        _save_memmap(os.path.join(path_tmp, 'Qi.npy'), self.Qi)
+        _save_memmap(os.path.join(path_tmp, 'ri.npy'), self.ri)
+        np.save(os.path.join(path_tmp, 'telemetry.npy'), self.telemetry)
+        # Other state
+        state = dict(
+            version = self.CHECKPOINT_VERSION,
+            K = self.K,
+            dphi = self.dphi,
+            iter = self.iter,
+            rng_state = self.rng.get_state() if self.rng is not None else None,
+            workers = [worker.get_state() for worker in self.workers]
+        )
+        with open(os.path.join(path_tmp, 'state.pkl'), 'wb') as f:
+            pickle.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        # Replace the old checkpoint
+        if os.path.exists(path):
+            if os.path.exists(path_old):
+                shutil.rmtree(path_old)
+            os.rename(path, path_old)
+            os.rename(path_tmp, path)
+            shutil.rmtree(path_old)
+        else:
+            os.rename(path_tmp, path)
+
+
+    def load_checkpoint(self, path):
+        """Restore the state of the algorithm from a checkpoint.
+
+        The master has to be constructed with the same data and options as the
+        one which saved the checkpoint (see method save_checkpoint). After
+        restoring, the method run continues from the saved iteration with the
+        saved random state.
+
+        Parameters
+        ----------
+        path : str
+            Path of the checkpoint directory.
+
+        """
+        path = os.path.abspath(path)
+        if not os.path.exists(path) and os.path.exists(path + '.old'):
+            # Interrupted while replacing the old checkpoint
+            path = path + '.old'
+        with open(os.path.join(path, 'state.pkl'), 'rb') as f:
+            state = pickle.load(f)
+        if state['version'] != self.CHECKPOINT_VERSION:
+            raise ValueError("Unsupported checkpoint version {}"
+                             .format(state['version']))
+        if state['K'] != self.K or state['dphi'] != self.dphi:
+            raise ValueError("The checkpoint does not match with the master")
+        # Site parameters
+        np.copyto(self.Qi, np.load(os.path.join(path, 'Qi.npy'), mmap_mode='r'))
+        np.copyto(self.ri, np.load(os.path.join(path, 'ri.npy'), mmap_mode='r'))
+        if os.path.exists(os.path.join(path, 'telemetry.npy')):
+            saved = np.load(os.path.join(path, 'telemetry.npy'))
+            # Fields missing from older checkpoints are left zero
+            telemetry = np.zeros(saved.shape, dtype=self.TELEMETRY_DTYPE)
+            for name in saved.dtype.names:
+                if name in self.TELEMETRY_DTYPE.names:
+                    telemetry[name] = saved[name]
+            self._telemetry = list(telemetry)
+        # Other state
+        self.iter = state['iter']
+        if state['rng_state'] is not None:
+            self.rng = np.random.RandomState()
+            self.rng.set_state(state['rng_state'])
+        else:
+            self.rng = None
+        for worker, worker_state in zip(self.workers, state['workers']):
+            worker.set_state(worker_state)
+        # Global approximation
+        np.add(self.Qi.sum(axis=-1, out=self.Q), self.Q0, out=self.Q)
+        np.add(self.ri.sum(axis=-1, out=self.r), self.r0, out=self.r)
+        # Cavities
+        for k, worker in enumerate(self.workers):
+            if not worker.cavity(self.Q, self.r, self.Qi[:,:,k], self.ri[:,k]):
+                raise ValueError("Restored cavity is not pos.def.")
+
+
+    @classmethod
+    def from_checkpoint(cls, path, site_model, X, y, **kwargs):
+        """Construct a master and restore its state from a checkpoint.
+
+        Parameters
+        ----------
+        path : str
+            Path of the checkpoint directory.
+
+        site_model, X, y, **kwargs
+            The arguments for the constructor. These should be the same as the
+            ones used for the master which saved the checkpoint. The option
+            `init_site` is ignored as the sites are restored from the
+            checkpoint.
+
+        Returns
+        -------
+        master : Master
+            The restored master.
+
+        """
+        # Skip the possibly expensive site initialisation
+        kwargs = dict(kwargs, init_site=None)
+        master = cls(site_model, X, y, **kwargs)
+        master.load_checkpoint(path)
+        return master
+
+
     def run(self, niter, calc_moments=True, save_last_param=None, verbose=True,
-            return_analytics=False, seed=None):
+            return_analytics=False, seed=None, checkpoint_path=None,
+            checkpoint_every=1, tol=None, patience=1, history=None):
         """Run the distributed EP algorithm.
 
         Parameters
@@ -922,8 +1607,50 @@ class Master(object):
             iteration is returned. Default is False.
 
         seed : {None, int, RandomState}, optional
-            The random seed used in the sampling. If not provided, a random seed
-            is used.
+            The random seed used in the sampling. If not provided, the random
+            state of the previous run (or the one restored from a checkpoint)
+            is continued, or a random seed is used if there is no such state.
+            N.B. earlier versions used a new random seed in each run if not
+            provided. See also Notes of the class.
+
+        checkpoint_path : str, optional
+            If provided, the state of the algorithm is saved into this
+            checkpoint directory every `checkpoint_every` iterations and after
+            the last iteration (see method save_checkpoint).
+
+        checkpoint_every : int, optional
+            Interval of the iterations between the checkpoints. Default is 1.
+
+        tol : {None, float, dict}, optional
+            Tolerance for the convergence criteria. If provided, the iterations
+            are stopped early when any of the criteria stays below its
+            tolerance for `patience` consecutive iterations. The name of the
+            criterion is then stored in the attribute `converged` and the
+            returned arrays contain only the run iterations. Providing a float
+            uses it as the tolerance of the criterion 'kl' only. Providing a
+            dict {criterion: tolerance} uses the given criteria, any of which
+            stops the iterations, and thus loose tolerances should not be
+            combined. N.B. the criterion 'update' is scaled by the damping
+            factor and is thus small also for unconverged runs with heavy
+            damping. The available criteria are:
+                'kl'     : KL-divergence from the previous global approximation
+                           to the current one
+                'mean'   : relative change of the mean of the global
+                           approximation
+                'update' : Frobenius norm of the damped site precision updates
+                           relative to the norm of the global precision
+            By default, all `niter` iterations are run.
+
+        patience : int, optional
+            Number of consecutive iterations a criterion has to stay below its
+            tolerance for stopping. Default is 1.
+
+        history : History, optional
+            If provided, the moments of the posterior approximation and the
+            analytics of each iteration are appended into this on-disk history
+            (see module epstan.history) as the iterations proceed. Combined
+            with `calc_moments` False, the history of the iterations is not
+            kept in the memory.
 
         Returns
         -------
@@ -939,6 +1666,11 @@ class Master(object):
             non-sampling for each iteration. Returned only if
             `return_analytics` is True.
 
+        See also
+        --------
+        iterate : Iterate the algorithm one iteration at a time without
+            storing the history of the iterations.
+
         """
         if niter < 1:
             if verbose:
@@ -952,12 +1684,191 @@ class Master(object):
                 out.append((None, None, None))
             return out if len(out) > 1 else out[0]
 
-        # Get seeds for sampling in workers for each iteration
+        # Convergence criteria
+        self.converged = None
+        if tol is not None:
+            if isinstance(tol, dict):
+                for crit in tol:
+                    if crit not in self.CONV_CRITERIA:
+                        raise ValueError("Invalid convergence criterion {}"
+                                         .format(crit))
+                tol = dict(tol)
+            else:
+                tol = {'kl': tol}
+            # Number of consecutive iterations below the tolerance
+            conv_counts = dict((crit, 0) for crit in tol)
+
+        if calc_moments:
+            # Allocate memory for results
+            m_phi_s = np.zeros((niter, self.dphi))
+            cov_phi_s = np.zeros((niter, self.dphi, self.dphi))
+
+        # monitor sampling times, mean stepsizes, and max rhats, and other times
+        stimes = np.zeros(niter)
+        msteps = np.zeros(niter)
+        mrhats = np.zeros(niter)
+        othertimes = np.zeros(niter)
+
+        info = self.INFO_OK
+        iterations = self.iterate(
+            niter,
+            calc_moments = calc_moments or history is not None,
+            calc_cov = calc_moments or (history is not None and history.cov),
+            save_last_param = save_last_param,
+            seed = seed,
+            calc_conv = tol is not None,
+            verbose = verbose
+        )
+        for cur_iter, rec in enumerate(iterations):
+            # Store the analytics
+            if rec['stime'] is not None:
+                stimes[cur_iter] = rec['stime']
+                msteps[cur_iter] = rec['mstep']
+                mrhats[cur_iter] = rec['mrhat']
+            if rec['info'] != self.INFO_OK:
+                info = rec['info']
+                break
+            othertimes[cur_iter] = rec['othertime']
+            if history is not None:
+                history.append_record(rec)
+            if calc_moments:
+                np.copyto(m_phi_s[cur_iter], rec['m'])
+                np.copyto(cov_phi_s[cur_iter], rec['S'])
+
+            if tol is not None:
+                conv_stats = rec['conv']
+                for crit in tol:
+                    if conv_stats[crit] < tol[crit]:
+                        conv_counts[crit] += 1
+                        if (    conv_counts[crit] >= patience
+                             and self.converged is None
+                           ):
+                            self.converged = crit
+                    else:
+                        conv_counts[crit] = 0
+
+            # Save checkpoint
+            if checkpoint_path and (
+                    self.iter % checkpoint_every == 0 or cur_iter == niter-1):
+                self.save_checkpoint(checkpoint_path)
+                if verbose:
+                    print("Checkpoint saved into {}".format(checkpoint_path))
+
+            if self.converged is not None:
+                # Stop early
+                if checkpoint_path and self.iter % checkpoint_every != 0:
+                    self.save_checkpoint(checkpoint_path)
+                if verbose:
+                    print("Converged by criterion {}".format(self.converged))
+                niter = cur_iter + 1
+                if calc_moments:
+                    m_phi_s = m_phi_s[:niter]
+                    cov_phi_s = cov_phi_s[:niter]
+                stimes = stimes[:niter]
+                msteps = msteps[:niter]
+                mrhats = mrhats[:niter]
+                othertimes = othertimes[:niter]
+                break
+
+        if verbose and info == self.INFO_OK:
+            print(
+                "{} iterations done\nTotal limiting sampling time: {}"
+                .format(niter, stimes.sum())
+            )
+            if self.recoveries:
+                print("Total recoveries: {}".format(self.recoveries))
+
+        # return with desired args
+        out = [info]
+        if calc_moments:
+            out.append((m_phi_s, cov_phi_s))
+        if return_analytics:
+            out.append((stimes, msteps, mrhats, othertimes))
+        return tuple(out) if len(out) > 1 else out[0]
+
+
+    def iterate(self, niter=None, calc_moments=True, calc_cov=True,
+                save_last_param=None, seed=None, calc_conv=False,
+                verbose=False):
+        """Iterate the distributed EP algorithm one iteration at a time.
+
+        A generator yielding a record of each iteration after the iteration is
+        done. Unlike in method `run`, the history of the iterations is not
+        stored, so that the records can be e.g. streamed to disk or plotted
+        while iterating. The iterations can be stopped early by simply not
+        consuming the generator further, after which the state of the object is
+        consistent with the last yielded iteration.
+
+        Parameters
+        ----------
+        niter : int, optional
+            Maximum number of iterations to run. By default, the iterations are
+            continued as long as the generator is consumed.
+
+        calc_moments : bool, optional
+            If True, the mean of the posterior approximation is calculated and
+            included in the records. Default is True.
+
+        calc_cov : bool, optional
+            If True and `calc_moments` is True, the covariance of the posterior
+            approximation is also included in the records. Default is True.
+
+        save_last_param : sequence of str
+            If provided, the last fit samples of the given parameters are saved
+            in every iteration.
+
+        seed : {None, int, RandomState}, optional
+            The random seed used in the sampling, see method `run`.
+
+        calc_conv : bool, optional
+            If True, the convergence criteria listed in Master.CONV_CRITERIA
+            are calculated and included in the records. Default is False.
+
+        verbose : bool, optional
+            If true, some progress information is printed. Default is False.
+
+        Yields
+        ------
+        record : dict
+            Information of the iteration with the following keys:
+                'iter'       : index of the iteration (attribute `iter`)
+                'info'       : return code, see variables Master.INFO_*; if
+                               not zero, the iteration failed, the state of
+                               the object is not updated, and this is the
+                               last record
+                'm', 'S'     : mean and covariance of the posterior
+                               approximation, or None if not calculated
+                'df'         : the damping factor used
+                'stime'      : limiting sampling time, including the possible
+                               recoveries
+                'mstep'      : max of the mean stepsizes of the sites
+                'mrhat'      : max of the max Rhats of the sites
+                'othertime'  : time used for non-sampling
+                'site_times', 'site_msteps', 'site_mrhats' :
+                               sampling time, mean stepsize and max Rhat of
+                               each site
+                'site_ok'    : success of the tilted distribution of each site
+                'recoveries' : number of recoveries in the iteration
+                'telemetry'  : per-site telemetry of the iteration, a row of
+                               the attribute `telemetry`
+                'conv'       : values of the convergence criteria, or None if
+                               not calculated
+
+        """
+        # Random state for the seeds of the sampling in workers
         if isinstance(seed, np.random.RandomState):
-            rng = seed
-        else:
-            rng = np.random.RandomState(seed=seed)
-        seeds = rng.randint(0, pystan_max_uint, size=(niter, self.K))
+            self.rng = seed
+        elif seed is not None or self.rng is None:
+            self.rng = np.random.RandomState(seed=seed)
+
+        if calc_conv:
+            # The previous global approximation
+            cho = linalg.cho_factor(self.Q)
+            conv_prev = dict(
+                Q = self.Q.copy(order='F'),
+                m = linalg.cho_solve(cho, self.r),
+                ldet = np.sum(np.log(np.diag(cho[0])))
+            )
 
         # Localise some instance variables
         # Mean and cov of the posterior approximation
@@ -966,12 +1877,6 @@ class Master(object):
         # Natural parameters of the approximation
         Q = self.Q
         r = self.r
-        # Natural site parameters
-        Qi = self.Qi
-        ri = self.ri
-        # Natural site proposal parameters
-        Qi2 = self.Qi2
-        ri2 = self.ri2
         # Site parameter updates
         dQi = self.dQi
         dri = self.dri
@@ -979,21 +1884,63 @@ class Master(object):
         # Array for positive definitness checking of each cavity distribution
         posdefs = np.empty(self.K, dtype=bool)
 
-        if calc_moments:
-            # Allocate memory for results
-            m_phi_s = np.zeros((niter, self.dphi))
-            cov_phi_s = np.zeros((niter, self.dphi, self.dphi))
-
-        # monitor sampling times, mean stepsizes, and max rhats, and other times
-        stimes = np.zeros(niter)
-        msteps = np.zeros(niter)
-        mrhats = np.zeros(niter)
-        othertimes = np.zeros(niter)
+        if self.max_recoveries > 0:
+            # Snapshot of the site parameters in the beginning of the iteration
+            Qi_snap = np.empty_like(self.Qi, order='F')
+            ri_snap = np.empty_like(self.ri, order='F')
+            # Sites causing the damping factor to decay
+            offending = np.empty(self.K, dtype=bool)
 
         # Iterate niter rounds
-        for cur_iter in range(niter):
+        cur_iter = 0
+        while niter is None or cur_iter < niter:
+            cur_iter += 1
             self.iter += 1
 
+            # Natural site parameters and site proposal parameters (these are
+            # switched in the damping)
+            Qi = self.Qi
+            ri = self.ri
+            Qi2 = self.Qi2
+            ri2 = self.ri2
+
+            # Record of the iteration
+            rec = dict(
+                iter = self.iter,
+                info = self.INFO_OK,
+                m = None,
+                S = None,
+                df = None,
+                stime = None,
+                mstep = None,
+                mrhat = None,
+                othertime = None,
+                site_times = None,
+                site_msteps = None,
+                site_mrhats = None,
+                site_ok = None,
+                recoveries = 0,
+                conv = None,
+                telemetry = None
+            )
+
+            # Per-site telemetry of the iteration
+            tele = np.zeros(self.K, dtype=self.TELEMETRY_DTYPE)
+            tele['iter'] = self.iter
+            tele['site'] = np.arange(self.K)
+            tele['cavity_ok'] = True
+            self._telemetry.append(tele)
+            rec['telemetry'] = tele
+
+            # Seeds for the sampling in workers for this iteration
+            seeds = self.rng.randint(0, TiltedBackend.MAX_SEED, size=self.K)
+
+            if self.max_recoveries > 0:
+                # Snapshot the site parameters
+                np.copyto(Qi_snap, Qi)
+                np.copyto(ri_snap, ri)
+                offending.fill(False)
+
             # Tilted distributions (parallelisable)
             # -------------------------------------
 
@@ -1002,27 +1949,45 @@ class Master(object):
                         "Iter {} starting. Process tilted distributions"
                         .format(self.iter)
                     )
+            # Sites estimated with the Laplace approximation in this iteration
+            if self.iter <= self.laplace_iters:
+                laplace = np.ones(self.K, dtype=bool)
+            else:
+                laplace = self.laplace_sites
             for k in range(self.K):
                 if verbose:
                     sys.stdout.write("\r    site {}".format(k+1)+' '*10+'\b'*9)
                     # Force flush here as it is not done automatically
                     sys.stdout.flush()
+                tilted_estim = 'laplace' if laplace[k] else None
                 # Process the site
-                if save_last_param:
-                    posdefs[k] = self.workers[k].tilted(
-                        dQi[:,:,k],
-                        dri[:,k],
-                        save_samples = save_last_param,
-                        seed = seeds[cur_iter, k]
-                    )
-                else:
-                    posdefs[k] = self.workers[k].tilted(
-                        dQi[:,:,k],
-                        dri[:,k],
-                        seed = seeds[cur_iter, k]
-                    )
+                with self.profiler.stage('tilted', site=k):
+                    if save_last_param:
+                        posdefs[k] = self.workers[k].tilted(
+                            dQi[:,:,k],
+                            dri[:,k],
+                            save_samples = save_last_param,
+                            seed = seeds[k],
+                            tilted_estim = tilted_estim,
+                            defer_olse = self.batch_olse
+                        )
+                    else:
+                        posdefs[k] = self.workers[k].tilted(
+                            dQi[:,:,k],
+                            dri[:,k],
+                            seed = seeds[k],
+                            tilted_estim = tilted_estim,
+                            defer_olse = self.batch_olse
+                        )
+                self._store_telemetry(tele, k)
+                tele['laplace'][k] = (
+                    laplace[k] or self.workers[k].tilted_estim == 'laplace')
                 if verbose and not posdefs[k]:
                     sys.stdout.write("fail\n")
+            if self.batch_olse:
+                # Deferred precision estimates of all the sites at once
+                self._batch_olse(dQi, dri, posdefs)
+            tele['tilted_ok'] = posdefs
             if verbose:
                 if np.all(posdefs):
                     print("\rAll sites ok")
@@ -1030,24 +1995,27 @@ class Master(object):
                     print("\rSome sites failed and are not updated")
                 else:
                     print("\rEvery site failed")
+            rec['site_ok'] = posdefs.copy()
             if not np.any(posdefs):
-                # all sites failed, return with desired args
-                out = [self.INFO_ALL_SITES_FAIL]
-                if calc_moments:
-                    out.append((m_phi_s, cov_phi_s))
-                if return_analytics:
-                    out.append((stimes, msteps, mrhats, othertimes))
-                return out if len(out) > 1 else out[0]
-
-            # Store max sampling time
-            stimes[cur_iter] = max([w.last_time for w in self.workers])
-            msteps[cur_iter] = max([w.last_msteps for w in self.workers])
-            mrhats[cur_iter] = max([w.last_mrhat for w in self.workers])
+                # all sites failed
+                rec['info'] = self.INFO_ALL_SITES_FAIL
+                yield rec
+                return
+
+            # Store sampling times
+            rec['site_times'] = np.array([w.last_time for w in self.workers])
+            rec['site_msteps'] = np.array(
+                [w.last_msteps for w in self.workers])
+            rec['site_mrhats'] = np.array(
+                [w.last_mrhat for w in self.workers])
+            rec['stime'] = rec['site_times'].max()
+            rec['mstep'] = rec['site_msteps'].max()
+            rec['mrhat'] = rec['site_mrhats'].max()
 
             if verbose:
                 print(
                     "Sampling done, max sampling time {}"
-                    .format(stimes[cur_iter])
+                    .format(rec['stime'])
                 )
 
             # measure elapsed time for othertimes
@@ -1064,6 +2032,7 @@ class Master(object):
                 fail_printline_cov = False
             # Fail flag for pos.def enforcing
             failed_force_pos_def = False
+            start_damping = time.time()
             while True:
                 # Try to update the global posterior approximation
 
@@ -1081,6 +2050,7 @@ class Master(object):
                 except linalg.LinAlgError:
                     # Not positive definite -> reduce damping factor
                     df *= self.df_decay
+                    failed = 'global'
                     if verbose:
                         fail_printline_pos = True
                         sys.stdout.write(
@@ -1092,75 +2062,45 @@ class Master(object):
                     if self.iter == 1:
                         if verbose:
                             print("\nInvalid prior.")
-                        # return with desired args
-                        out = [self.INFO_INVALID_PRIOR]
-                        if calc_moments:
-                            out.append((m_phi_s, cov_phi_s))
-                        if return_analytics:
-                            out.append((stimes, msteps, mrhats, othertimes))
-                        return out if len(out) > 1 else out[0]
-                    if df < self.df_treshold:
-                        if verbose:
-                            print("\nDamping factor reached minimum.")
-                        df = self.df0(self.iter)
-                        np.add(Qi, np.multiply(df, dQi, out=Qi2), out=Qi2)
-                        np.add(ri, np.multiply(df, dri, out=ri2), out=ri2)
-                        if failed_force_pos_def:
-                            if verbose:
-                                print("Failed to force pos_def global.")
-                            # return with desired args
-                            out = [self.INFO_DF_TRESHOLD_REACHED_CAVITY]
-                            if calc_moments:
-                                out.append((m_phi_s, cov_phi_s))
-                            if return_analytics:
-                                out.append((stimes, msteps, mrhats, othertimes))
-                            return out if len(out) > 1 else out[0]
-                        failed_force_pos_def = True
-                        # Try to fix by forcing improper sites to proper
-                        posdefs.fill(0)
+                        rec['info'] = self.INFO_INVALID_PRIOR
+                        yield rec
+                        return
+                else:
+                    # Cavity distributions (parallelisable)
+                    # -------------------------------------
+                    # Check positive definitness for each cavity distribution
+                    with self.profiler.stage('cavity', df=df):
                         for k in range(self.K):
-                            # Set min eigenvalue to MIN_EIG by adding to the
-                            # diagonal if it is smaller than MIN_EIG_TRESHOLD
-                            min_eig = linalg.eigvalsh(
-                                Qi2[:,:,k], eigvals=(0,0))[0]
-                            if min_eig < self.MIN_EIG_TRESHOLD:
-                                Qi[:,:,k].flat[::self.dphi+1] += (
-                                    self.MIN_EIG - min_eig)
-                                posdefs[k] = 1
-                        if verbose:
-                            print("Force sites {} pos_def.".format(
-                                np.nonzero(posdefs)[0]))
-                    continue
-
-                # Cavity distributions (parallelisable)
-                # -------------------------------------
-                # Check positive definitness for each cavity distribution
-                for k in range(self.K):
-                    posdefs[k] = \
-                        self.workers[k].cavity(Q, r, Qi2[:,:,k], ri2[:,k])
-                    # Early stopping criterion (when in serial)
-                    if not posdefs[k]:
+                            posdefs[k] = self.workers[k].cavity(
+                                Q, r, Qi2[:,:,k], ri2[:,k])
+                            tele['cavity_ok'][k] = posdefs[k]
+                            # Early stopping criterion (when in serial)
+                            if not posdefs[k]:
+                                break
+
+                    if np.all(posdefs):
+                        # All cavity distributions are positive definite.
+                        # Accept step (switch Qi-Qi2 and ri-ri2)
+                        temp = Qi
+                        Qi = Qi2
+                        Qi2 = temp
+                        temp = ri
+                        ri = ri2
+                        ri2 = temp
+                        self.Qi = Qi
+                        self.Qi2 = Qi2
+                        self.ri = ri
+                        self.ri2 = ri2
                         break
 
-                if np.all(posdefs):
-                    # All cavity distributions are positive definite.
-                    # Accept step (switch Qi-Qi2 and ri-ri2)
-                    temp = Qi
-                    Qi = Qi2
-                    Qi2 = temp
-                    temp = ri
-                    ri = ri2
-                    ri2 = temp
-                    self.Qi = Qi
-                    self.Qi2 = Qi2
-                    self.ri = ri
-                    self.ri2 = ri2
-                    break
-
-                else:
                     # Not all cavity distributions are positive definite ...
                     # reduce the damping factor
                     df *= self.df_decay
+                    failed = 'cavities'
+                    first_fail = np.nonzero(~posdefs)[0][0]
+                    tele['damp_retries'][first_fail] += 1
+                    if self.max_recoveries > 0:
+                        offending[first_fail] = True
                     if verbose:
                         if fail_printline_pos:
                             fail_printline_pos = False
@@ -1169,82 +2109,236 @@ class Master(object):
                         sys.stdout.write(
                             "\rNon pos. def. cavity, " +
                             "(first encountered in site {}), "
-                            .format(np.nonzero(~posdefs)[0][0]) +
+                            .format(first_fail) +
                             "reducing df to {:.3}".format(df) +
                             " "*5 + "\b"*5
                         )
                         sys.stdout.flush()
-                    if df < self.df_treshold:
-                        if verbose:
-                            print("\nDamping factor reached minimum.")
+
+                if df < self.df_treshold:
+                    # The damping failed for the global approximation or for
+                    # the cavities
+                    if verbose:
+                        print("\nDamping factor reached minimum.")
+                    df = self.df0(self.iter)
+                    np.add(Qi, np.multiply(df, dQi, out=Qi2), out=Qi2)
+                    np.add(ri, np.multiply(df, dri, out=ri2), out=ri2)
+                    if (    failed_force_pos_def
+                         and self.max_recoveries > 0
+                         and rec['recoveries'] < self.max_recoveries
+                       ):
+                        # Roll back and resample the offending sites
+                        start_recovery = time.time()
+                        rec['stime'] += self._recover(
+                            Qi_snap, ri_snap, offending, save_last_param,
+                            verbose, tele
+                        )
+                        start_othertime += time.time() - start_recovery
+                        rec['recoveries'] += 1
+                        offending.fill(False)
                         df = self.df0(self.iter)
-                        np.add(Qi, np.multiply(df, dQi, out=Qi2), out=Qi2)
-                        np.add(ri, np.multiply(df, dri, out=ri2), out=ri2)
-                        if failed_force_pos_def:
-                            if verbose:
-                                print("Failed to force pos_def cavities.")
-                            # return with desired args
-                            out = [self.INFO_DF_TRESHOLD_REACHED_CAVITY]
-                            if calc_moments:
-                                out.append((m_phi_s, cov_phi_s))
-                            if return_analytics:
-                                out.append((stimes, msteps, mrhats, othertimes))
-                            return out if len(out) > 1 else out[0]
-                        failed_force_pos_def = True
-                        # Try to fix by forcing improper sites to proper
-                        posdefs.fill(0)
-                        for k in range(self.K):
-                            # Set min eigenvalue to MIN_EIG by adding to the
-                            # diagonal if it is smaller than MIN_EIG_TRESHOLD
-                            min_eig = linalg.eigvalsh(
-                                Qi2[:,:,k], eigvals=(0,0))[0]
-                            if min_eig < self.MIN_EIG_TRESHOLD:
-                                Qi[:,:,k].flat[::self.dphi+1] += (
-                                    self.MIN_EIG - min_eig)
-                                posdefs[k] = 1
+                        failed_force_pos_def = False
+                        continue
+                    if failed_force_pos_def:
                         if verbose:
-                            print("Force sites {} pos_def.".format(
-                                np.nonzero(posdefs)[0]))
+                            print("Failed to force pos_def {}.".format(failed))
+                        rec['info'] = self.INFO_DF_TRESHOLD_REACHED_CAVITY
+                        yield rec
+                        return
+                    failed_force_pos_def = True
+                    # Try to fix by forcing improper sites to proper
+                    self._force_pos_def(Qi, Qi2, posdefs)
+                    tele['forced'] |= posdefs
+                    if self.max_recoveries > 0:
+                        offending |= posdefs
+                    if verbose:
+                        print("Force sites {} pos_def.".format(
+                            np.nonzero(posdefs)[0]))
             if verbose and (fail_printline_pos or fail_printline_cov):
                 print()
+            rec['df'] = df
+            self.profiler.record(
+                'damping', start_damping, time.time() - start_damping, df=df)
+
+            if calc_conv:
+                # Convergence criteria (chol of Q still in cho_Q)
+                with self.profiler.stage('conv'):
+                    rec['conv'] = self._conv_stats(cho_Q, df, conv_prev)
+                if verbose:
+                    print(
+                        "Convergence: KL {:.3g}, mean {:.3g}, update {:.3g}"
+                        .format(
+                            rec['conv']['kl'],
+                            rec['conv']['mean'],
+                            rec['conv']['update']
+                        )
+                    )
 
             if calc_moments:
                 # Invert Q (chol was already calculated)
                 # N.B. The following inversion could be done while
                 # parallel jobs are running, thus saving time.
-                invert_normal_params(cho_Q, r, out_A='in-place', out_b=m,
-                                     cho_form=True)
+                with self.profiler.stage('moments'):
+                    invert_normal_params(cho_Q, r, out_A='in-place', out_b=m,
+                                         cho_form=True)
                 # Store the approximation moments
-                np.copyto(m_phi_s[cur_iter], m)
-                np.copyto(cov_phi_s[cur_iter], S.T)
+                rec['m'] = m.copy()
+                if calc_cov:
+                    rec['S'] = S.T.copy()
                 if verbose:
                     print(
                         "Mean and std of phi[0]: {:.3}, {:.3}"
-                        .format(
-                            m_phi_s[cur_iter,0],
-                            np.sqrt(cov_phi_s[cur_iter,0,0])
-                        )
+                        .format(m[0], np.sqrt(S[0,0]))
                     )
 
             # measure total time - tilted time
-            othertimes[cur_iter] = time.time() - start_othertime
+            rec['othertime'] = time.time() - start_othertime
 
             if verbose:
                 print("Iter {} done.".format(self.iter))
 
-        if verbose:
-            print(
-                "{} iterations done\nTotal limiting sampling time: {}"
-                .format(niter, stimes.sum())
+            yield rec
+
+
+    def _force_pos_def(self, Qi, Qi2, forced):
+        """Force the improper site proposals to proper ones.
+
+        The minimum eigenvalue of each site proposal precision in `Qi2`
+        smaller than MIN_EIG_TRESHOLD is set to MIN_EIG by adding to the
+        diagonal of the respective site precision in `Qi`. The forced sites
+        are marked into the boolean array `forced`.
+
+        """
+        forced.fill(0)
+        for k in range(self.K):
+            min_eig = linalg.eigvalsh(Qi2[:,:,k], eigvals=(0,0))[0]
+            if min_eig < self.MIN_EIG_TRESHOLD:
+                Qi[:,:,k].flat[::self.dphi+1] += self.MIN_EIG - min_eig
+                forced[k] = 1
+
+
+    def _conv_stats(self, cho_Q, df, prev):
+        """Calculate the convergence criteria for the current iteration.
+
+        Parameters
+        ----------
+        cho_Q : ndarray
+            Upper Cholesky factor of the current global precision matrix.
+
+        df : float
+            The damping factor used in the current iteration.
+
+        prev : dict
+            Precision matrix 'Q', mean 'm' and half of the log-determinant
+            of the precision matrix 'ldet' of the previous global approximation.
+            These are updated to the current ones.
+
+        Returns
+        -------
+        stats : dict
+            Values of the criteria listed in Master.CONV_CRITERIA.
+
+        """
+        cho = (cho_Q, False)
+        m = linalg.cho_solve(cho, self.r)
+        ldet = np.sum(np.log(np.diag(cho_Q)))
+        dm = m - prev['m']
+        # KL-divergence from the previous approximation to the current one
+        kl = (
+            0.5*(
+                np.trace(linalg.cho_solve(cho, prev['Q']))
+                + dm.dot(prev['Q'].dot(dm))
+                - self.dphi
             )
+            + ldet - prev['ldet']
+        )
+        # Relative change of the mean
+        norm_m = np.linalg.norm(prev['m'])
+        mean = np.linalg.norm(dm) / norm_m if norm_m > 0 else np.inf
+        # Relative norm of the damped site precision updates
+        update = df * np.linalg.norm(self.dQi) / np.linalg.norm(self.Q)
+        # Store the current approximation
+        np.copyto(prev['Q'], self.Q)
+        prev['m'] = m
+        prev['ldet'] = ldet
+        return dict(kl=kl, mean=mean, update=update)
+
+
+    def _recover(self, Qi_snap, ri_snap, offending, save_last_param, verbose,
+                 tele=None):
+        """Roll back the site parameters and resample the offending sites.
+
+        The site parameters are restored from the given snapshot taken in the
+        beginning of the iteration and the site parameter updates of the
+        offending sites are recalculated by sampling with `recov_iter_mult`
+        times more draws and using the precision estimate method
+        `recov_prec_estim`. If no site is marked as offending, every site is
+        resampled. The diagnostics of the resampled sites are updated into the
+        optional telemetry row `tele`.
 
-        # return with desired args
-        out = [self.INFO_OK]
-        if calc_moments:
-            out.append((m_phi_s, cov_phi_s))
-        if return_analytics:
-            out.append((stimes, msteps, mrhats, othertimes))
-        return tuple(out) if len(out) > 1 else out[0]
+        Returns
+        -------
+        stime : float
+            Max sampling time of the resampled sites.
+
+        """
+        sites = np.nonzero(offending)[0]
+        if len(sites) == 0:
+            sites = np.arange(self.K)
+        if verbose:
+            print("Recover by resampling sites {}".format(sites))
+        start = time.time()
+        # Roll back
+        np.copyto(self.Qi, Qi_snap)
+        np.copyto(self.ri, ri_snap)
+        np.add(self.Qi.sum(2, out=self.Q), self.Q0, out=self.Q)
+        np.add(self.ri.sum(1, out=self.r), self.r0, out=self.r)
+        # Resample
+        stime = 0.0
+        for k in sites:
+            worker = self.workers[k]
+            if not worker.cavity(
+                    self.Q, self.r, self.Qi[:,:,k], self.ri[:,k]):
+                # The rolled back cavity is not positive definite, the site is
+                # not updated
+                if verbose:
+                    print("Cavity of site {} not pos_def, not updated"
+                          .format(k))
+                self.dQi[:,:,k].fill(0)
+                self.dri[:,k].fill(0)
+                if tele is not None:
+                    tele['cavity_ok'][k] = False
+                    tele['tilted_ok'][k] = False
+                continue
+            stan_params = dict(
+                iter = self.recov_iter_mult * worker.stan_params['iter'])
+            if worker.stan_params['warmup'] is not None:
+                stan_params['warmup'] = (
+                    self.recov_iter_mult * worker.stan_params['warmup'])
+            pos_def = worker.tilted(
+                self.dQi[:,:,k],
+                self.dri[:,k],
+                save_samples = save_last_param,
+                seed = self.rng.randint(0, TiltedBackend.MAX_SEED),
+                stan_params = stan_params,
+                prec_estim = self.recov_prec_estim,
+                tilted_estim = 'sample'
+            )
+            if verbose and not pos_def:
+                print("Resampling site {} failed, not updated".format(k))
+            stime = max(stime, worker.last_time)
+            if tele is not None:
+                time_prev = tele['time'][k]
+                warmup_time_prev = tele['warmup_time'][k]
+                self._store_telemetry(tele, k)
+                tele['time'][k] += time_prev
+                tele['warmup_time'][k] += warmup_time_prev
+                tele['tilted_ok'][k] = pos_def
+                tele['resampled'][k] = True
+        self.recoveries += 1
+        self.profiler.record(
+            'recover', start, time.time() - start, sites=sites.tolist())
+        return stime
 
 
     def mix_phi(self, out_S=None, out_m=None):
@@ -1275,26 +2369,21 @@ class Master(object):
         temp_M = np.empty((self.dphi,self.dphi), order='F')
         temp_v = np.empty(self.dphi)
 
-        # Combine from all the sites
+        # Combine from all the sites, the saved samples are left intact
         nsamp_tot = 0
-        means = []
-        nsamps = []
+        sites = []
         for k in range(self.K):
-            samp = self.workers[k].saved_samp['phi']
-            nsamp = samp.shape[0]
-            nsamps.append(nsamp)
-            nsamp_tot += nsamp
-            mt = np.mean(samp, axis=0)
-            means.append(mt)
-            samp -= mt
-            out_m += mt
-            samp.T.dot(samp, out=temp_M.T)
-            out_S += temp_M
+            moments = MomentAccumulator(self.dphi)
+            moments.add(self.workers[k].saved_samp['phi'])
+            sites.append(moments)
+            nsamp_tot += moments.n
+            out_m += moments.mean
+            out_S += moments.scatter
         out_m /= self.K
-        for k in range(self.K):
-            np.subtract(means[k], out_m, out=temp_v)
+        for moments in sites:
+            np.subtract(moments.mean, out_m, out=temp_v)
             np.multiply(temp_v[:,np.newaxis], temp_v, out=temp_M.T)
-            temp_M *= nsamps[k]
+            temp_M *= moments.n
             out_S += temp_M
         out_S /= nsamp_tot - 1
 
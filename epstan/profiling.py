@@ -0,0 +1,246 @@
+"""Instrumentation of the stages of the distributed EP algorithm.
+
+A profiler can be given for epstan.method.Master with the keyword argument
+`profiler`, after which the durations of the stages of each iteration (e.g.
+sampling the tilted distributions, the damping and the cavity loops) are
+recorded into it. Without a profiler, the null profiler NULL_PROFILER is used,
+whose context managers do nothing.
+
+The recorded stages can be summarised with Profiler.summary or exported into
+a Chrome trace JSON file with Profiler.save_chrome_trace, which can be viewed
+on a timeline e.g. in chrome://tracing or https://ui.perfetto.dev.
+
+Example
+-------
+    profiler = Profiler()
+    master = Master(site_model, X, y, profiler=profiler, **options)
+    master.run(niter)
+    print(profiler.summary())
+    profiler.save_chrome_trace('trace.json')
+
+The most recent version of the code can be found on GitHub:
+https://github.com/gelman/ep-stan
+
+"""
+
+# Licensed under the 3-clause BSD license.
+# http://opensource.org/licenses/BSD-3-Clause
+#
+# Copyright (C) 2014 Tuomas Sivula
+# All rights reserved.
+
+
+__all__ = ['Profiler', 'NullProfiler', 'NULL_PROFILER']
+
+
+import os
+import time
+import json
+import threading
+
+
+class _Stage(object):
+    """Context manager recording the duration of a stage."""
+
+    __slots__ = ('profiler', 'name', 'args', 'start')
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(
+            self.name, self.start, time.time() - self.start, **self.args)
+
+
+class _NullStage(object):
+    """Context manager doing nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Profiler(object):
+    """Registry of the timed stages.
+
+    Each recorded stage is stored as an event with its name, start time
+    (seconds since the epoch), duration in seconds, process and thread id, and
+    optional extra arguments (e.g. the index of the site).
+
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.events = []
+
+    def stage(self, name, **args):
+        """Context manager recording the duration of the enclosed block.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage.
+
+        **args
+            Additional information of the stage, e.g. site=k.
+
+        """
+        return _Stage(self, name, args)
+
+    def bind(self, **args):
+        """Return a view of the profiler adding `args` to each stage.
+
+        Used e.g. for passing the profiler of a worker into the backend, so
+        that the stages of the sampling are recorded with site=k.
+
+        """
+        return _BoundProfiler(self, args)
+
+    def record(self, name, start, duration, pid=None, tid=None, **args):
+        """Record a stage timed elsewhere, e.g. in a subprocess.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage.
+
+        start : float
+            Start time of the stage in seconds since the epoch (time.time).
+
+        duration : float
+            Duration of the stage in seconds.
+
+        pid, tid : int, optional
+            Process and thread id of the stage. By default, the current ones
+            are used.
+
+        **args
+            Additional information of the stage.
+
+        """
+        self.events.append(dict(
+            name = name,
+            start = start,
+            duration = duration,
+            pid = os.getpid() if pid is None else pid,
+            tid = threading.get_ident() if tid is None else tid,
+            args = args
+        ))
+
+    def clear(self):
+        """Remove all the recorded events."""
+        self.events = []
+
+    def stats(self):
+        """Return the statistics of the recorded stages.
+
+        Returns
+        -------
+        stats : dict
+            Dict {name: (count, total, max)} of the recorded stages, where
+            count is the number of times the stage was recorded, and total and
+            max are the total and the maximum duration of the stage in seconds.
+
+        """
+        stats = {}
+        for event in self.events:
+            count, total, max_ = stats.get(event['name'], (0, 0.0, 0.0))
+            stats[event['name']] = (
+                count + 1,
+                total + event['duration'],
+                max(max_, event['duration'])
+            )
+        return stats
+
+    def summary(self):
+        """Return a table of the statistics of the recorded stages."""
+        stats = self.stats()
+        lines = [
+            ('{:20}' + 4*' {:>12}').format(
+                'stage', 'count', 'total (s)', 'mean (s)', 'max (s)'),
+            73*'-'
+        ]
+        for name, (count, total, max_) in sorted(
+                stats.items(), key=lambda item: -item[1][1]):
+            lines.append(
+                ('{:20} {:>12d}' + 3*' {:>12.4f}').format(
+                    name, count, total, total/count, max_)
+            )
+        return '\n'.join(lines)
+
+    def save_chrome_trace(self, filename):
+        """Export the recorded stages into a Chrome trace JSON file.
+
+        Parameters
+        ----------
+        filename : str
+            Name of the output file.
+
+        """
+        events = [
+            dict(
+                name = event['name'],
+                cat = 'epstan',
+                ph = 'X',
+                ts = event['start'] * 1e6,
+                dur = event['duration'] * 1e6,
+                pid = event['pid'],
+                tid = event['tid'],
+                args = event['args']
+            )
+            for event in self.events
+        ]
+        with open(filename, 'w') as f:
+            json.dump(dict(traceEvents=events, displayTimeUnit='ms'), f)
+
+
+class _BoundProfiler(object):
+    """View of a profiler adding fixed arguments to the stages."""
+
+    enabled = True
+
+    def __init__(self, profiler, args):
+        self.profiler = profiler
+        self.args = args
+
+    def stage(self, name, **args):
+        return _Stage(self, name, args)
+
+    def bind(self, **args):
+        return _BoundProfiler(self.profiler, dict(self.args, **args))
+
+    def record(self, name, start, duration, pid=None, tid=None, **args):
+        self.profiler.record(
+            name, start, duration, pid=pid, tid=tid, **dict(self.args, **args))
+
+
+class NullProfiler(object):
+    """Profiler recording nothing."""
+
+    enabled = False
+
+    def stage(self, name, **args):
+        return _NULL_STAGE
+
+    def bind(self, **args):
+        return self
+
+    def record(self, name, start, duration, pid=None, tid=None, **args):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
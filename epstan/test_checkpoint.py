@@ -0,0 +1,125 @@
+"""Script for testing the checkpoints of the distributed EP algorithm, see
+method.Master.save_checkpoint and method.Master.from_checkpoint.
+
+Run with:
+    $ python -m epstan.test_checkpoint
+
+A synthetic linear regression is fitted with the Stan-free Gaussian backend
+(see backends.GaussianBackend) in one run and in two runs, the second of which
+continues from the checkpoint saved by the first one. The site parameters,
+the global approximations and the telemetry of the two are compared and an
+AssertionError is raised if they differ.
+
+The most recent version of the code can be found on GitHub:
+https://github.com/gelman/ep-stan
+
+"""
+
+# Licensed under the 3-clause BSD license.
+# http://opensource.org/licenses/BSD-3-Clause
+#
+# Copyright (C) 2014 Tuomas Sivula
+# All rights reserved.
+
+
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from .method import Master
+from .backends import GaussianBackend
+
+
+# ------------------------------------------------------------------------------
+#     Configurations
+# ------------------------------------------------------------------------------
+seed_data = 0                   # Seed of the data
+seed_ep = 1                     # Seed of the distributed EP
+K = 4                           # Number of sites
+n_site = 30                     # Number of observations in each site
+dphi = 3                        # Dimension of the parameter
+niter = 6                       # Total number of iterations
+nfirst = 3                      # Iterations run before the checkpoint
+nsamp = 200                     # Number of tilted distribution draws
+
+
+rng = np.random.RandomState(seed_data)
+X = rng.randn(K*n_site, dphi)
+y = X.dot(rng.randn(dphi)) + rng.randn(K*n_site)
+options = dict(
+    dphi = dphi,
+    site_sizes = np.full(K, n_site, dtype=np.int64),
+    chains = 1,
+    iter = 2*nsamp,
+    warmup = nsamp,
+    df0 = 0.5
+)
+
+
+def new_master():
+    return Master(None, X, y, backend=GaussianBackend(), **options)
+
+
+# Uninterrupted run
+master = new_master()
+info, (m_ref, S_ref) = master.run(niter, verbose=False, seed=seed_ep)
+assert info == Master.INFO_OK
+ref = master
+
+tmp_dir = tempfile.mkdtemp()
+try:
+    path = os.path.join(tmp_dir, 'checkpoint')
+
+    # Run interrupted after the first iterations
+    master = new_master()
+    info, (m_first, S_first) = master.run(
+        nfirst, verbose=False, seed=seed_ep, checkpoint_path=path)
+    assert info == Master.INFO_OK
+    assert os.path.isdir(path)
+
+    # Round-trip of the saved state
+    restored = Master.from_checkpoint(
+        path, None, X, y, backend=GaussianBackend(), **options)
+    assert restored.iter == master.iter == nfirst
+    assert np.array_equal(restored.Qi, master.Qi)
+    assert np.array_equal(restored.ri, master.ri)
+    assert np.array_equal(restored.Q, master.Q)
+    assert np.array_equal(restored.r, master.r)
+    # Compared as bytes as the missing diagnostics are nan
+    assert restored.telemetry.tobytes() == master.telemetry.tobytes()
+    assert np.array_equal(
+        restored.rng.get_state()[1], master.rng.get_state()[1])
+    print('{:28} ok'.format('round-trip'))
+
+    # Continue without a seed, i.e. with the restored random state
+    info, (m_cont, S_cont) = restored.run(niter - nfirst, verbose=False)
+    assert info == Master.INFO_OK
+    assert restored.iter == niter
+    assert np.array_equal(np.concatenate((m_first, m_cont)), m_ref)
+    assert np.array_equal(np.concatenate((S_first, S_cont)), S_ref)
+    assert np.array_equal(restored.Qi, ref.Qi)
+    assert np.array_equal(restored.ri, ref.ri)
+    for name in ('iter', 'site', 'cavity_ok', 'tilted_ok', 'forced'):
+        assert np.array_equal(restored.telemetry[name], ref.telemetry[name])
+    print('{:28} ok'.format('identical continuation'))
+
+    # The sites are not initialised again when restored
+    class CountingBackend(GaussianBackend):
+        def __init__(self):
+            super().__init__()
+            self.laplace_calls = 0
+        def laplace(self, data, cavity, seed=None, init=None):
+            self.laplace_calls += 1
+            return super().laplace(data, cavity, seed=seed, init=init)
+    backend = CountingBackend()
+    restored = Master.from_checkpoint(
+        path, None, X, y, backend=backend, init_site='laplace', **options)
+    assert backend.laplace_calls == 0
+    assert np.array_equal(restored.Qi, master.Qi)
+    print('{:28} ok'.format('no site initialisation'))
+
+finally:
+    shutil.rmtree(tmp_dir)
+
+print('All ok')
@@ -0,0 +1,116 @@
+"""Script for testing the on-disk iteration history, see history.History.
+
+Run with:
+    $ python -m epstan.test_history
+
+The iterations are appended into a temporary history, which is then reopened
+for reading and for appending, and the stored arrays are compared to the
+appended ones. An AssertionError is raised if they differ.
+
+The most recent version of the code can be found on GitHub:
+https://github.com/gelman/ep-stan
+
+"""
+
+# Licensed under the 3-clause BSD license.
+# http://opensource.org/licenses/BSD-3-Clause
+#
+# Copyright (C) 2014 Tuomas Sivula
+# All rights reserved.
+
+
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from .history import History, open_history
+
+
+# ------------------------------------------------------------------------------
+#     Configurations
+# ------------------------------------------------------------------------------
+np.random.seed(0)               # Seed
+dphi = 5                        # Dimension of the approximated parameter
+niter = 8                       # Number of iterations appended at first
+nmore = 3                       # Number of iterations appended after reopening
+
+
+def random_iteration(dphi):
+    """Random mean, covariance and analytics of one iteration."""
+    m = np.random.randn(dphi)
+    A = np.random.randn(dphi, dphi)
+    S = A.dot(A.T) + np.eye(dphi)
+    analytics = dict(
+        time = np.random.rand(),
+        mstep = np.random.rand(),
+        mrhat = 1 + 0.1*np.random.rand(),
+        df = np.random.rand()
+    )
+    return m, S, analytics
+
+
+def check(history, iterations, cov):
+    """Compare the history to the appended iterations."""
+    assert len(history) == len(iterations)
+    assert history.m.shape == (len(iterations), dphi)
+    for i, (m, S, analytics) in enumerate(iterations):
+        assert np.array_equal(history.m[i], m)
+        if cov:
+            assert np.array_equal(history.S[i], S)
+        else:
+            assert history.S is None
+        for name in History.ANALYTICS:
+            val = history.analytics[name][i]
+            if name in analytics:
+                assert val == analytics[name]
+            else:
+                assert np.isnan(val)
+
+
+tmp_dir = tempfile.mkdtemp()
+try:
+    for cov, packed in ((True, False), (True, True), (False, False)):
+        name = 'cov={} packed={}'.format(cov, packed)
+        path = os.path.join(tmp_dir, 'history')
+        iterations = [random_iteration(dphi) for _ in range(niter + nmore)]
+
+        # Append and read while appending
+        history = History(path, dphi, cov=cov, packed=packed)
+        check(history, [], cov)
+        for i in range(niter):
+            m, S, analytics = iterations[i]
+            history.append(m, S, **analytics)
+            check(history, iterations[:i+1], cov)
+        history.close()
+
+        # Reopen for reading
+        check(open_history(path), iterations[:niter], cov)
+
+        # Reopen for appending
+        with History(path, mode='a') as history:
+            check(history, iterations[:niter], cov)
+            for m, S, analytics in iterations[niter:]:
+                history.append(m, S, **analytics)
+        check(open_history(path), iterations, cov)
+
+        shutil.rmtree(path)
+        print('{:28} ok'.format(name))
+
+    # A partially written record is discarded when reopened for appending
+    path = os.path.join(tmp_dir, 'history')
+    iterations = [random_iteration(dphi) for _ in range(niter)]
+    with History(path, dphi) as history:
+        for m, S, analytics in iterations:
+            history.append(m, S, **analytics)
+    with open(os.path.join(path, 'm.bin'), 'ab') as f:
+        f.write(b'\0' * 3)
+    with History(path, mode='a') as history:
+        check(history, iterations, True)
+    assert os.path.getsize(os.path.join(path, 'm.bin')) == niter*dphi*8
+    print('{:28} ok'.format('partial record'))
+
+finally:
+    shutil.rmtree(tmp_dir)
+
+print('All ok')
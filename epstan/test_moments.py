@@ -0,0 +1,134 @@
+"""Script for testing the streamed moments of the tilted distribution samples,
+see util.MomentAccumulator, TiltedBackend.sample_moments and
+method.Worker.site_update.
+
+Run with:
+    $ python -m epstan.test_moments
+
+The moments accumulated in chunks and merged from separate accumulators are
+compared to np.mean and np.cov, the moments of the backends to the ones of
+their samples, and the site parameter updates estimated from the moments to
+the ones estimated from the sample matrix. The maximum relative differences
+are printed and an AssertionError is raised if any of them exceeds the
+tolerance.
+
+The most recent version of the code can be found on GitHub:
+https://github.com/gelman/ep-stan
+
+"""
+
+# Licensed under the 3-clause BSD license.
+# http://opensource.org/licenses/BSD-3-Clause
+#
+# Copyright (C) 2014 Tuomas Sivula
+# All rights reserved.
+
+
+import numpy as np
+
+from .util import MomentAccumulator
+from .backends import TiltedBackend, LogisticBackend
+from .method import Worker
+
+
+# ------------------------------------------------------------------------------
+#     Configurations
+# ------------------------------------------------------------------------------
+np.random.seed(0)               # Seed
+n = 200                         # Number of samples
+d = 10                          # Dimension of the test distributions
+chunks = [1, 13, 50, 136]       # Chunk sizes of the accumulated samples
+n_site = 40                     # Number of observations in the site
+params = dict(chains=4, iter=200, warmup=100)  # Sampling parameters
+tol = 1e-10                     # Tolerance for the relative differences
+
+
+def random_samples(n, d):
+    """Draw samples from a random correlated normal distribution."""
+    L = np.random.randn(d, d) / np.sqrt(d) + np.eye(d)
+    return np.random.randn(n, d).dot(L) + np.random.randn(d)
+
+
+def rel_diff(a, b):
+    return np.max(np.abs(a - b)) / np.max(np.abs(b))
+
+
+results = []
+
+# MomentAccumulator vs np.mean and np.cov, chunks added and merged
+samp = random_samples(n, d)
+for chunk in chunks:
+    acc = MomentAccumulator(d)
+    merged = MomentAccumulator(d)
+    for i in range(0, n, chunk):
+        acc.add(samp[i:i+chunk])
+        part = MomentAccumulator(d)
+        part.add(samp[i:i+chunk])
+        merged.merge(part)
+    for name, cur in (('add', acc), ('merge', merged)):
+        assert cur.n == n
+        results.append((
+            'MomentAccumulator {} {}'.format(name, chunk),
+            max(rel_diff(cur.mean, np.mean(samp, axis=0)),
+                rel_diff(cur.cov(ddof=1), np.cov(samp, rowvar=False)))
+        ))
+
+# Moments of the backends vs the moments of their samples
+X = np.random.randn(n_site, d)
+y = (np.random.rand(n_site) < 0.5).astype(np.int64)
+data = dict(X=X, y=y)
+cavity = (np.zeros(d), np.asfortranarray(np.eye(d)))
+
+
+class SampleOnly(TiltedBackend):
+    """Backend relying on the default implementation of sample_moments."""
+    def sample(self, *args, **kwargs):
+        return LogisticBackend().sample(*args, **kwargs)
+
+
+for name, backend in (
+        ('logistic', LogisticBackend()), ('default', SampleOnly())):
+    samp, _, _ = backend.sample(data, cavity, 1, params=params)
+    moments, _, _ = backend.sample_moments(data, cavity, 1, params=params)
+    assert moments.n == samp.shape[0]
+    results.append((
+        'sample_moments {}'.format(name),
+        max(rel_diff(moments.mean, np.mean(samp, axis=0)),
+            rel_diff(moments.cov(ddof=1), np.cov(samp, rowvar=False)))
+    ))
+
+# Site parameter updates from the moments vs from the sample matrix
+samp = np.asfortranarray(random_samples(n, d))
+for prec_estim in Worker.PREC_ESTIM_OPTIONS:
+    out = []
+    for use_moments in (True, False):
+        worker = Worker(
+            0, None, d, X, y, backend=LogisticBackend(), prec_estim=prec_estim)
+        worker.cavity(
+            np.asfortranarray(np.eye(d)), np.zeros(d),
+            np.zeros((d,d), order='F'), np.zeros(d)
+        )
+        dQi = np.empty((d,d), order='F')
+        dri = np.empty(d)
+        if use_moments:
+            moments = MomentAccumulator(d)
+            for i in range(0, n, chunks[2]):
+                moments.add(samp[i:i+chunks[2]])
+            worker.site_update(moments, dQi, dri)
+        else:
+            worker.site_update(samp.copy(order='F'), dQi, dri)
+        assert worker.nsamp == n
+        out.append((dQi, dri))
+    results.append((
+        'site_update {}'.format(prec_estim),
+        max(rel_diff(out[0][0], out[1][0]), rel_diff(out[0][1], out[1][1]))
+    ))
+
+# Print results
+print(('{:32} {:>13}').format('test', 'max rel diff'))
+print(46*'-')
+for name, diff in results:
+    print(('{:32} {:>13.2e}').format(name, diff))
+failed = [name for name, diff in results if not diff < tol]
+assert not failed, "Failed tests: {}".format(', '.join(failed))
+print('All ok')
@@ -0,0 +1,79 @@
+"""Script for testing the batched olse precision estimates, see
+util.olse_batch.
+
+Run with:
+    $ python -m epstan.test_olse_batch
+
+The batched estimates are compared to the estimates of util.olse computed
+separately for each matrix, with a common and separate numbers of samples and
+prior matrices. The maximum relative differences are printed and an
+AssertionError is raised if any of them exceeds the tolerance.
+
+The most recent version of the code can be found on GitHub:
+https://github.com/gelman/ep-stan
+
+"""
+
+# Licensed under the 3-clause BSD license.
+# http://opensource.org/licenses/BSD-3-Clause
+#
+# Copyright (C) 2014 Tuomas Sivula
+# All rights reserved.
+
+
+import numpy as np
+
+from .util import olse, olse_batch
+
+
+# ------------------------------------------------------------------------------
+#     Configurations
+# ------------------------------------------------------------------------------
+np.random.seed(0)               # Seed
+K = 16                          # Number of matrices in the batch
+n = 200                         # Samples for the prior matrices
+d = 10                          # Dimension of the test distributions
+tol = 1e-10                     # Tolerance for the relative differences
+
+
+def random_samples(n, d):
+    """Draw samples from a random correlated normal distribution."""
+    L = np.random.randn(d, d) / np.sqrt(d) + np.eye(d)
+    return np.random.randn(n, d).dot(L) + np.random.randn(d)
+
+
+S = np.empty((K,d,d))
+P = np.empty((K,d,d))
+# Few samples for a notable shrinkage
+ns = np.random.randint(d+2, 3*d, size=K)
+for k in range(K):
+    S[k] = np.cov(random_samples(ns[k], d), rowvar=False, bias=True)
+    P[k] = np.linalg.inv(np.cov(random_samples(n, d), rowvar=False))
+
+results = []
+for name, n_arg, P_arg in (
+        ('common n, no P', ns[0], None),
+        ('common n, separate P', ns[0], P),
+        ('separate n, no P', ns, None),
+        ('separate n and P', ns, P)):
+    S_copy = S.copy()
+    batch = olse_batch(S, n_arg, P=P_arg)
+    assert np.array_equal(S, S_copy)
+    ref = np.empty((K,d,d))
+    for k in range(K):
+        ref[k] = olse(
+            np.asfortranarray(S[k]),
+            n_arg[k] if isinstance(n_arg, np.ndarray) else n_arg,
+            P = None if P_arg is None else np.asfortranarray(P_arg[k])
+        )
+    results.append(
+        (name, np.max(np.abs(batch - ref)) / np.max(np.abs(ref))))
+
+# Print results
+print(('{:32} {:>13}').format('test', 'max rel diff'))
+print(46*'-')
+for name, diff in results:
+    print(('{:32} {:>13.2e}').format(name, diff))
+failed = [name for name, diff in results if not diff < tol]
+assert not failed, "Failed tests: {}".format(', '.join(failed))
+print('All ok')
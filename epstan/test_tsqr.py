@@ -0,0 +1,66 @@
+"""Script for testing the blocked QR decomposition of tall-skinny matrices,
+see util.tsqr.
+
+Run with:
+    $ python -m epstan.test_tsqr
+
+The R factors with different numbers of blocks are compared to the one of
+np.linalg.qr, which they equal up to the signs of the rows. The maximum
+relative differences are printed and an AssertionError is raised if any of
+them exceeds the tolerance.
+
+The most recent version of the code can be found on GitHub:
+https://github.com/gelman/ep-stan
+
+"""
+
+# Licensed under the 3-clause BSD license.
+# http://opensource.org/licenses/BSD-3-Clause
+#
+# Copyright (C) 2014 Tuomas Sivula
+# All rights reserved.
+
+
+import numpy as np
+
+from .util import tsqr
+
+
+# ------------------------------------------------------------------------------
+#     Configurations
+# ------------------------------------------------------------------------------
+np.random.seed(0)               # Seed
+shapes = [(200, 10), (1000, 3), (45, 20)]   # Shapes of the tested matrices
+nblocks = [1, 2, 4, 7]          # Numbers of blocks
+tol = 1e-12                     # Tolerance for the relative differences
+
+
+results = []
+for n, d in shapes:
+    L = np.random.randn(d, d) / np.sqrt(d) + np.eye(d)
+    A = np.random.randn(n, d).dot(L) + np.random.randn(d)
+    A_copy = A.copy()
+    R_ref = np.linalg.qr(A, mode='r')
+    for nb in nblocks:
+        R = tsqr(A, nb)
+        signs = np.sign(np.diag(R)) * np.sign(np.diag(R_ref))
+        diff = (
+            np.max(np.abs(signs[:,np.newaxis]*R - R_ref))
+            / np.max(np.abs(R_ref))
+        )
+        results.append(('{}x{} {} blocks'.format(n, d, nb), diff))
+    # Output array and the input not overwritten
+    out = np.empty((d, d), order='F')
+    R = tsqr(A, nblocks[-1], out=out)
+    assert R is out
+    results.append(('{}x{} not overwritten'.format(n, d),
+                    np.max(np.abs(A - A_copy))))
+
+# Print results
+print(('{:32} {:>13}').format('test', 'max rel diff'))
+print(46*'-')
+for name, diff in results:
+    print(('{:32} {:>13.2e}').format(name, diff))
+failed = [name for name, diff in results if not diff < tol]
+assert not failed, "Failed tests: {}".format(', '.join(failed))
+print('All ok')
@@ -13,9 +13,10 @@ https://github.com/gelman/ep-stan
 
 
 __all__ = [
-    'invert_normal_params', 'olse', 'cv_moments', 'copy_fit_samples',
-    'get_last_fit_sample', 'load_stan', 'distribute_groups',
-    'redirect_stdout_stderr_deep', 'stan_sample_time'
+    'invert_normal_params', 'olse', 'olse_batch', 'MomentAccumulator', 'tsqr',
+    'ConsensusCombiner', 'cv_moments', 'copy_fit_samples', 'add_fit_samples',
+    'get_last_fit_sample', 'split_rhat_ess', 'load_stan', 'distribute_groups',
+    'redirect_stdout_stderr_deep', 'stan_sample_time', 'StanSamplePool'
 ]
 
 
@@ -25,14 +26,21 @@ import tempfile
 import pickle
 import re
 import itertools
+import hashlib
+import platform
+import sysconfig
+import threading
 import multiprocessing
+from multiprocessing.pool import ThreadPool
 from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 import numpy as np
 from scipy import linalg
 
-from pystan import StanModel
-
 from .cython_util import (
     copy_triu_to_tril,
     auto_outer,
@@ -44,6 +52,9 @@ from .cython_util import (
 # LAPACK positive definite inverse routine
 dpotri_routine = linalg.get_lapack_funcs('potri')
 
+# LAPACK qr routine
+dgeqrf_routine = linalg.get_lapack_funcs('geqrf')
+
 # Precalculated constant
 _LOG_2PI = np.log(2*np.pi)
 
@@ -194,6 +205,306 @@ def olse(S, n, P=None, out=None):
     return out
 
 
+def olse_batch(S, n, P=None, out=None):
+    """Optimal linear shrinkage estimator for a stack of covariance matrices.
+
+    Vectorised version of the function olse for e.g. the tilted distribution
+    sample covariance matrices of all the sites. The matrices are inverted
+    with batched Cholesky decompositions and the traces and the Frobenius
+    norms are computed for all the matrices at once.
+
+    Parameters
+    ----------
+    S : ndarray
+        The sample covariance matrices of shape (K, d, d).
+
+    n : int or ndarray
+        Number of contributing samples, common or one for each matrix.
+
+    P : {None, ndarray}, optional
+        The prior matrix of shape (d, d), or one for each matrix of shape
+        (K, d, d). Providing None uses the naive prior 1/d I, where d is the
+        number of dimensions. Default is None.
+
+    out : {None, ndarray}, optional
+        The output array of shape (K, d, d) for the precision matrix estimates.
+
+    Returns
+    -------
+    out : ndarray
+        The precision matrix estimates.
+
+    Raises
+    ------
+    LinAlgError
+        If any of the matrices is not positive definite.
+
+    """
+    if S.ndim != 3 or S.shape[1] != S.shape[2]:
+        raise ValueError("Invalid shape of arg. `S`")
+    d = S.shape[1]
+    n = np.asarray(n, dtype=np.float64)
+    # Invert via the inverse of the Cholesky factors: S^-1 = L^-T L^-1
+    L_inv = np.linalg.inv(np.linalg.cholesky(S))
+    out = np.matmul(np.swapaxes(L_inv, 1, 2), L_inv, out=out)
+    tr = np.einsum('kii->k', out)
+    tr2 = tr**2
+    f2 = np.einsum('kij,kij->k', out, out)
+    if P is None:
+        # Naive prior
+        alpha = 1 - (d + tr2/(f2 - tr2/d))/n
+        beta = tr*(1-d/n-alpha)
+        out *= alpha[:,None,None]
+        # Add beta/d to the diagonals
+        ind = np.arange(d)
+        out[:,ind,ind] += (beta/d)[:,None]
+    else:
+        # Use provided prior
+        f2p = np.einsum('...ij,...ij->...', P, P)
+        trSP = np.einsum('kij,kij->k', out, np.broadcast_to(P, out.shape))
+        alpha = 1 - (d + tr2*f2p/(f2*f2p - trSP**2))/n
+        beta = (trSP/f2p)*(1-d/n-alpha)
+        out *= alpha[:,None,None]
+        out += beta[:,None,None]*P
+    return out
+
+
+def _qr_r(A):
+    """R factor of the QR decomposition of `A` of shape (n, d), n >= d."""
+    qr, _, _, info = dgeqrf_routine(A)
+    if info:
+        raise linalg.LinAlgError(
+            "dgeqrf LAPACK routine failed with error code {}".format(info))
+    return np.triu(qr[:A.shape[1]])
+
+
+def tsqr(A, nblocks, threads=None, out=None):
+    """R factor of the QR decomposition of a tall-skinny matrix by blocks.
+
+    The rows of `A` are split into blocks, e.g. one for each chain, whose QR
+    decompositions are computed in parallel in a thread pool. The R factors of
+    the blocks are then stacked and decomposed again [1]_. The resulting R is
+    identical to the one of the QR decomposition of the whole matrix up to the
+    signs of its rows.
+
+    Parameters
+    ----------
+    A : ndarray
+        The matrix of shape (n, d), where n >= d. Not overwritten.
+
+    nblocks : int
+        The number of blocks. Limited so that each block has at least d rows.
+
+    threads : int, optional
+        The number of threads. By default, one for each block.
+
+    out : ndarray, optional
+        The output array of shape (d, d) for R.
+
+    Returns
+    -------
+    out : ndarray
+        The upper triangular R factor of shape (d, d).
+
+    References
+    ----------
+    .. [1] Demmel, J., Grigori, L., Hoemmen, M. and Langou, J.,
+       Communication-optimal Parallel and Sequential QR and LU Factorizations,
+       SIAM Journal on Scientific Computing 34(1), 206-239, 2012.
+
+    """
+    n, d = A.shape
+    if n < d:
+        raise ValueError("Arg. `A` should have at least as many rows as "
+                         "columns")
+    nblocks = max(1, min(nblocks, n // d))
+    if nblocks == 1:
+        R = _qr_r(A)
+    else:
+        lims = np.linspace(0, n, nblocks + 1).astype(int)
+        blocks = [A[lims[i]:lims[i+1]] for i in range(nblocks)]
+        if threads is None:
+            threads = nblocks
+        if threads > 1:
+            with ThreadPool(min(threads, nblocks)) as pool:
+                Rs = pool.map(_qr_r, blocks)
+        else:
+            Rs = [_qr_r(block) for block in blocks]
+        R = _qr_r(np.vstack(Rs))
+    if out is None:
+        return np.asfortranarray(R)
+    np.copyto(out, R)
+    return out
+
+
+class MomentAccumulator(object):
+    """Streaming accumulator of the mean and the scatter matrix of samples.
+
+    The samples can be added in chunks as they arrive, e.g. one chain or one
+    sampling increment at a time, and accumulators of separate chunks can be
+    merged, so that the whole sample matrix does not need to be held in the
+    memory. The chunks are combined with the parallel algorithm of Chan et al.
+    [1]_, a generalisation of the algorithm of Welford.
+
+    Parameters
+    ----------
+    d : int
+        The dimension of the samples.
+
+    Attributes
+    ----------
+    n : int
+        The number of accumulated samples.
+
+    mean : ndarray
+        The mean of the accumulated samples.
+
+    scatter : ndarray
+        The scatter matrix, i.e. the sum of the outer products of the centered
+        samples, in F-order.
+
+    References
+    ----------
+    .. [1] Chan, T.F., Golub, G.H. and LeVeque, R.J., Algorithms for Computing
+       the Sample Variance: Analysis and Recommendations, The American
+       Statistician 37(3), 242-247, 1983.
+
+    """
+
+    def __init__(self, d):
+        self.d = d
+        self.n = 0
+        self.mean = np.zeros(d)
+        self.scatter = np.zeros((d,d), order='F')
+
+    def add(self, samp):
+        """Add a chunk of samples of shape (n, d)."""
+        samp = np.asarray(samp)
+        if samp.ndim != 2 or samp.shape[1] != self.d:
+            raise ValueError("Invalid shape of arg. `samp`")
+        if samp.shape[0] == 0:
+            return
+        mean = np.mean(samp, axis=0)
+        centered = samp - mean
+        scatter = np.dot(centered.T, centered)
+        self.add_moments(samp.shape[0], mean, scatter)
+
+    def add_moments(self, n, mean, scatter):
+        """Add a chunk of samples given its size, mean and scatter matrix."""
+        if n == 0:
+            return
+        n_tot = self.n + n
+        delta = mean - self.mean
+        self.scatter += scatter
+        # The cross term of the two chunks
+        self.scatter += np.multiply.outer(delta, delta) * (self.n * n / n_tot)
+        self.mean += delta * (n / n_tot)
+        self.n = n_tot
+
+    def merge(self, other):
+        """Merge another accumulator into this one."""
+        if other.d != self.d:
+            raise ValueError("Dimension mismatch")
+        self.add_moments(other.n, other.mean, other.scatter)
+
+    def cov(self, ddof=0):
+        """Return the covariance matrix of the accumulated samples."""
+        if self.n - ddof <= 0:
+            raise ValueError("Not enough samples")
+        return self.scatter / (self.n - ddof)
+
+
+class ConsensusCombiner(object):
+    """Streaming combination of the site draws of consensus Monte Carlo.
+
+    The draws of each site are added as soon as the site has been sampled and
+    can then be discarded, so that the memory usage does not grow with the
+    number of sites. The moments of the pooled draws of all the sites are
+    accumulated with MomentAccumulator. With `weighting`, the draws are also
+    combined with the consensus Monte Carlo weighting of Scott et al. [1]_,
+    i.e. the s:th combined draw is the precision-weighted average
+    (sum_k W_k)^-1 sum_k W_k theta_ks, where W_k is the inverse of the sample
+    covariance matrix of site k. The weighted sums are accumulated for all the
+    draws at once, which requires the same number of draws from each site.
+
+    Parameters
+    ----------
+    d : int
+        The dimension of the draws.
+
+    weighting : bool, optional
+        Combine the draws with the consensus weighting. Default is False.
+
+    Attributes
+    ----------
+    pooled : MomentAccumulator
+        The moments of the pooled draws of the sites.
+
+    nsites : int
+        The number of added sites.
+
+    References
+    ----------
+    .. [1] Scott, S.L., Blocker, A.W., Bonassi, F.V., Chipman, H.A., George,
+       E.I. and McCulloch, R.E., Bayes and Big Data: The Consensus Monte Carlo
+       Algorithm, International Journal of Management Science and Engineering
+       Management 11(2), 78-88, 2016.
+
+    """
+
+    def __init__(self, d, weighting=False):
+        self.d = d
+        self.weighting = weighting
+        self.pooled = MomentAccumulator(d)
+        self.nsites = 0
+        # Sum of the weights and the weighted sums of the draws
+        self._W_sum = np.zeros((d,d), order='F')
+        self._W_draws = None
+
+    def add(self, samp):
+        """Add the draws of one site of shape (n, d)."""
+        samp = np.asarray(samp)
+        if (    self.weighting and self._W_draws is not None
+             and samp.shape[0] != self._W_draws.shape[0]
+           ):
+            raise ValueError(
+                "The number of draws differs from the previous sites")
+        site = MomentAccumulator(self.d)
+        site.add(samp)
+        self.pooled.merge(site)
+        if self.weighting:
+            if self._W_draws is None:
+                self._W_draws = np.zeros(samp.shape)
+            W, _ = invert_normal_params(site.cov(ddof=1))
+            # Weight all the draws at once (note W symmetric)
+            self._W_draws += np.dot(samp, W)
+            self._W_sum += W
+        self.nsites += 1
+
+    def draws(self):
+        """Return the consensus draws of shape (n, d)."""
+        if not self.weighting:
+            raise RuntimeError("The draws are not weighted.")
+        if self.nsites == 0:
+            raise RuntimeError("No sites added.")
+        cho = linalg.cho_factor(self._W_sum)
+        return linalg.cho_solve(cho, self._W_draws.T).T
+
+    def moments(self, ddof=1):
+        """Return the mean and the covariance matrix of the combined draws.
+
+        The moments are the ones of the consensus draws with `weighting` and
+        the ones of the pooled draws otherwise.
+
+        """
+        if self.weighting:
+            acc = MomentAccumulator(self.d)
+            acc.add(self.draws())
+        else:
+            acc = self.pooled
+        return acc.mean.copy(), acc.cov(ddof=ddof)
+
+
 def _cv_estim(f, h, Eh, opt, cov_k=None, var_k=None, ddof_f=0, ddof_h=0,
               out=None):
     """Estimate f_hat. Used by function cv_moments."""
@@ -486,6 +797,53 @@ def copy_fit_samples(fit, param_name, out=None):
     return out
 
 
+def add_fit_samples(fit, param_name, moments):
+    """Add the samples from PyStan fit object into a moment accumulator.
+
+    The samples are added one chain at a time, so that the samples of all the
+    chains are not copied at once (cf. copy_fit_samples).
+
+    Parameters
+    ----------
+    fit : StanFit4<model_name>
+        instance containing the fitted results
+
+    param_name : string
+        desired parameter name, the elements of which, in F-order, form the
+        dimensions of the accumulated samples
+
+    moments : MomentAccumulator
+        the accumulator into which the samples with burn-in removed are added
+
+    """
+    # tested with pystan version 2.17.0.0
+
+    # get the parameter dimensions
+    dims = fit.par_dims[fit.model_pars.index(param_name)]
+    nchains = fit.sim['chains']
+    warmup = fit.sim['warmup2'][0]
+    niter = len(fit.sim['samples'][0]['chains']['lp__'])
+    nsamp_per_chain = niter - warmup
+
+    # names of the parameter elements in f-order
+    if dims:
+        names = [
+            '{}[{}]'.format(param_name, ','.join(map(str, reversed(idxs))))
+            for idxs in itertools.product(*reversed(list(map(range, dims))))
+        ]
+    else:
+        names = [param_name]
+    if len(names) != moments.d:
+        raise ValueError("Dimension mismatch")
+
+    chunk = np.empty((nsamp_per_chain, len(names)), order='F')
+    for c in range(nchains):
+        chains = fit.sim['samples'][c]['chains']
+        for j, name in enumerate(names):
+            np.copyto(chunk[:,j], chains[name][warmup:])
+        moments.add(chunk)
+
+
 def get_last_fit_sample(fit, out=None):
     """Extract the last sample from a PyStan fit object.
 
@@ -537,6 +895,64 @@ def get_last_fit_sample(fit, out=None):
     return out
 
 
+def _autocov(x):
+    """Biased autocovariances of the rows of `x`."""
+    n = x.shape[1]
+    x = x - x.mean(axis=1, keepdims=True)
+    nfft = 2**int(np.ceil(np.log2(2*n)))
+    f = np.fft.rfft(x, n=nfft, axis=1)
+    return np.fft.irfft(f * np.conj(f), n=nfft, axis=1)[:, :n] / n
+
+
+def split_rhat_ess(draws):
+    """Split-Rhat and effective sample size of each parameter.
+
+    Computed as in Stan (Gelman et al., 2013, Bayesian Data Analysis, 3rd ed.,
+    Chapter 11). The autocorrelations are truncated with Geyer's initial
+    positive sequence.
+
+    Parameters
+    ----------
+    draws : ndarray
+        The draws of shape (nchains, ndraws, nparams).
+
+    Returns
+    -------
+    rhat, ess : ndarray
+        The split-Rhat and the effective sample size of each parameter.
+        Parameters with no variation, and all parameters if there are less
+        than four draws per chain, yield nan.
+
+    """
+    nchains, n, p = draws.shape
+    rhat = np.full(p, np.nan)
+    ess = np.full(p, np.nan)
+    n //= 2
+    if n < 2:
+        return rhat, ess
+    # Split the chains into halves
+    x = np.concatenate((draws[:, :n], draws[:, -n:]), axis=0)
+    m = x.shape[0]
+    for j in range(p):
+        acov = _autocov(x[:, :, j])
+        W = np.mean(acov[:, 0]) * n / (n - 1)
+        if not W > 0:
+            continue
+        var_plus = (n - 1) / n * W + np.var(x[:, :, j].mean(axis=1), ddof=1)
+        rhat[j] = np.sqrt(var_plus / W)
+        rho = 1 - (W - acov.mean(axis=0)) / var_plus
+        rho[0] = 1.0
+        # Geyer's initial positive sequence
+        tau = -1.0
+        for t in range(0, n - 1, 2):
+            pair = rho[t] + rho[t+1]
+            if pair < 0:
+                break
+            tau += 2 * pair
+        ess[j] = m * n / tau
+    return rhat, ess
+
+
 def distribute_groups(J, K, Nj):
     """Distribute J groups to K sites.
 
@@ -639,57 +1055,218 @@ def distribute_groups(J, K, Nj):
         raise ValueError("K cant be greater than number of samples")
 
 
-def load_stan(filename, overwrite=False):
+def _model_cache_key(source):
+    """Hash identifying a compiled model of the given Stan source code."""
+    import pystan
+    h = hashlib.sha256()
+    for part in (
+            source,
+            pystan.__version__,
+            sys.version,
+            platform.machine(),
+            sysconfig.get_config_var('CC') or '',
+            sysconfig.get_config_var('CFLAGS') or ''):
+        if not isinstance(part, bytes):
+            part = part.encode('utf-8')
+        h.update(part)
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _is_compiled(path, key=None):
+    """Check if the compiled model `path`.pkl exists and matches `key`.
+
+    If `key` is not None, it is compared to the hash in file `path`.hash
+    written along with the model.
+
+    """
+    if not os.path.isfile(path+'.pkl'):
+        return False
+    if key is None:
+        return True
+    try:
+        with open(path+'.hash', 'r') as f:
+            return f.read().strip() == key
+    except OSError:
+        return False
+
+
+def _write_atomic(path, content):
+    """Write bytes atomically so that a partial file is never read."""
+    fd, tmp = tempfile.mkstemp(
+        suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+@contextmanager
+def _file_lock(path, blocking=True):
+    """Hold an exclusive lock on the given lock file.
+
+    Yields True if the lock was acquired and False if it is held by another
+    process, which is only possible if `blocking` is False. Without module
+    fcntl (e.g. on Windows), no locking is done.
+
+    Raises
+    ------
+    OSError
+        If locking is not supported for the file, e.g. on some network file
+        systems.
+
+    """
+    if fcntl is None:
+        yield True
+        return
+    with open(path, 'a') as f:
+        if blocking:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _evict_models(cache_dir, cache_size, keep):
+    """Remove the least recently used models from the cache.
+
+    The cache holds at most `cache_size` models including `keep`. Models
+    locked by another process, e.g. being loaded, are not removed.
+
+    """
+    pkls = [
+        os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+        if name.endswith('.pkl') and os.path.join(cache_dir, name) != keep
+    ]
+    if len(pkls) < cache_size:
+        return
+    pkls.sort(key=os.path.getmtime)
+    for path in pkls[:len(pkls)-cache_size+1]:
+        lock = path[:-4] + '.lock'
+        with _file_lock(lock, blocking=False) as acquired:
+            if acquired:
+                # The lock file is kept so that the waiting processes and the
+                # new ones lock the same file
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def load_stan(filename, overwrite=False, cache_dir=None, cache_size=None):
     """Load or compile a stan model.
 
+    If a respective pickle file ending with '.pkl' is found, the model is not
+    built but loaded from it (unless `overwrite` is True). Otherwise the model
+    is compiled from the respective file ending with '.stan' and saved into
+    the '.pkl' file, or into a cache directory if one is provided. The
+    compilation is safe for concurrent use: if several processes need the
+    same model, exactly one of them compiles it while the others wait for it
+    (the locking requires module fcntl, i.e. a POSIX system).
+
+    In the cache directory, the compiled models are keyed by a hash of the
+    Stan source code, the PyStan version and the compiler, so that a model is
+    compiled again whenever its source changes, and the least recently used
+    models are evicted when the cache gets full. A '.pkl' file next to the
+    source is accompanied by a '.hash' file holding the same hash, and the
+    model is compiled again if the hash does not match, e.g. after the source
+    or PyStan is updated. A '.pkl' file without a respective '.stan' file is
+    loaded as is.
+
     Parameters
     ----------
     filename : string
         The name of the model file. It may or may not contain path and ending
-        '.stan' or '.pkl'. If a respective file with ending '.pkl' is found,
-        the model is not built but loaded from the pickle file (unless
-        `overwrite` is True). Otherwise the model is compiled from the
-        respective file ending with '.stan' and saved into '.pkl' file.
+        '.stan' or '.pkl'.
 
     overwrite : bool
         Compile and save a new model even if a pickled model with same name
         already exists.
 
+    cache_dir : str, optional
+        The cache directory. Providing None uses the environment variable
+        EPSTAN_MODEL_CACHE or, if not set, no cache, i.e. the model is saved
+        next to its source.
+
+    cache_size : int, optional
+        The maximum number of models kept in the cache. Providing None uses
+        the environment variable EPSTAN_MODEL_CACHE_SIZE or, if not set, 20.
+
     """
+    # PyStan is imported only when needed as its import is slow
+    from pystan import StanModel
+
     # Remove '.pkl' or '.stan' endings
     if filename.endswith('.pkl'):
         filename = filename[:-4]
     elif filename.endswith('.stan'):
         filename = filename[:-5]
 
-    if not overwrite and os.path.isfile(filename+'.pkl'):
-        # Use precompiled model
-        with open(filename+'.pkl', 'rb') as f:
-            sm = pickle.load(f)
-    elif os.path.isfile(filename+'.stan'):
-        # Compiling and save the model
-        if not overwrite:
-            print("Precompiled stan model {} not found.".format(filename+'.pkl'))
-            print("Compiling and saving the model.")
-        else:
-            print("Compiling and saving the model {}.".format(filename+'.pkl'))
-        if '/' in filename:
-            model_name = filename.split('/')[-1]
-        elif '\\' in filename:
-            model_name = filename.split('\\')[-1]
-        else:
-            model_name = filename
-        sm = StanModel(file=filename+'.stan', model_name=model_name)
-        with open(filename+'.pkl', 'wb') as f:
-            pickle.dump(sm, f)
-        print("Compiling and saving done.")
-    else:
+    if not os.path.isfile(filename+'.stan'):
+        if not overwrite and os.path.isfile(filename+'.pkl'):
+            # Use precompiled model, which can not be checked without source
+            with open(filename+'.pkl', 'rb') as f:
+                return pickle.load(f)
         raise IOError("File {} or {} not found"
                       .format(filename+'.stan', filename+'.pkl'))
+    with open(filename+'.stan', 'rb') as f:
+        source = f.read()
+    key = _model_cache_key(source)
+
+    model_name = os.path.basename(filename)
+    if cache_dir is None:
+        cache_dir = os.environ.get('EPSTAN_MODEL_CACHE')
+    if cache_dir is None:
+        # Save next to the source with the hash in a separate file
+        path = filename
+        if not overwrite and _is_compiled(path, key):
+            # Use precompiled model
+            with open(path+'.pkl', 'rb') as f:
+                return pickle.load(f)
+    else:
+        cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        if cache_size is None:
+            cache_size = int(os.environ.get('EPSTAN_MODEL_CACHE_SIZE', 20))
+        if cache_size < 1:
+            raise ValueError("Invalid value for arg. `cache_size`")
+        os.makedirs(cache_dir, exist_ok=True)
+        path = os.path.join(cache_dir, '{}-{}'.format(model_name, key[:16]))
+
+    with _file_lock(path+'.lock'):
+        # Check again as another process may have compiled the model while
+        # waiting for the lock (the hash is in the name of a cached model)
+        if not overwrite and _is_compiled(
+                path, key if cache_dir is None else None):
+            # Use precompiled model
+            with open(path+'.pkl', 'rb') as f:
+                sm = pickle.load(f)
+            if cache_dir is not None:
+                # Mark as recently used
+                os.utime(path+'.pkl', None)
+            return sm
+        # Compile and save the model
+        print("Compiling and saving the model {}.".format(path+'.pkl'))
+        sm = StanModel(file=filename+'.stan', model_name=model_name)
+        _write_atomic(path+'.pkl', pickle.dumps(sm))
+        if cache_dir is None:
+            _write_atomic(path+'.hash', key.encode('ascii'))
+        print("Compiling and saving done.")
+    if cache_dir is not None:
+        _evict_models(cache_dir, cache_size, path+'.pkl')
     return sm
 
 
-def stan_sample_time(model, **sampling_kwargs):
+def stan_sample_time(model, return_warmup_time=False, **sampling_kwargs):
     """Perform stan sampling while capturing the sampling time.
 
     All provided keyword arguments are passed to the model sampling method.
@@ -699,6 +1276,10 @@ def stan_sample_time(model, **sampling_kwargs):
     model : pystan.StanModel
         the model to be sampled
 
+    return_warmup_time : bool, optional
+        If True, also the maximum of the warm-up times of the chains is
+        returned. Default is False.
+
     Returns
     -------
     fit : pystan fit-object
@@ -707,6 +1288,10 @@ def stan_sample_time(model, **sampling_kwargs):
     max_sampling_time : float
         the maximum of the sampling times of the chains
 
+    max_warmup_time : float
+        the maximum of the warm-up times of the chains, returned only if
+        `return_warmup_time` is True
+
     """
     # ensure stan param refresh is -1 to suppress some unnecessary output
     sampling_kwargs['refresh'] = -1
@@ -721,6 +1306,13 @@ def stan_sample_time(model, **sampling_kwargs):
     # find the maximum total sampling time from the output
     max_sampling_time = max(
         map(float, re.findall('[0-9]+\.[0-9]+(?= seconds \(Total\))', out)))
+    if return_warmup_time:
+        # find the maximum warm-up time from the output
+        max_warmup_time = max(map(
+            float,
+            re.findall('[0-9]+\.[0-9]+(?= seconds \(Warm-up\))', out)
+        ))
+        return fit, max_sampling_time, max_warmup_time
     return fit, max_sampling_time
 
 
@@ -812,12 +1404,16 @@ def _stan_sample_subprocess_routine(
         The last sample of the chains.
 
     """
+    queue.put(_stan_sample_info(load_stan(model), pars, sampling_kwargs))
+
+
+def _stan_sample_info(model, pars, sampling_kwargs):
+    """Fit a loaded model and collect the info of stan_sample_subprocess."""
     # ensure sequence
     if isinstance(pars, str):
         pars = (pars,)
 
     # sample from the model
-    model = load_stan(model)
     fit, max_sampling_time = stan_sample_time(model, **sampling_kwargs)
 
     # extract samples
@@ -837,9 +1433,101 @@ def _stan_sample_subprocess_routine(
     # max Rhat (from all but last row in the last column)
     max_rhat = np.max(fit.summary()['summary'][:-1,-1])
 
-    # return info in the queue
-    ret = (samples, max_sampling_time, mean_stepsize, max_rhat, lastsamp)
-    queue.put(ret)
+    return samples, max_sampling_time, mean_stepsize, max_rhat, lastsamp
+
+
+# Model of the StanSamplePool process
+_pool_model = None
+
+def _stan_pool_init(model):
+    global _pool_model
+    _pool_model = load_stan(model)
+
+def _stan_pool_sample(args):
+    i, pars, sampling_kwargs = args
+    return i, _stan_sample_info(_pool_model, pars, sampling_kwargs)
+
+
+class StanSamplePool(object):
+    """Pool of resident processes sampling the same Stan model concurrently.
+
+    Each process loads the model once when the pool is created and then
+    samples it with different data, e.g. for the sites of consensus Monte
+    Carlo, which avoids loading the model for every fit as in
+    stan_sample_subprocess. As the pool processes may not start processes
+    themselves, the chains of each fit are run one after another in its
+    process (`n_jobs` = 1), and the parallelism comes from running several
+    fits at once.
+
+    Parameters
+    ----------
+    model : str
+        Path to the stan model. Provided for :meth:`load_stan()` so that
+        precompiled model is used if found.
+
+    processes : int, optional
+        The number of processes. By default, the number of CPUs is used.
+
+    """
+
+    def __init__(self, model, processes=None):
+        self._pool = multiprocessing.Pool(
+            processes, initializer=_stan_pool_init, initargs=(model,))
+
+    def sample(self, pars, sampling_kwargs_list):
+        """Fit the model once for each of the given sampling arguments.
+
+        Parameters
+        ----------
+        pars : str or sequence of str
+            Parameter names of which samples are returned.
+
+        sampling_kwargs_list : sequence of dict
+            Keyword arguments passed to the model sampling method for each fit.
+
+        Returns
+        -------
+        out : list of tuple
+            The output of each fit as returned by stan_sample_subprocess in
+            the order of `sampling_kwargs_list`.
+
+        """
+        out = [None]*len(sampling_kwargs_list)
+        for i, out_i in self.sample_iter(pars, sampling_kwargs_list):
+            out[i] = out_i
+        return out
+
+    def sample_iter(self, pars, sampling_kwargs_list):
+        """Fit the model for the given sampling arguments as in method sample.
+
+        Yields the tuples (i, out), where i is the index of the fit in
+        `sampling_kwargs_list` and out is its output, in the order in which the
+        fits finish, so that e.g. the samples of each fit can be processed and
+        discarded while the others are still running.
+
+        """
+        args = [
+            (i, pars, dict(sampling_kwargs, n_jobs=1))
+            for i, sampling_kwargs in enumerate(sampling_kwargs_list)
+        ]
+        for out in self._pool.imap_unordered(
+                _stan_pool_sample, args, chunksize=1):
+            yield out
+
+    def close(self):
+        """Terminate the processes."""
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Lock serialising the redirections of the process-wide file descriptors
+_redirect_lock = threading.RLock()
 
 
 # The following contextmanager code is made separately by Tuomas Sivula.
@@ -852,7 +1540,11 @@ def redirect_stdout_stderr_deep(file_out=None, file_err=None):
     Contextmanager for redirecting stdout and stderr into given files or null
     devices. Reassigns the file descriptors so that also child processes streams
     are redirected (compare to the built-in
-    :meth:`contextlib.redirect_stdout()`).
+    :meth:`contextlib.redirect_stdout()`). As the file descriptors are shared
+    by the whole process, the redirections of concurrent threads are
+    serialised, i.e. a thread entering the context waits until the others have
+    exited it. The original file descriptors are restored also if an exception
+    is raised.
 
     Parameters
     ----------
@@ -865,28 +1557,42 @@ def redirect_stdout_stderr_deep(file_out=None, file_err=None):
         descriptor. If not provided, the respective stream is suppressed.
 
     """
-    # check if stdout redirected or suppressed
-    if file_out is not None:
-        fd_out = file_out.fileno()
-    else:
-        fd_out = os.open(os.devnull, os.O_RDWR)
-    # check if stderr redirected or suppressed
-    if file_err is not None:
-        fd_err = file_err.fileno()
-    else:
-        fd_err = os.open(os.devnull, os.O_RDWR)
-    # save a copy of the original file descriptors
-    orig_stdout = sys.stdout.fileno()
-    orig_stderr = sys.stderr.fileno()
-    orig_stdout_dup = os.dup(orig_stdout)
-    orig_stderr_dup = os.dup(orig_stderr)
-    # set new file descriptors
-    os.dup2(fd_out, orig_stdout)
-    os.dup2(fd_err, orig_stderr)
-
-    yield
-
-    # __exit__
-    # assign the original fd(s) back
-    os.dup2(orig_stdout_dup, orig_stdout)
-    os.dup2(orig_stderr_dup, orig_stderr)
+    with _redirect_lock:
+        # check if stdout redirected or suppressed
+        if file_out is not None:
+            fd_out = file_out.fileno()
+        else:
+            fd_out = os.open(os.devnull, os.O_RDWR)
+        # check if stderr redirected or suppressed
+        if file_err is not None:
+            fd_err = file_err.fileno()
+        else:
+            fd_err = os.open(os.devnull, os.O_RDWR)
+        # save a copy of the original file descriptors
+        orig_stdout = sys.stdout.fileno()
+        orig_stderr = sys.stderr.fileno()
+        orig_stdout_dup = os.dup(orig_stdout)
+        orig_stderr_dup = os.dup(orig_stderr)
+        try:
+            # flush the python buffers written before the redirection
+            sys.stdout.flush()
+            sys.stderr.flush()
+            # set new file descriptors
+            os.dup2(fd_out, orig_stdout)
+            os.dup2(fd_err, orig_stderr)
+
+            yield
+
+        finally:
+            # __exit__
+            sys.stdout.flush()
+            sys.stderr.flush()
+            # assign the original fd(s) back
+            os.dup2(orig_stdout_dup, orig_stdout)
+            os.dup2(orig_stderr_dup, orig_stderr)
+            os.close(orig_stdout_dup)
+            os.close(orig_stderr_dup)
+            if file_out is None:
+                os.close(fd_out)
+            if file_err is None:
+                os.close(fd_err)
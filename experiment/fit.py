@@ -3,12 +3,15 @@ algorithm described in an article "Expectation propagation as a way of life"
 (arXiv:1412.4869).
 
 usage: fit.py [-h] [--J P] [--D P] [--npg P [P ...]] [--cor_input B]
-              [--run_all B] [--run_ep B] [--run_full B] [--run_consensus B]
-              [--run_target B] [--iter P] [--siter P] [--target_siter P]
-              [--chains P] [--K P] [--damp F] [--mix B] [--prec_estim S]
-              [--seed_data N] [--seed_ep N] [--seed_full N] [--seed_cons N]
-              [--seed_target N] [--id S] [--save_true B] [--save_res B]
-              [--save_target_samp B]
+              [--data_cache B] [--run_all B] [--run_ep B] [--run_full B]
+              [--run_consensus B] [--run_target B] [--iter P] [--tol F]
+              [--patience P] [--siter P] [--target_siter P] [--chains P]
+              [--K P] [--damp F] [--mix B] [--prec_estim S] [--recoveries N]
+              [--laplace_iters N] [--laplace_init B] [--cons_procs N]
+              [--cons_weighting B] [--full_incremental B] [--seed_data N]
+              [--seed_ep N] [--seed_full N] [--seed_cons N] [--seed_target N]
+              [--id S] [--save_true B] [--save_res B] [--save_target_samp B]
+              [--history B] [--profile B]
               model_name
 
 positional arguments:
@@ -23,6 +26,9 @@ optional arguments - data:
   --npg P [P ...]       number of observations per group (constant or min
                         max), default 20
   --cor_input B         correlated input variable, default False
+  --data_cache B        store the simulated data in the dataset cache and load
+                        it from there if found (see
+                        models.common.simulate_data_cached), default False
 
 optional arguments - selected methods:
   --run_all B           run all the methods, default False
@@ -34,6 +40,12 @@ optional arguments - selected methods:
 optional arguments - iterations:
   --iter P              number of distributed EP iterations, default
                         max(4*K, 20)
+  --tol F               tolerance of the KL-divergence between consecutive
+                        global approximations for stopping the distributed EP
+                        iterations early (see epstan.method.Master.run),
+                        default None
+  --patience P          number of consecutive iterations below the tolerance
+                        for stopping early, default 2
   --siter P             Stan iterations in each major iteration, default 400
   --target_siter P      Stan iterations for the target approximation, default
                         1000
@@ -46,6 +58,27 @@ optional arguments - method options:
   --prec_estim S        estimate method for tilted distribution precision
                         matrix, currently available options are sample and
                         olse (see epstan.method.Master), default sample
+  --recoveries N        max number of rollback-and-retry recoveries in one
+                        distributed EP iteration when the damping fails (see
+                        epstan.method.Master), default 0
+  --laplace_iters N     number of the first distributed EP iterations in which
+                        the tilted distributions are approximated at their
+                        mode instead of sampling (see epstan.method.Master),
+                        default 0
+  --laplace_init B      initialise the sites with the Laplace approximations of
+                        their likelihoods (see epstan.method.Master), default
+                        False
+  --cons_procs N        number of resident processes sampling the consensus
+                        MC sites concurrently, None uses the number of CPUs
+                        and 0 samples the sites one after another, default
+                        None
+  --cons_weighting B    combine the consensus MC draws of the sites with the
+                        precision weighting of consensus MC instead of pooling
+                        them, default False
+  --full_incremental B  sample the full model once with the largest number of
+                        iterations and estimate the moments of each smaller
+                        number of iterations from the prefixes of the chains,
+                        default False
 
 optional arguments - seeds for randomisation:
   --seed_data N         seed for data simulation, default 100
@@ -60,6 +93,11 @@ optional arguments - saving options:
   --save_true B         save true values, default True
   --save_res B          save results, default True
   --save_target_samp B  save target approximation samples, default False
+  --history B           save the distributed EP iteration history on disk
+                        incrementally instead of keeping it in the memory,
+                        default False
+  --profile B           profile the stages of the distributed EP iterations
+                        and save a Chrome trace of them, default False
 
 Argument types
 - N denotes a non-negative and P a positive integer argument.
@@ -79,10 +117,18 @@ the results of consensus MC method are saved into file
     `res_c_<model_name>.npz`
 and the true values are saved into the file
     `true_vals_<model_name>.npz`
-into the folder results.
+into the folder results. If option history is set, the means and covariances
+of the distributed method iterations are saved into the on-disk history
+    `hist_d_<model_name>`
+(see epstan.history) instead of the file `res_d_<model_name>.npz`. If option
+profile is set, the timeline of the stages of the distributed method
+iterations is saved into the Chrome trace file
+    `trace_d_<model_name>.json`
+(see epstan.profiling).
 
 After running this skript for all the methods, the script plot_res.py can be
-used to plot the results.
+used to plot the results. The script run_grid.py runs this experiment over a
+grid of models and configurations in parallel.
 
 The most recent version of the code can be found on GitHub:
 https://github.com/gelman/ep-stan
@@ -97,13 +143,12 @@ https://github.com/gelman/ep-stan
 
 
 import os
+import time
 import argparse
 
 import numpy as np
 from scipy import linalg
 
-import pystan
-
 
 # Add parent dir to sys.path if not present already. This is only done because
 # of easy importing of the package epstan. Adding the parent directory into the
@@ -118,17 +163,23 @@ if os.path.exists(os.path.join(PARENT_PATH, 'epstan')):
         os.sys.path.insert(0, PARENT_PATH)
 
 from epstan.method import Master
+from epstan.backends import TiltedBackend
+from epstan.history import History
+from epstan.profiling import Profiler
 from epstan.util import (
-    load_stan, distribute_groups, stan_sample_time, stan_sample_subprocess)
+    load_stan, distribute_groups, stan_sample_time, stan_sample_subprocess,
+    StanSamplePool, ConsensusCombiner, MomentAccumulator, split_rhat_ess
+)
 
 
 CONFS = [
-    'J', 'D', 'npg', 'cor_input',
+    'J', 'D', 'npg', 'cor_input', 'data_cache',
     'run_all', 'run_ep', 'run_full', 'run_consensus', 'run_target',
-    'iter', 'siter', 'target_siter', 'chains',
-    'K', 'damp', 'mix', 'prec_estim',
+    'iter', 'tol', 'patience', 'siter', 'target_siter', 'chains',
+    'K', 'damp', 'mix', 'prec_estim', 'recoveries', 'laplace_iters',
+    'laplace_init', 'cons_procs', 'cons_weighting', 'full_incremental',
     'seed_data', 'seed_ep', 'seed_full', 'seed_cons', 'seed_target',
-    'id', 'save_true', 'save_res', 'save_target_samp',
+    'id', 'save_true', 'save_res', 'save_target_samp', 'history', 'profile',
 ]
 
 CONF_DEFAULT = dict(
@@ -138,6 +189,7 @@ CONF_DEFAULT = dict(
     K                = 32,
     npg              = 20,
     cor_input        = True,
+    data_cache       = False,
 
     run_all          = False,
     run_ep           = False,
@@ -146,6 +198,8 @@ CONF_DEFAULT = dict(
     run_target       = False,
 
     iter             = None,
+    tol              = None,
+    patience         = 2,
     siter            = 200,
     target_siter     = 10000,
     chains           = 4,
@@ -153,6 +207,12 @@ CONF_DEFAULT = dict(
     damp             = None,
     mix              = False,
     prec_estim       = 'sample',
+    recoveries       = 0,
+    laplace_iters    = 0,
+    laplace_init     = False,
+    cons_procs       = None,
+    cons_weighting   = False,
+    full_incremental = False,
 
     seed_data        = 100,
     seed_ep          = 1,
@@ -164,6 +224,8 @@ CONF_DEFAULT = dict(
     save_true        = True,
     save_res         = True,
     save_target_samp = False,
+    history          = False,
+    profile          = False,
 
 )
 
@@ -230,12 +292,16 @@ def main(model_name, conf, ret_master=False):
     # Import the model simulator module (import at runtime)
     model_module = getattr(__import__('models.'+model_name), model_name)
     model = model_module.model(J, D, conf.npg)
+    from models.common import simulate_data_cached
 
     # Simulate_data
-    if conf.cor_input:
-        data = model.simulate_data(Sigma_x='rand', rng=conf.seed_data)
+    Sigma_x = 'rand' if conf.cor_input else None
+    if conf.data_cache:
+        # Reuse the data simulated in earlier runs
+        data = simulate_data_cached(
+            model, model_name, Sigma_x=Sigma_x, seed=conf.seed_data)
     else:
-        data = model.simulate_data(rng=conf.seed_data)
+        data = model.simulate_data(Sigma_x=Sigma_x, rng=conf.seed_data)
 
     # Calculate the uncertainty
     uncertainty_global, uncertainty_group = data.calc_uncertainty()
@@ -246,7 +312,11 @@ def main(model_name, conf, ret_master=False):
 
     #~ # Set init_site to N(0,A**2/K I), where A = 10 * max(diag(S0))
     #~ init_site = 10 * np.max(np.diag(S0))
-    init_site = None # Zero initialise the sites
+    if conf.laplace_init:
+        # Initialise the sites with the Laplace approximations
+        init_site = 'laplace'
+    else:
+        init_site = None # Zero initialise the sites
 
     # Get parameter information
     pnames, pshapes, phiers = model.get_param_definitions()
@@ -298,6 +368,9 @@ def main(model_name, conf, ret_master=False):
             prec_estim = conf.prec_estim,
             df0 = df0,
             init_site = init_site,
+            max_recoveries = conf.recoveries,
+            laplace_iters = conf.laplace_iters,
+            profiler = Profiler() if conf.profile else None,
             chains = conf.chains,
             iter = conf.siter,
             warmup = None,
@@ -350,30 +423,78 @@ def main(model_name, conf, ret_master=False):
         # initial approximation
         S_ep_init, m_ep_init = epstan_master.cur_approx()
 
+        if conf.history:
+            # Save the iterations into the on-disk history
+            if conf.id:
+                hist_name = 'hist_d_{}_{}'.format(model_name, conf.id)
+            else:
+                hist_name = 'hist_d_{}'.format(model_name)
+            history = History(
+                os.path.join(RES_PATH, hist_name),
+                dphi = epstan_master.dphi,
+                packed = True
+            )
+            history.append(m_ep_init, S_ep_init, time=0.0)
+        else:
+            history = None
+
         # Run the algorithm for `EP_ITER` iterations
         print(
             "Run distributed EP algorithm for {} iterations."
             .format(iters_to_run)
         )
-        (
-            info,
-            (m_s_ep, S_s_ep),
-            (time_s_ep, mstepsize_s_ep, mrhat_s_ep, othertimes)
-        ) = (
-            epstan_master.run(
-                iters_to_run,
-                return_analytics = True,
-                save_last_param = pnames if conf.mix else None,
-                seed = conf.seed_ep
-            )
+        run_out = epstan_master.run(
+            iters_to_run,
+            calc_moments = history is None,
+            return_analytics = True,
+            save_last_param = pnames if conf.mix else None,
+            seed = conf.seed_ep,
+            tol = conf.tol,
+            patience = conf.patience,
+            history = history
         )
+        if history is None:
+            (
+                info,
+                (m_s_ep, S_s_ep),
+                (time_s_ep, mstepsize_s_ep, mrhat_s_ep, othertimes)
+            ) = run_out
+        else:
+            (
+                info,
+                (time_s_ep, mstepsize_s_ep, mrhat_s_ep, othertimes)
+            ) = run_out
+            history.close()
+        if epstan_master.converged:
+            print(
+                "Converged after {} iterations by criterion {}."
+                .format(epstan_master.iter, epstan_master.converged)
+            )
+
+        if conf.profile:
+            print("Profile of the distributed EP iterations:")
+            print(epstan_master.profiler.summary())
+            if not os.path.exists(RES_PATH):
+                os.makedirs(RES_PATH)
+            if conf.id:
+                filename = 'trace_d_{}_{}.json'.format(model_name, conf.id)
+            else:
+                filename = 'trace_d_{}.json'.format(model_name)
+            epstan_master.profiler.save_chrome_trace(
+                os.path.join(RES_PATH, filename))
+            print("Chrome trace saved into results.")
 
         # cumulate elapsed time in the sampling runtime analysis
         time_s_ep = time_s_ep.cumsum()
 
         # add initial approx info
-        S_s_ep = np.concatenate((S_ep_init[None,:,:], S_s_ep), axis=0)
-        m_s_ep = np.concatenate((m_ep_init[None,:], m_s_ep), axis=0)
+        if history is None:
+            S_s_ep = np.concatenate((S_ep_init[None,:,:], S_s_ep), axis=0)
+            m_s_ep = np.concatenate((m_ep_init[None,:], m_s_ep), axis=0)
+            moments = dict(m_s_ep=m_s_ep, S_s_ep=S_s_ep)
+        else:
+            # moments are found in the history
+            moments = dict(history=hist_name)
         time_s_ep = np.insert(time_s_ep, 0, 0.0)
         mstepsize_s_ep = np.insert(mstepsize_s_ep, 0, np.nan)
         mrhat_s_ep = np.insert(mrhat_s_ep, 0, np.nan)
@@ -391,12 +512,13 @@ def main(model_name, conf, ret_master=False):
                 np.savez(
                     os.path.join(RES_PATH, filename),
                     conf = conf.__dict__,
-                    m_s_ep = m_s_ep,
-                    S_s_ep = S_s_ep,
+                    **moments,
                     time_s_ep = time_s_ep,
                     mstepsize_s_ep = mstepsize_s_ep,
                     mrhat_s_ep = mrhat_s_ep,
                     othertimes = othertimes,
+                    recoveries = epstan_master.recoveries,
+                    telemetry = epstan_master.telemetry,
                     last_iter = epstan_master.iter
                 )
                 print("Uncomplete distributed model results saved.")
@@ -431,12 +553,14 @@ def main(model_name, conf, ret_master=False):
                 np.savez(
                     os.path.join(RES_PATH, filename),
                     conf = conf.__dict__,
-                    m_s_ep = m_s_ep,
-                    S_s_ep = S_s_ep,
+                    **moments,
                     time_s_ep = time_s_ep,
                     mstepsize_s_ep = mstepsize_s_ep,
                     mrhat_s_ep = mrhat_s_ep,
                     othertimes = othertimes,
+                    recoveries = epstan_master.recoveries,
+                    telemetry = epstan_master.telemetry,
+                    converged = epstan_master.converged or '',
                     m_phi_ep = m_ep,
                     S_phi_ep = S_ep,
                     **presults
@@ -445,11 +569,13 @@ def main(model_name, conf, ret_master=False):
                 np.savez(
                     os.path.join(RES_PATH, filename),
                     conf = conf.__dict__,
-                    m_s_ep = m_s_ep,
-                    S_s_ep = S_s_ep,
+                    **moments,
                     time_s_ep = time_s_ep,
                     mstepsize_s_ep = mstepsize_s_ep,
                     mrhat_s_ep = mrhat_s_ep,
+                    recoveries = epstan_master.recoveries,
+                    telemetry = epstan_master.telemetry,
+                    converged = epstan_master.converged or '',
                 )
             print("Distributed model results saved.")
 
@@ -476,42 +602,50 @@ def main(model_name, conf, ret_master=False):
             Omega_phi = Q0.T    # Q0 transposed in order to get C-contiguous
         )
 
-        # sample multiple times with different number of iterations
         # preallocate output arrays
         m_s_full = np.full((len(FULL_ITERS), model.dphi), np.nan)
         S_s_full = np.full((len(FULL_ITERS), model.dphi, model.dphi), np.nan)
         time_s_full = np.full(len(FULL_ITERS), np.nan)
         mstepsize_s_full = np.full(len(FULL_ITERS), np.nan)
         mrhat_s_full = np.full(len(FULL_ITERS), np.nan)
-        for i, iters in enumerate(FULL_ITERS):
 
-            print('  iter {}: {}'.format(i+1, iters))
+        if conf.full_incremental:
+            # sample once with the largest number of iterations and use the
+            # prefixes of the chains for the smaller numbers of iterations
+            full_incremental(
+                model_name, model.dphi, data_full, conf, m_s_full, S_s_full,
+                time_s_full, mstepsize_s_full, mrhat_s_full)
+        else:
+            # sample multiple times with different number of iterations
+            for i, iters in enumerate(FULL_ITERS):
 
-            # use same seed for each iteration
-            seed = np.random.RandomState(seed=conf.seed_full)
-
-            # Sample and extract samples
-            (samples, max_sampling_time, mean_stepsize, max_rhat, _
-            ) = stan_sample_subprocess(
-                model = os.path.join(MOD_PATH, model_name),
-                pars = 'phi',
-                data = data_full,
-                seed = seed,
-                chains = conf.chains,
-                iter = iters,
-                thin = 1
-            )
-            time_s_full[i] = max_sampling_time
-            mstepsize_s_full[i] = mean_stepsize
-            mrhat_s_full[i] = max_rhat
-            samples = samples['phi']
+                print('  iter {}: {}'.format(i+1, iters))
 
-            # Moment estimates
-            nsamp = samples.shape[0]
-            samples.mean(axis=0, out=m_s_full[i])
-            samples -= m_s_full[i]
-            samples.T.dot(samples, out=S_s_full[i])
-            S_s_full[i] /= nsamp - 1
+                # use same seed for each iteration
+                seed = np.random.RandomState(seed=conf.seed_full)
+
+                # Sample and extract samples
+                (samples, max_sampling_time, mean_stepsize, max_rhat, _
+                ) = stan_sample_subprocess(
+                    model = os.path.join(MOD_PATH, model_name),
+                    pars = 'phi',
+                    data = data_full,
+                    seed = seed,
+                    chains = conf.chains,
+                    iter = iters,
+                    thin = 1
+                )
+                time_s_full[i] = max_sampling_time
+                mstepsize_s_full[i] = mean_stepsize
+                mrhat_s_full[i] = max_rhat
+                samples = samples['phi']
+
+                # Moment estimates
+                nsamp = samples.shape[0]
+                samples.mean(axis=0, out=m_s_full[i])
+                samples -= m_s_full[i]
+                samples.T.dot(samples, out=S_s_full[i])
+                S_s_full[i] /= nsamp - 1
 
         # Save results
         if conf.save_res:
@@ -602,56 +736,75 @@ def main(model_name, conf, ret_master=False):
         # determine seeds for each site, constant for each iteration
         seeds = (
             np.random.RandomState(seed=conf.seed_cons)
-            .randint(0, pystan.constants.MAX_UINT, size=K)
+            .randint(0, TiltedBackend.MAX_SEED, size=K)
         )
         # preallocate output arrays
         m_s_cons = np.full((len(CONS_ITERS), model.dphi), np.nan)
         S_s_cons = np.full((len(CONS_ITERS), model.dphi, model.dphi), np.nan)
         time_s_cons = np.full(len(CONS_ITERS), np.nan)
+        walltime_s_cons = np.full(len(CONS_ITERS), np.nan)
         mstepsize_s_cons = np.full(len(CONS_ITERS), np.nan)
         mrhat_s_cons = np.full(len(CONS_ITERS), np.nan)
+        if conf.cons_procs != 0:
+            # Resident processes sampling the sites concurrently
+            cons_pool = StanSamplePool(
+                stan_model_name, processes=conf.cons_procs)
         for i, iters in enumerate(CONS_ITERS):
 
             print('  iter {}: {}'.format(i+1, iters))
 
             # sample for each site
-            samples = []
+            combiner = ConsensusCombiner(
+                model.dphi, weighting=conf.cons_weighting)
             times = np.full(K, np.nan)
             mstepsizes = np.full(K, np.nan)
             mrhats = np.full(K, np.nan)
-            for k in range(K):
-
-                (samples_k, max_sampling_time, mean_stepsize, max_rhat, _
-                ) = stan_sample_subprocess(
-                    model = stan_model_name,
-                    pars = 'phi',
+            sampling_kwargs = [
+                dict(
                     data = data_k[k],
                     seed = seeds[k],
                     chains = conf.chains,
                     iter = iters,
-                    thin = 1,
+                    thin = 1
+                )
+                for k in range(K)
+            ]
+            start_wall = time.time()
+            if conf.cons_procs != 0:
+                outs = cons_pool.sample_iter('phi', sampling_kwargs)
+            else:
+                outs = (
+                    (k, stan_sample_subprocess(
+                        model=stan_model_name, pars='phi', **kwargs))
+                    for k, kwargs in enumerate(sampling_kwargs)
                 )
+            # Combine the draws of each site as soon as it is sampled
+            for k, out in outs:
+                (samples_k, max_sampling_time, mean_stepsize, max_rhat, _
+                ) = out
                 times[k] = max_sampling_time
                 mstepsizes[k] = mean_stepsize
                 mrhats[k] = max_rhat
-                samples.append(samples_k['phi'])
+                combiner.add(samples_k['phi'])
+                del samples_k, out
+            walltime_s_cons[i] = time.time() - start_wall
 
             # Moment estimates
-            # TODO make more efficient similar as in Master.mix_phi()
-            samp = np.concatenate(samples, axis=0)
-            nsamp = samp.shape[0]
-            samp.mean(axis=0, out=m_s_cons[i])
-            samp -= m_s_cons[i]
-            samp.T.dot(samp, out=S_s_cons[i])
-            S_s_cons[i] /= nsamp - 1
+            m_s_cons[i], S_s_cons[i] = combiner.moments()
 
             # diagnostics
             time_s_cons[i] = np.max(times)
             mstepsize_s_cons[i] = np.mean(mstepsizes)
             mrhat_s_cons[i] = np.max(mrhats)
 
+            print('    max site time {:.4g} s, wall time {:.4g} s'.format(
+                time_s_cons[i], walltime_s_cons[i]))
+
             # dereference samples
-            del samples, samp
+            del combiner
+
+        if conf.cons_procs != 0:
+            cons_pool.close()
 
         # Save results
         if conf.save_res:
@@ -667,6 +820,7 @@ def main(model_name, conf, ret_master=False):
                 m_s_cons = m_s_cons,
                 S_s_cons = S_s_cons,
                 time_s_cons = time_s_cons,
+                walltime_s_cons = walltime_s_cons,
                 mstepsize_s_cons = mstepsize_s_cons,
                 mrhat_s_cons = mrhat_s_cons,
             )
@@ -760,6 +914,59 @@ def main(model_name, conf, ret_master=False):
         print("Done with target approximation")
 
 
+def full_incremental(model_name, dphi, data_full, conf, m_s_full, S_s_full,
+                     time_s_full, mstepsize_s_full, mrhat_s_full):
+    """Estimate the full model moments of FULL_ITERS from one long run.
+
+    The chains are sampled once with max(FULL_ITERS) iterations, of which the
+    first half is warmup as by default in Stan. For each number of iterations
+    `iters` in FULL_ITERS, the moments are estimated from the first
+    `iters - iters//2` post-warmup draws of each chain, that is, the number of
+    draws the separate run with `iters` iterations would yield. The moments are
+    accumulated from the increments between the consecutive prefixes. The
+    results are written into the given output arrays in place.
+
+    As PyStan can not continue sampling from a saved adaptation state, all the
+    prefixes share the warmup of the longest run, which makes the estimates of
+    the small numbers of iterations somewhat better than those of separate
+    short runs. The sampling time of each prefix is estimated as the
+    corresponding proportion of the sampling time of the whole run, the step
+    size is the one adapted in the whole run and the Rhat is the max split-Rhat
+    of the parameters phi in the prefix.
+
+    """
+    iters_max = max(FULL_ITERS)
+    print('  iter {}, checkpoints: {}'.format(
+        iters_max, ', '.join(map(str, FULL_ITERS))))
+
+    (samples, max_sampling_time, mean_stepsize, _, _
+    ) = stan_sample_subprocess(
+        model = os.path.join(MOD_PATH, model_name),
+        pars = 'phi',
+        data = data_full,
+        seed = np.random.RandomState(seed=conf.seed_full),
+        chains = conf.chains,
+        iter = iters_max,
+        thin = 1
+    )
+    # the chains are stacked in the samples
+    draws = samples['phi'].reshape(conf.chains, -1, dphi)
+
+    acc = MomentAccumulator(dphi)
+    n_prev = 0
+    for i in np.argsort(FULL_ITERS, kind='stable'):
+        iters = FULL_ITERS[i]
+        n = iters - iters//2
+        if n > n_prev:
+            acc.add(draws[:, n_prev:n].reshape(-1, dphi))
+            n_prev = n
+        m_s_full[i] = acc.mean
+        S_s_full[i] = acc.cov(ddof=1)
+        time_s_full[i] = max_sampling_time * iters / iters_max
+        mstepsize_s_full[i] = mean_stepsize
+        mrhat_s_full[i] = np.nanmax(split_rhat_ess(draws[:, :n])[0])
+
+
 def _create_pmaps(phiers, J, K, Ns):
     """Create the mappings for hierarhical parameters."""
     if K < 2:
@@ -874,6 +1081,12 @@ def _parse_damp(arg):
         raise ValueError("Invalid damp option")
     return f
 
+def _parse_positive_float(arg):
+    f = float(arg)
+    if f <= 0.0:
+        raise ValueError("Invalid float option")
+    return f
+
 def _parse_nonnegative_int(arg):
     if arg.isalnum():
         return int(arg)
@@ -887,6 +1100,10 @@ CONF_HELP = dict(
     K                = 'number of sites',
     npg              = 'number of observations per group (constant or min max)',
     cor_input        = 'correlated input variable',
+    data_cache       = (
+        'store the simulated data in the dataset cache and load it from there '
+        'if found (see models.common.simulate_data_cached)'
+    ),
 
     run_all          = 'run all the methods',
     run_ep           = 'run the distributed EP method',
@@ -895,6 +1112,15 @@ CONF_HELP = dict(
     run_target       = 'run target approximation',
 
     iter             = 'number of distributed EP iterations',
+    tol              = (
+        'tolerance of the KL-divergence between consecutive global '
+        'approximations for stopping the distributed EP iterations early '
+        '(see epstan.method.Master.run)'
+    ),
+    patience         = (
+        'number of consecutive iterations below the tolerance for stopping '
+        'early'
+    ),
     siter            = 'Stan iterations in each major iteration',
     target_siter     = 'Stan iterations for the target approximation',
     chains           = 'number of chains used in stan sampling',
@@ -906,6 +1132,33 @@ CONF_HELP = dict(
         'matrix, currently available options are sample and olse '
         '(see epstan.method.Master)'
     ),
+    recoveries       = (
+        'max number of rollback-and-retry recoveries in one distributed EP '
+        'iteration when the damping fails (see epstan.method.Master)'
+    ),
+    laplace_iters    = (
+        'number of the first distributed EP iterations in which the tilted '
+        'distributions are approximated at their mode instead of sampling '
+        '(see epstan.method.Master)'
+    ),
+    laplace_init     = (
+        'initialise the sites with the Laplace approximations of their '
+        'likelihoods (see epstan.method.Master)'
+    ),
+    cons_procs       = (
+        'number of resident processes sampling the consensus MC sites '
+        'concurrently, None uses the number of CPUs and 0 samples the sites '
+        'one after another'
+    ),
+    cons_weighting   = (
+        'combine the consensus MC draws of the sites with the precision '
+        'weighting of consensus MC instead of pooling them'
+    ),
+    full_incremental = (
+        'sample the full model once with the largest number of iterations '
+        'and estimate the moments of each smaller number of iterations from '
+        'the prefixes of the chains'
+    ),
 
     seed_data        = 'seed for data simulation',
     seed_ep          = 'seed for distributed EP sampling',
@@ -917,6 +1170,14 @@ CONF_HELP = dict(
     save_true        = 'save true values',
     save_res         = 'save results',
     save_target_samp = 'save target approximation samples',
+    history          = (
+        'save the distributed EP iteration history on disk incrementally '
+        'instead of keeping it in the memory'
+    ),
+    profile          = (
+        'profile the stages of the distributed EP iterations and save a '
+        'Chrome trace of them'
+    ),
 
 )
 
@@ -939,6 +1200,7 @@ CONF_CUSTOMS = dict(
     K                = dict(type=_parse_positive_int, metavar='P'),
     npg              = dict(nargs='+', type=_parse_positive_int, metavar='P'),
     cor_input        = dict(type=_parse_bool, metavar='B'),
+    data_cache       = dict(type=_parse_bool, metavar='B'),
 
     run_all          = dict(type=_parse_bool, metavar='B'),
     run_ep           = dict(type=_parse_bool, metavar='B'),
@@ -947,6 +1209,8 @@ CONF_CUSTOMS = dict(
     run_target       = dict(type=_parse_bool, metavar='B'),
 
     iter             = dict(type=_parse_positive_int, metavar='P'),
+    tol              = dict(type=_parse_positive_float, metavar='F'),
+    patience         = dict(type=_parse_positive_int, metavar='P'),
     siter            = dict(type=_parse_positive_int, metavar='P'),
     target_siter     = dict(type=_parse_positive_int, metavar='P'),
     chains           = dict(type=_parse_positive_int, metavar='P'),
@@ -954,6 +1218,12 @@ CONF_CUSTOMS = dict(
     damp             = dict(type=_parse_damp, metavar='F'),
     mix              = dict(type=_parse_bool, metavar='B'),
     prec_estim       = dict(metavar='S'),
+    recoveries       = dict(type=_parse_nonnegative_int, metavar='N'),
+    laplace_iters    = dict(type=_parse_nonnegative_int, metavar='N'),
+    laplace_init     = dict(type=_parse_bool, metavar='B'),
+    cons_procs       = dict(type=_parse_nonnegative_int, metavar='N'),
+    cons_weighting   = dict(type=_parse_bool, metavar='B'),
+    full_incremental = dict(type=_parse_bool, metavar='B'),
 
     seed_data        = dict(type=_parse_nonnegative_int, metavar='N'),
     seed_ep          = dict(type=_parse_nonnegative_int, metavar='N'),
@@ -965,6 +1235,8 @@ CONF_CUSTOMS = dict(
     save_true        = dict(type=_parse_bool, metavar='B'),
     save_res         = dict(type=_parse_bool, metavar='B'),
     save_target_samp = dict(type=_parse_bool, metavar='B'),
+    history          = dict(type=_parse_bool, metavar='B'),
+    profile          = dict(type=_parse_bool, metavar='B'),
 
 )
 
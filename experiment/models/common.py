@@ -7,6 +7,14 @@
 # All rights reserved.
 
 
+import os
+import sys
+import json
+import pickle
+import shutil
+import hashlib
+import tempfile
+
 import numpy as np
 from scipy.special import erfinv, logit
 
@@ -34,9 +42,20 @@ def rand_corr_vine(d, alpha=2, beta=2, pmin=-0.8, pmax=0.8, seed=None):
     """Create random correlation matrix using modified vine method.
 
     Each partial corelation is distributed according to Beta(alpha, beta)
-    shifted and scaled to [pmin, pmax]. This method could be further optimised.
-    Does not necessarily return pos-def matrix if high correlations are
-    imposed.
+    shifted and scaled to [pmin, pmax]. The matrix is positive definite in exact
+    arithmetic, but it may be numerically singular for large d or if high
+    correlations are imposed.
+
+    The partial correlations p_ki of the vine are converted into the
+    correlations with the recursion
+
+        c_ij = p_ij,  c_ij <- c_ij * sqrt((1 - p_ki^2)(1 - p_kj^2)) + p_ki p_kj
+
+    over k = i-1, ..., 0. Unrolled, this is c_ij = sum_{k<=i} L_ki L_kj, where
+    L_ki = p_ki prod_{l<k} sqrt(1 - p_li^2) for k < i and
+    L_ii = prod_{l<i} sqrt(1 - p_li^2), so that the correlation matrix is
+    computed as L.T L with L formed with cumulative products, instead of the
+    O(d^3) scalar operations of the recursion.
 
     Reference:
     Lewandowski, Kurowicka, and Joe, 2009, "Generating random
@@ -48,36 +67,88 @@ def rand_corr_vine(d, alpha=2, beta=2, pmin=-0.8, pmax=0.8, seed=None):
     else:
         rand_state = np.random.RandomState(seed)
     # Sample partial correlations into upper triangular
-    P = np.empty((d,d))
+    P = np.zeros((d,d))
     uinds = np.triu_indices(d, 1)
     betas = rand_state.beta(alpha, beta, size=len(uinds[0]))
     betas *= pmax - pmin
     betas += pmin
     P[uinds] = betas
-    # Store the square of the upper triangular in the lower triangular
-    np.square(betas, out=betas)
-    P.T[uinds] = betas
     # Release memory
     del(betas, uinds)
-    # Output array
-    C = np.eye(d)
-    # Convert partial correlations to raw correlations
-    for i in range(d-1):
-        for j in range(i+1,d):
-            cur = P[i,j]
-            for k in range(i-1,-1,-1):
-                cur *= np.sqrt((1 - P[i,k])*(1 - P[j,k]))
-                cur += P[k,i]*P[k,j]
-            C[i,j] = cur
-            C[j,i] = cur
+    # Cumulative products prod_{l<k} sqrt(1 - p_li^2) in row k and column i
+    L = np.square(P)
+    np.subtract(1, L, out=L)
+    np.sqrt(L, out=L)
+    np.cumprod(L, axis=0, out=L)
+    L[1:] = L[:-1]
+    L[0] = 1
+    # Multiply with the partial correlations, the diagonal and below are 1
+    P[np.tril_indices(d)] = 1
+    L *= P
     # Release memory
     del(P)
+    L = np.triu(L)
+    # Correlation matrix, symmetrised exactly from the upper triangular
+    C = np.triu(L.T.dot(L), 1)
+    del(L)
+    C += C.T
+    np.fill_diagonal(C, 1)
     # Permute the order of variables
     perm = rand_state.permutation(d)
     C = C[np.ix_(perm,perm)]
     return C
 
 
+def group_indices(Nj):
+    """Form the index limits and the group indices of grouped observations.
+
+    Parameters
+    ----------
+    Nj : ndarray
+        Number of observations in each group.
+
+    Returns
+    -------
+    j_lim : ndarray
+        Index limits of the groups: observations j_lim[j]:j_lim[j+1] belong to
+        group j.
+
+    j_ind : ndarray
+        The group index of each observation.
+
+    """
+    Nj = np.asarray(Nj)
+    j_lim = np.concatenate(([0], np.cumsum(Nj)))
+    j_ind = np.repeat(np.arange(Nj.shape[0], dtype=np.int64), Nj)
+    return j_lim, j_ind
+
+
+def group_sum(x, j_ind, J):
+    """Sum the observations in each group.
+
+    Computed as a segment reduction with np.bincount in a single pass over the
+    observations instead of a loop over the groups. Empty groups sum to zero.
+
+    Parameters
+    ----------
+    x : ndarray
+        One dimensional array of the observations.
+
+    j_ind : ndarray
+        The group index of each observation.
+
+    J : int
+        Number of groups.
+
+    Returns
+    -------
+    out : ndarray
+        Array of shape (J,) containing the sum of each group.
+
+    """
+    return np.bincount(j_ind, weights=x, minlength=J)
+
+
 def calc_input_param_lin_reg(beta, sigma, Sigma_x=None):
     """Calculate suitable sigma_x for linear regression models.
 
@@ -273,19 +344,7 @@ def calc_input_param_classification(alpha, beta, Sigma_x=None):
             else:
                 ssbeta = np.abs(beta)
             divisor = np.sqrt(2) * ERFINVGAMMA0 * ssbeta
-            mu_x = np.zeros(J)
-            sigma_x = np.empty(J)
-            for j in range(J):
-                if np.abs(alpha[j]) < DELTA_MAX:
-                    # No mean adjustment needed
-                    sigma_x[j] = (LOGITP0 + np.abs(alpha[j])) / divisor
-                else:
-                    # Mean adjustment needed
-                    if alpha[j] > 0:
-                        mu_x[j] = (DELTA_MAX -alpha[j])/sbeta
-                    else:
-                        mu_x[j] = (-DELTA_MAX -alpha[j])/sbeta
-                    sigma_x[j] = SIGMA_F0/ssbeta
+            mu_x, sigma_x = _adjust_groups(alpha, sbeta, ssbeta, divisor)
 
         else:
             # Multiple alpha and beta: alpha.ndim == 1 and beta.ndim == 2
@@ -300,20 +359,35 @@ def calc_input_param_classification(alpha, beta, Sigma_x=None):
             else:
                 ssbeta = np.abs(beta[:,0])
             divisor = np.sqrt(2) * ERFINVGAMMA0 * ssbeta
-            mu_x = np.zeros(J)
-            sigma_x = np.empty(J)
-            for j in range(J):
-                if np.abs(alpha[j]) < DELTA_MAX:
-                    # No mean adjustment needed
-                    sigma_x[j] = (LOGITP0 + np.abs(alpha[j])) / divisor[j]
-                else:
-                    # Mean adjustment needed
-                    if alpha[j] > 0:
-                        mu_x[j] = (DELTA_MAX -alpha[j])/sbeta[j]
-                    else:
-                        mu_x[j] = (-DELTA_MAX -alpha[j])/sbeta[j]
-                    sigma_x[j] = SIGMA_F0/ssbeta[j]
+            mu_x, sigma_x = _adjust_groups(alpha, sbeta, ssbeta, divisor)
+
+    return mu_x, sigma_x
 
+
+def _adjust_groups(alpha, sbeta, ssbeta, divisor):
+    """Compute mu_x and sigma_x of the groups with their own alpha.
+
+    The arguments `sbeta`, `ssbeta` and `divisor` are either common for all
+    the groups or given for each group.
+
+    """
+    # Groups needing mean adjustment
+    adj = np.abs(alpha) >= DELTA_MAX
+    # No mean adjustment needed
+    mu_x = np.zeros(alpha.shape[0])
+    sigma_x = LOGITP0 + np.abs(alpha)
+    sigma_x /= divisor
+    # Mean adjustment needed
+    alpha_adj = alpha[adj]
+    mu_adj = np.where(alpha_adj > 0, DELTA_MAX, -DELTA_MAX)
+    mu_adj -= alpha_adj
+    if np.ndim(sbeta) == 0:
+        mu_adj /= sbeta
+        sigma_x[adj] = SIGMA_F0/ssbeta
+    else:
+        mu_adj /= sbeta[adj]
+        sigma_x[adj] = SIGMA_F0/ssbeta[adj]
+    mu_x[adj] = mu_adj
     return mu_x, sigma_x
 
 
@@ -375,30 +449,141 @@ class data(object):
         """
         y = self.y
         y_true = self.y_true
-        j_lim = self.j_lim
-        Nj = self.Nj
+        j_ind = self.j_ind
+        J = self.J
         if issubclass(y.dtype.type, np.integer):
             # Categorial: percentage of wrong classes
-            uncertainty_global = np.count_nonzero(y_true != y)/self.N
-            uncertainty_group = np.empty(self.J)
-            for j in range(self.J):
-                uncertainty_group[j] = (
-                    np.count_nonzero(
-                        y_true[j_lim[j]:j_lim[j+1]] != y[j_lim[j]:j_lim[j+1]]
-                    ) / Nj[j]
-                )
+            wrong = y_true != y
+            uncertainty_global = np.count_nonzero(wrong)/self.N
+            uncertainty_group = group_sum(wrong, j_ind, J)
+            uncertainty_group /= self.Nj
         else:
             # Continuous: R squared
             sst = np.sum(np.square(y - np.mean(y)))
             sse = np.sum(np.square(y - y_true))
             uncertainty_global = 1 - sse/sst
-            uncertainty_group = np.empty(self.J)
-            for j in range(self.J):
-                sst = np.sum(np.square(
-                    y[j_lim[j]:j_lim[j+1]] - np.mean(y[j_lim[j]:j_lim[j+1]])
-                ))
-                sse = np.sum(np.square(
-                    y[j_lim[j]:j_lim[j+1]] - y_true[j_lim[j]:j_lim[j+1]]
-                ))
-                uncertainty_group[j] = 1 - sse/sst
+            mean_j = group_sum(y, j_ind, J)
+            mean_j /= self.Nj
+            sst_j = group_sum(np.square(y - mean_j[j_ind]), j_ind, J)
+            sse_j = group_sum(np.square(y - y_true), j_ind, J)
+            uncertainty_group = sse_j
+            uncertainty_group /= sst_j
+            np.subtract(1, uncertainty_group, out=uncertainty_group)
         return uncertainty_global, uncertainty_group
+
+
+# Arrays of the class data stored as separate .npy files in the dataset cache
+DATA_ARRAYS = ('X', 'y', 'y_true', 'Nj', 'j_lim', 'j_ind')
+
+# Default dataset cache directory, next to the results of the experiment
+DATA_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'results', 'data_cache'
+)
+
+
+def _data_cache_key(model, model_name, Sigma_x, seed):
+    """Hash identifying a dataset simulated from the model."""
+    h = hashlib.sha256()
+    npg = model.npg
+    if hasattr(npg, '__getitem__'):
+        npg = [int(v) for v in npg]
+    else:
+        npg = int(npg)
+    h.update(json.dumps(
+        [model_name, int(model.J), int(model.D), npg, Sigma_x, int(seed),
+         np.__version__]
+    ).encode('utf-8'))
+    # The simulation code
+    for filename in (sys.modules[type(model).__module__].__file__, __file__):
+        with open(filename, 'rb') as f:
+            h.update(b'\0')
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def simulate_data_cached(model, model_name, Sigma_x=None, seed=None,
+                         cache_dir=None):
+    """Simulate data from the model or load it from the dataset cache.
+
+    The simulated datasets are stored in a cache directory keyed by the model,
+    its dimensions J, D and npg, the argument `Sigma_x` and the seed, and by a
+    hash of the simulation code, so that a dataset is simulated again if the
+    code changes. The arrays of the data are stored as .npy files and opened
+    with memory mapping in read-only mode, so that the processes using the
+    same dataset share its pages and the dataset is not loaded into the
+    memory as a whole. The datasets are not evicted automatically; the cache
+    directory can be removed at any time.
+
+    Parameters
+    ----------
+    model : object
+        The model object of the module models.<model_name>.
+
+    model_name : str
+        The name of the model.
+
+    Sigma_x : {None, 'rand'}, optional
+        Passed to the method simulate_data of the model.
+
+    seed : int
+        The seed of the simulation, passed as the argument `rng` to the method
+        simulate_data of the model.
+
+    cache_dir : str, optional
+        The cache directory. Providing None uses the environment variable
+        EPSTAN_DATA_CACHE or, if not set, the directory DATA_CACHE_PATH, i.e.
+        'results/data_cache' in the experiment directory.
+
+    Returns
+    -------
+    data : data
+        The simulated data, in which the arrays listed in DATA_ARRAYS are
+        read-only memory maps.
+
+    """
+    if not isinstance(seed, (int, np.integer)):
+        raise TypeError("Arg. `seed` has to be an integer")
+    if not (Sigma_x is None or isinstance(Sigma_x, str) and Sigma_x == 'rand'):
+        raise ValueError("Invalid value for arg. `Sigma_x`")
+
+    if cache_dir is None:
+        cache_dir = os.environ.get('EPSTAN_DATA_CACHE', DATA_CACHE_PATH)
+    cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+    os.makedirs(cache_dir, exist_ok=True)
+
+    key = _data_cache_key(model, model_name, Sigma_x, seed)
+    path = os.path.join(cache_dir, '{}-{}'.format(model_name, key[:16]))
+
+    if not os.path.isdir(path):
+        print("Simulating and saving the data into {}.".format(path))
+        dat = model.simulate_data(Sigma_x=Sigma_x, rng=seed)
+        # Write into a temporary directory and rename it, so that a partial
+        # dataset is never loaded. If several processes simulate the same
+        # dataset concurrently, the first rename wins.
+        tmp = tempfile.mkdtemp(suffix='.tmp', dir=cache_dir)
+        try:
+            for name in DATA_ARRAYS:
+                np.save(os.path.join(tmp, name+'.npy'), getattr(dat, name))
+            with open(os.path.join(tmp, 'params.pkl'), 'wb') as f:
+                pickle.dump((dat.X_param, dat.true_values), f)
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+                shutil.rmtree(tmp)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+    arrays = dict(
+        (name, np.load(os.path.join(path, name+'.npy'), mmap_mode='r'))
+        for name in DATA_ARRAYS
+    )
+    with open(os.path.join(path, 'params.pkl'), 'rb') as f:
+        X_param, true_values = pickle.load(f)
+    return data(
+        arrays['X'], arrays['y'], X_param, arrays['y_true'], arrays['Nj'],
+        arrays['j_lim'], arrays['j_ind'], true_values
+    )
@@ -27,7 +27,9 @@ Definition:
 
 import numpy as np
 from scipy.linalg import cholesky
-from .common import data, calc_input_param_lin_reg, rand_corr_vine
+from .common import (
+    data, calc_input_param_lin_reg, rand_corr_vine, group_indices
+)
 
 
 # ------------------------------------------------------------------------------
@@ -125,12 +127,9 @@ class model(object):
             Nj = npg*np.ones(J, dtype=np.int64)
         # Total number of observations
         N = np.sum(Nj)
-        # Observation index limits for J groups
-        j_lim = np.concatenate(([0], np.cumsum(Nj)))
-        # Group indices for each sample
-        j_ind = np.empty(N, dtype=np.int64)
-        for j in range(J):
-            j_ind[j_lim[j]:j_lim[j+1]] = j
+        # Observation index limits for J groups and group indices for each
+        # sample
+        j_lim, j_ind = group_indices(Nj)
 
         # Assign parameters
         if SIGMA is None:
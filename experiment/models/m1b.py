@@ -26,7 +26,9 @@ Definition:
 
 import numpy as np
 from scipy.linalg import cholesky
-from .common import data, calc_input_param_classification, rand_corr_vine
+from .common import (
+    data, calc_input_param_classification, rand_corr_vine, group_indices
+)
 
 
 # ------------------------------------------------------------------------------
@@ -118,12 +120,9 @@ class model(object):
             Nj = npg*np.ones(J, dtype=np.int64)
         # Total number of observations
         N = np.sum(Nj)
-        # Observation index limits for J groups
-        j_lim = np.concatenate(([0], np.cumsum(Nj)))
-        # Group indices for each sample
-        j_ind = np.empty(N, dtype=np.int64)
-        for j in range(J):
-            j_ind[j_lim[j]:j_lim[j+1]] = j
+        # Observation index limits for J groups and group indices for each
+        # sample
+        j_lim, j_ind = group_indices(Nj)
 
         # Assign parameters
         if SIGMA_A is None:
@@ -154,16 +153,13 @@ class model(object):
 
         # Simulate data
         # Different mu_x and sigma_x for every group
-        X = np.empty((N,D))
-        if Sigma_x is None:
-            for j in range(J):
-                X[j_lim[j]:j_lim[j+1],:] = \
-                    mu_x_j[j] + rng.randn(Nj[j],D)*sigma_x_j[j]
-        else:
-            cho_x = cholesky(Sigma_x)
-            for j in range(J):
-                X[j_lim[j]:j_lim[j+1],:] = \
-                    mu_x_j[j] + rng.randn(Nj[j],D).dot(sigma_x_j[j]*cho_x)
+        # The draws of the groups are consecutive in the random stream, so
+        # they can be drawn at once
+        X = rng.randn(N,D)
+        if Sigma_x is not None:
+            X = X.dot(cholesky(Sigma_x))
+        X *= sigma_x_j[j_ind,np.newaxis]
+        X += mu_x_j[j_ind,np.newaxis]
         y = alpha_j[j_ind] + X.dot(beta)
         y = 1/(1+np.exp(-y))
         y_true = (0.5 < y).astype(int)
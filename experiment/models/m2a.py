@@ -28,7 +28,9 @@ Definition:
 
 import numpy as np
 from scipy.linalg import cholesky
-from .common import data, calc_input_param_lin_reg, rand_corr_vine
+from .common import (
+    data, calc_input_param_lin_reg, rand_corr_vine, group_indices
+)
 
 
 # ------------------------------------------------------------------------------
@@ -112,7 +114,7 @@ class model(object):
             rng = np.random.RandomState(rng)
         # Draw random seed for input covariance for consistency in randomness
         # even if not needed
-        seed_input_cov = rnd_data.randint(2**31-1)
+        seed_input_cov = rng.randint(2**31-1)
 
         # Randomise input covariance structure if needed
         if Sigma_x == 'rand':
@@ -121,41 +123,38 @@ class model(object):
         # Parameters
         # Number of observations for each group
         if hasattr(npg, '__getitem__') and len(npg) == 2:
-            Nj = rnd_data.randint(npg[0],npg[1]+1, size=J)
+            Nj = rng.randint(npg[0],npg[1]+1, size=J)
         else:
             Nj = npg*np.ones(J, dtype=np.int64)
         # Total number of observations
         N = np.sum(Nj)
-        # Observation index limits for J groups
-        j_lim = np.concatenate(([0], np.cumsum(Nj)))
-        # Group indices for each sample
-        j_ind = np.empty(N, dtype=np.int64)
-        for j in range(J):
-            j_ind[j_lim[j]:j_lim[j+1]] = j
+        # Observation index limits for J groups and group indices for each
+        # sample
+        j_lim, j_ind = group_indices(Nj)
 
         # Assign parameters
         if SIGMA is None:
-            sigma = np.exp(rnd_data.randn()*SIGMA_H)
+            sigma = np.exp(rng.randn()*SIGMA_H)
         else:
             sigma = SIGMA
         if SIGMA_A is None:
-            sigma_a = np.exp(rnd_data.randn()*SIGMA_AH)
+            sigma_a = np.exp(rng.randn()*SIGMA_AH)
         else:
             sigma_a = SIGMA_A
         if SIGMA_B is None:
-            sigma_b = np.exp(rnd_data.randn()*SIGMA_BH)
+            sigma_b = np.exp(rng.randn()*SIGMA_BH)
         else:
             sigma_b = SIGMA_B
-        alpha_j = rnd_data.randn(J)*sigma_a
-        beta = rnd_data.randn(D)*sigma_b
+        alpha_j = rng.randn(J)*sigma_a
+        beta = rng.randn(D)*sigma_b
 
         # Regulate beta
         beta_sum = np.sum(beta)
         while np.abs(beta_sum) < B_ABS_MIN_SUM:
             # Replace one random element in beta
-            index = rnd_data.randint(D)
+            index = rng.randint(D)
             beta_sum -= beta[index]
-            beta[index] = rnd_data.randn()*sigma_b
+            beta[index] = rng.randn()*sigma_b
             beta_sum += beta[index]
 
         phi_true = np.empty(self.dphi)
@@ -168,12 +167,12 @@ class model(object):
 
         # Simulate data
         if Sigma_x is None:
-            X = rnd_data.randn(N,D)*sigma_x
+            X = rng.randn(N,D)*sigma_x
         else:
             cho_x = cholesky(Sigma_x)
-            X = rnd_data.randn(N,D).dot(sigma_x*cho_x)
+            X = rng.randn(N,D).dot(sigma_x*cho_x)
         y_true = alpha_j[j_ind] + X.dot(beta)
-        y = y_true + rnd_data.randn(N)*sigma
+        y = y_true + rng.randn(N)*sigma
 
         return data(
             X, y, {'sigma_x':sigma_x, 'Sigma_x':Sigma_x}, y_true, Nj, j_lim,
@@ -30,7 +30,9 @@ Definition:
 
 import numpy as np
 from scipy.linalg import cholesky
-from .common import data, calc_input_param_lin_reg, rand_corr_vine
+from .common import (
+    data, calc_input_param_lin_reg, rand_corr_vine, group_indices
+)
 
 
 # ------------------------------------------------------------------------------
@@ -126,12 +128,9 @@ class model(object):
             Nj = npg*np.ones(J, dtype=np.int64)
         # Total number of observations
         N = np.sum(Nj)
-        # Observation index limits for J groups
-        j_lim = np.concatenate(([0], np.cumsum(Nj)))
-        # Group indices for each sample
-        j_ind = np.empty(N, dtype=np.int64)
-        for j in range(J):
-            j_ind[j_lim[j]:j_lim[j+1]] = j
+        # Observation index limits for J groups and group indices for each
+        # sample
+        j_lim, j_ind = group_indices(Nj)
 
         # Assign parameters
         if SIGMA is None:
@@ -146,8 +145,9 @@ class model(object):
         alpha_j = rng.randn(J)*sigma_a
         beta_j = rng.randn(J,D)*sigma_b
 
-        # Regulate beta
-        for j in range(J):
+        # Regulate beta in the groups where needed
+        for j in np.flatnonzero(
+                np.abs(np.sum(beta_j, axis=-1)) < B_ABS_MIN_SUM):
             beta_sum = np.sum(beta_j[j])
             while np.abs(beta_sum) < B_ABS_MIN_SUM:
                 # Replace one random element in beta
@@ -166,18 +166,13 @@ class model(object):
 
         # Simulate data
         # Different sigma_x for every group
-        X = np.empty((N,D))
-        if Sigma_x is None:
-            for j in range(J):
-                X[j_lim[j]:j_lim[j+1],:] = rng.randn(Nj[j],D)*sigma_x_j[j]
-        else:
-            cho_x = cholesky(Sigma_x)
-            for j in range(J):
-                X[j_lim[j]:j_lim[j+1],:] = \
-                    rng.randn(Nj[j],D).dot(sigma_x_j[j]*cho_x)
-        y_true = np.empty(N)
-        for n in range(N):
-            y_true[n] = alpha_j[j_ind[n]] + X[n].dot(beta_j[j_ind[n]])
+        # The draws of the groups are consecutive in the random stream, so
+        # they can be drawn at once
+        X = rng.randn(N,D)
+        if Sigma_x is not None:
+            X = X.dot(cholesky(Sigma_x))
+        X *= sigma_x_j[j_ind,np.newaxis]
+        y_true = alpha_j[j_ind] + np.einsum('nd,nd->n', X, beta_j[j_ind])
         y = y_true + rng.randn(N)*sigma
 
         return data(
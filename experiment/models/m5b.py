@@ -32,7 +32,9 @@ Definition:
 
 import numpy as np
 from scipy.linalg import cholesky
-from .common import data, calc_input_param_classification, rand_corr_vine
+from .common import (
+    data, calc_input_param_classification, rand_corr_vine, group_indices
+)
 
 
 # ------------------------------------------------------------------------------
@@ -132,12 +134,9 @@ class model(object):
             Nj = npg*np.ones(J, dtype=np.int64)
         # Total number of observations
         N = np.sum(Nj)
-        # Observation index limits for J groups
-        j_lim = np.concatenate(([0], np.cumsum(Nj)))
-        # Group indices for each sample
-        j_ind = np.empty(N, dtype=np.int64)
-        for j in range(J):
-            j_ind[j_lim[j]:j_lim[j+1]] = j
+        # Observation index limits for J groups and group indices for each
+        # sample
+        j_lim, j_ind = group_indices(Nj)
 
         # Assign parameters
         if SIGMA_A is None:
@@ -153,8 +152,9 @@ class model(object):
         alpha_j = mu_a + rng.laplace(size=J)*sigma_a
         beta_j = mu_b + rng.laplace(size=(J,D))*sigma_b
 
-        # Regulate beta
-        for j in range(J):
+        # Regulate beta in the groups where needed
+        for j in np.flatnonzero(
+                np.abs(np.sum(beta_j, axis=-1)) < B_ABS_MIN_SUM):
             beta_sum = np.sum(beta_j[j])
             while np.abs(beta_sum) < B_ABS_MIN_SUM:
                 # Replace one random element in beta
@@ -176,19 +176,14 @@ class model(object):
 
         # Simulate data
         # Different mu_x and sigma_x for every group
-        X = np.empty((N,D))
-        if Sigma_x is None:
-            for j in range(J):
-                X[j_lim[j]:j_lim[j+1],:] = \
-                    mu_x_j[j] + rng.randn(Nj[j],D)*sigma_x_j[j]
-        else:
-            cho_x = cholesky(Sigma_x)
-            for j in range(J):
-                X[j_lim[j]:j_lim[j+1],:] = \
-                    mu_x_j[j] + rng.randn(Nj[j],D).dot(sigma_x_j[j]*cho_x)
-        y = np.empty(N)
-        for n in range(N):
-            y[n] = alpha_j[j_ind[n]] + X[n].dot(beta_j[j_ind[n]])
+        # The draws of the groups are consecutive in the random stream, so
+        # they can be drawn at once
+        X = rng.randn(N,D)
+        if Sigma_x is not None:
+            X = X.dot(cholesky(Sigma_x))
+        X *= sigma_x_j[j_ind,np.newaxis]
+        X += mu_x_j[j_ind,np.newaxis]
+        y = alpha_j[j_ind] + np.einsum('nd,nd->n', X, beta_j[j_ind])
         y = 1/(1+np.exp(-y))
         y_true = (0.5 < y).astype(int)
         y = (rng.rand(N) < y).astype(int)
@@ -12,6 +12,10 @@ from
 If <dist_id> is omitted, the same file ending is used also for distributed
 results. If also <model_id> is omitted, no file ending are used.
 
+If the distributed EP iterations were saved into an on-disk history (option
+history in fit.py), the history is opened lazily so that the iterations are
+read from the disk only when needed.
+
 The most recent version of the code can be found on GitHub:
 https://github.com/gelman/ep-stan
 
@@ -35,7 +39,14 @@ import matplotlib.pyplot as plt
 
 # Get the results directory
 CUR_PATH = os.path.dirname(os.path.abspath(__file__))
+PARENT_PATH = os.path.abspath(os.path.join(CUR_PATH, os.pardir))
 RES_PATH = os.path.join(CUR_PATH, 'results')
+# Double check that the package is in the parent directory
+if os.path.exists(os.path.join(PARENT_PATH, 'epstan')):
+    if PARENT_PATH not in os.sys.path:
+        os.sys.path.insert(0, PARENT_PATH)
+
+from epstan.history import open_history
 
 
 def kl_mvn(m0, S0, m1, S1, sum_log_diag_cho_S0=None):
@@ -176,8 +187,15 @@ def plot_results(model_name, model_id=None):
     for res_d_file_name in ep_filenames:
         res_d_file = np.load(
             os.path.join(RES_PATH, res_d_file_name))
-        m_s_ep_s.append(res_d_file['m_s_ep'])
-        S_s_ep_s.append(res_d_file['S_s_ep'])
+        if 'history' in res_d_file.files:
+            # Open the on-disk history lazily
+            history = open_history(
+                os.path.join(RES_PATH, str(res_d_file['history'])))
+            m_s_ep_s.append(history.m)
+            S_s_ep_s.append(history.S)
+        else:
+            m_s_ep_s.append(res_d_file['m_s_ep'])
+            S_s_ep_s.append(res_d_file['S_s_ep'])
         time_s_ep_s.append(res_d_file['time_s_ep'])
         mstepsize_s_ep_s.append(res_d_file['mstepsize_s_ep'])
         mrhat_s_ep_s.append(res_d_file['mrhat_s_ep'])
@@ -210,6 +228,7 @@ def plot_results(model_name, model_id=None):
     m_s_cons_s = []
     S_s_cons_s = []
     time_s_cons_s = []
+    walltime_s_cons_s = []
     mstepsize_s_cons_s = []
     mrhat_s_cons_s = []
     for res_c_file_name in cons_filenames:
@@ -218,6 +237,11 @@ def plot_results(model_name, model_id=None):
         m_s_cons_s.append(res_c_file['m_s_cons'])
         S_s_cons_s.append(res_c_file['S_s_cons'])
         time_s_cons_s.append(res_c_file['time_s_cons'])
+        # wall-clock time of the parallel sites (not in older files)
+        walltime_s_cons_s.append(
+            res_c_file['walltime_s_cons']
+            if 'walltime_s_cons' in res_c_file else None
+        )
         mstepsize_s_cons_s.append(res_c_file['mstepsize_s_cons'])
         mrhat_s_cons_s.append(res_c_file['mrhat_s_cons'])
         res_c_file.close()
@@ -295,9 +319,11 @@ def plot_results(model_name, model_id=None):
     for mse_ep, time_s_ep, fname in zip(mse_ep_s, time_s_ep_s, ep_filenames):
         ax.plot(time_s_ep/60, mse_ep, label=fname)
     ax.plot(time_s_full/60, mse_full, label='full')
-    for mse_cons, time_s_cons, fname in zip(
-            mse_cons_s, time_s_cons_s, cons_filenames):
+    for mse_cons, time_s_cons, walltime_s_cons, fname in zip(
+            mse_cons_s, time_s_cons_s, walltime_s_cons_s, cons_filenames):
         ax.plot(time_s_cons/60, mse_cons, label=fname)
+        if walltime_s_cons is not None:
+            ax.plot(walltime_s_cons/60, mse_cons, '--', label=fname+' (wall)')
     ax.set_xlabel('time (min)')
     ax.set_ylabel('MSE')
     ax = axes[1]
@@ -305,9 +331,11 @@ def plot_results(model_name, model_id=None):
     for kl_ep, time_s_ep, fname in zip(kl_ep_s, time_s_ep_s, ep_filenames):
         ax.plot(time_s_ep/60, kl_ep, label=fname)
     ax.plot(time_s_full/60, kl_full, label='full')
-    for kl_cons, time_s_cons, fname in zip(
-            kl_cons_s, time_s_cons_s, cons_filenames):
+    for kl_cons, time_s_cons, walltime_s_cons, fname in zip(
+            kl_cons_s, time_s_cons_s, walltime_s_cons_s, cons_filenames):
         ax.plot(time_s_cons/60, kl_cons, label=fname)
+        if walltime_s_cons is not None:
+            ax.plot(walltime_s_cons/60, kl_cons, '--', label=fname+' (wall)')
     ax.legend(loc='center left', bbox_to_anchor=(1, 0.5))
     ax.set_xlabel('time (min)')
     ax.set_ylabel('KL')
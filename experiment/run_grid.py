@@ -0,0 +1,427 @@
+"""Run the experiment of fit.py over a grid of models and configurations.
+
+usage: run_grid.py [-h] [--grid S [S ...]] [--set S [S ...]] [--jobs P]
+                   [--cores P] [--force B] [--dry_run B]
+                   model_name [model_name ...]
+
+positional arguments:
+  model_name        names of the models
+
+optional arguments:
+  -h, --help        show this help message and exit
+  --grid S [S ...]  swept options of fit.py as OPT=VAL1,VAL2,..., e.g.
+                    K=8,16,32 seed_ep=1,2, default no sweep
+  --set S [S ...]   fixed options of fit.py as OPT=VAL, e.g. run_all=True,
+                    default None
+  --jobs P          number of jobs run in parallel, default number of CPUs
+                    divided by option --cores
+  --cores P         number of CPU cores for each job, default 1
+  --force B         rerun also the jobs whose results exist, default False
+  --dry_run B       only list the jobs and whether their results exist,
+                    default False
+
+The jobs are all the combinations of the given models and the values of the
+swept options. The values are given in the format of the command line options
+of fit.py; option npg is given as MIN:MAX for a range. Each job is identified
+with a hash of its model name and configurations (fit.configurations),
+excluding the options that do not affect the results (id, data_cache, profile,
+history and cons_procs). The hash is used as the option id of fit.py, so that
+the result files of the jobs, e.g. `res_d_<model_name>_<hash>.npz`, do not
+overwrite each other. If option id is set, the hash is appended to it. The
+resulting id is denoted by <id> below.
+
+A completed job is recorded in the file `grid_<model_name>_<id>.json` in the
+folder results together with its configurations and result files. The jobs,
+whose record exists and whose result files are all found, are skipped, which
+allows extending the grid or continuing an interrupted grid without redoing
+the finished runs.
+
+The remaining jobs are run as separate fit.py processes, at most option
+--jobs at a time. The jobs are ordinary (non-daemonic) processes, so that they
+can start their own subprocesses, e.g. the Stan sampling and the consensus MC
+processes. Each job is limited to option --cores CPU cores: the numbers of the
+BLAS and OpenMP threads are set accordingly and, where supported, each process
+is pinned to its own cores, which also confines its subprocesses. The output of
+each job is written into the log file `grid_<model_name>_<id>.log`.
+
+Finally, the index of all the completed jobs in the folder results is written
+into the file `grid_index.json`.
+
+The most recent version of the code can be found on GitHub:
+https://github.com/gelman/ep-stan
+
+"""
+
+# Licensed under the 3-clause BSD license.
+# http://opensource.org/licenses/BSD-3-Clause
+#
+# Copyright (C) 2014 Tuomas Sivula
+# All rights reserved.
+
+
+import os
+import sys
+import time
+import json
+import hashlib
+import argparse
+import itertools
+import subprocess
+
+# Add parent dir to sys.path if not present already. This is only done because
+# of easy importing of the package epstan. Adding the parent directory into the
+# PYTHONPATH works as well.
+CUR_PATH = os.path.dirname(os.path.abspath(__file__))
+PARENT_PATH = os.path.abspath(os.path.join(CUR_PATH, os.pardir))
+RES_PATH = os.path.join(CUR_PATH, 'results')
+# Double check that the package is in the parent directory
+if os.path.exists(os.path.join(PARENT_PATH, 'epstan')):
+    if PARENT_PATH not in os.sys.path:
+        os.sys.path.insert(0, PARENT_PATH)
+
+import fit
+
+
+# Environment variables limiting the number of threads in a job
+THREAD_ENV_VARS = (
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'NUMEXPR_NUM_THREADS'
+)
+
+INDEX_FILE = 'grid_index.json'
+
+# Options of fit.py that do not affect the results and are thus excluded from
+# the hash identifying a job
+NON_RESULT_OPTS = ('id', 'data_cache', 'profile', 'history', 'cons_procs')
+
+
+def parse_value(opt, val):
+    """Parse the value of an option of fit.py given as a string."""
+    if opt not in fit.CONF_DEFAULT:
+        raise ValueError("Invalid option `{}`".format(opt))
+    parse = fit.CONF_CUSTOMS[opt].get('type', str)
+    if opt == 'npg' and ':' in val:
+        return [parse(v) for v in val.split(':')]
+    return parse(val)
+
+
+def parse_assignments(args, multiple):
+    """Parse options given as OPT=VAL or OPT=VAL1,VAL2,... into a dict."""
+    out = {}
+    for arg in args:
+        if '=' not in arg:
+            raise ValueError("Invalid option `{}`, use OPT=VAL".format(arg))
+        opt, val = arg.split('=', 1)
+        if multiple:
+            out[opt] = [parse_value(opt, v) for v in val.split(',')]
+        else:
+            out[opt] = parse_value(opt, val)
+    return out
+
+
+def conf_hash(model_name, conf):
+    """Hash identifying the model and the configurations.
+
+    The options listed in NON_RESULT_OPTS are ignored.
+
+    """
+    items = sorted(
+        (opt, val) for opt, val in conf.__dict__.items()
+        if opt not in NON_RESULT_OPTS
+    )
+    code = json.dumps([model_name, items], default=repr)
+    return hashlib.sha256(code.encode('utf-8')).hexdigest()[:12]
+
+
+def make_jobs(model_names, grid, fixed):
+    """Form the jobs (model_name, conf, key) of the grid."""
+    jobs = []
+    opts = sorted(grid)
+    for model_name in model_names:
+        for vals in itertools.product(*(grid[opt] for opt in opts)):
+            kwargs = dict(fixed)
+            kwargs.update(zip(opts, vals))
+            conf = fit.configurations(**kwargs)
+            key = conf_hash(model_name, conf)
+            conf.id = key if not conf.id else '{}_{}'.format(conf.id, key)
+            jobs.append((model_name, conf, key))
+    return jobs
+
+
+def record_path(model_name, conf_id):
+    return os.path.join(
+        RES_PATH, 'grid_{}_{}.json'.format(model_name, conf_id))
+
+
+def result_files(model_name, conf_id):
+    """Names of the result files of a job in the folder results."""
+    stem = '_{}_{}'.format(model_name, conf_id)
+    if not os.path.isdir(RES_PATH):
+        return []
+    return sorted(
+        name for name in os.listdir(RES_PATH)
+        if not name.startswith('grid_')
+        and os.path.splitext(name)[0].endswith(stem)
+    )
+
+
+def is_done(model_name, conf_id):
+    """Check if the record of the job and all its result files exist."""
+    path = record_path(model_name, conf_id)
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'r') as f:
+        record = json.load(f)
+    return all(
+        os.path.exists(os.path.join(RES_PATH, name))
+        for name in record['files']
+    )
+
+
+def job_command(model_name, conf):
+    """Command line running the job with fit.py.
+
+    The options equal to their defaults are omitted.
+
+    """
+    cmd = [sys.executable, os.path.join(CUR_PATH, 'fit.py'), model_name]
+    for opt in fit.CONFS:
+        val = getattr(conf, opt)
+        if val is None or val == fit.CONF_DEFAULT[opt]:
+            continue
+        cmd.append('--'+opt)
+        if isinstance(val, (list, tuple)):
+            cmd.extend(str(v) for v in val)
+        else:
+            cmd.append(str(val))
+    return cmd
+
+
+def start_job(job, cores=None):
+    """Start a job in a new process.
+
+    Parameters
+    ----------
+    job : tuple
+        The job (model_name, conf, key).
+
+    cores : list of int, optional
+        The CPU cores the process is pinned to. Not pinned if not provided.
+
+    Returns
+    -------
+    proc : subprocess.Popen
+        The process. Its output is written into the log file of the job, which
+        is kept open in attribute `log` of the process.
+
+    """
+    model_name, conf, key = job
+    log_path = os.path.join(
+        RES_PATH, 'grid_{}_{}.log'.format(model_name, conf.id))
+    log = open(log_path, 'w')
+    if cores is not None:
+        # Pin before exec so that all the threads and subprocesses of the job
+        # inherit the affinity
+        preexec_fn = lambda: os.sched_setaffinity(0, cores)
+    else:
+        preexec_fn = None
+    try:
+        proc = subprocess.Popen(
+            job_command(model_name, conf),
+            stdout = log,
+            stderr = subprocess.STDOUT,
+            cwd = CUR_PATH,
+            preexec_fn = preexec_fn
+        )
+    except BaseException:
+        log.close()
+        raise
+    proc.log = log
+    return proc
+
+
+def record_job(job, elapsed):
+    """Record a completed job."""
+    model_name, conf, key = job
+    record = dict(
+        model_name = model_name,
+        key = key,
+        conf = conf.__dict__,
+        files = result_files(model_name, conf.id),
+        time = elapsed,
+        created = time.strftime('%Y-%m-%d %H:%M:%S')
+    )
+    with open(record_path(model_name, conf.id), 'w') as f:
+        json.dump(record, f, indent=1, default=repr)
+
+
+def run_jobs(todo, n_jobs, core_sets=None, poll_interval=0.5):
+    """Run the jobs, at most `n_jobs` at a time, and record the completed ones.
+
+    Parameters
+    ----------
+    todo : list of tuple
+        The jobs (model_name, conf, key).
+
+    n_jobs : int
+        Number of jobs run in parallel.
+
+    core_sets : list of list of int, optional
+        The CPU cores of each of the `n_jobs` parallel job slots. If not
+        provided, the processes are not pinned.
+
+    poll_interval : float, optional
+        Time in seconds between the checks of the running processes.
+
+    Yields
+    ------
+    out : tuple
+        The model name, the key, the status ('done' or 'failed') and the
+        elapsed time of each job in the order of their completion.
+
+    """
+    todo = list(reversed(todo))
+    free = list(range(n_jobs))
+    running = []
+    try:
+        while todo or running:
+            # Start new jobs in the free slots
+            while todo and free:
+                slot = free.pop()
+                job = todo.pop()
+                cores = core_sets[slot] if core_sets is not None else None
+                running.append((start_job(job, cores), job, slot, time.time()))
+            time.sleep(poll_interval)
+            # Collect the finished jobs
+            still_running = []
+            for proc, job, slot, start in running:
+                if proc.poll() is None:
+                    still_running.append((proc, job, slot, start))
+                    continue
+                elapsed = time.time() - start
+                proc.log.close()
+                free.append(slot)
+                if proc.returncode == 0:
+                    record_job(job, elapsed)
+                    status = 'done'
+                else:
+                    status = 'failed'
+                yield job[0], job[2], status, elapsed
+            running = still_running
+    finally:
+        # Do not leave orphan jobs if interrupted
+        for proc, _, _, _ in running:
+            if proc.poll() is None:
+                proc.terminate()
+                proc.wait()
+            proc.log.close()
+
+
+def write_index():
+    """Write the index of all the recorded jobs in the folder results."""
+    records = []
+    for name in sorted(os.listdir(RES_PATH)):
+        if (    name.startswith('grid_') and name.endswith('.json')
+             and name != INDEX_FILE
+           ):
+            with open(os.path.join(RES_PATH, name), 'r') as f:
+                records.append(json.load(f))
+    path = os.path.join(RES_PATH, INDEX_FILE)
+    with open(path, 'w') as f:
+        json.dump(records, f, indent=1)
+    return path, len(records)
+
+
+def _parse_bool(arg):
+    up = str(arg).upper()
+    if up == 'TRUE'[:len(up)] or up == '1':
+       return True
+    elif up == 'FALSE'[:len(up)] or up == '0':
+       return False
+    else:
+       raise ValueError("Invalid boolean option")
+
+def _parse_positive_int(arg):
+    if arg.isalnum() and int(arg) > 0:
+        return int(arg)
+    else:
+       raise ValueError("Invalid integer option")
+
+
+if __name__ == '__main__':
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description = __doc__.split('\n\n', 1)[0],
+        epilog = "See module docstring for more detailed info.",
+        formatter_class = argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('model_name', nargs='+', help="names of the models")
+    parser.add_argument('--grid', nargs='+', default=[], metavar='S')
+    parser.add_argument('--set', nargs='+', default=[], metavar='S')
+    parser.add_argument('--jobs', type=_parse_positive_int, metavar='P')
+    parser.add_argument('--cores', type=_parse_positive_int, default=1,
+                        metavar='P')
+    parser.add_argument('--force', type=_parse_bool, default=False,
+                        metavar='B')
+    parser.add_argument('--dry_run', type=_parse_bool, default=False,
+                        metavar='B')
+    args = parser.parse_args()
+
+    grid = parse_assignments(args.grid, multiple=True)
+    fixed = parse_assignments(args.set, multiple=False)
+    jobs = make_jobs(args.model_name, grid, fixed)
+
+    # Skip the jobs whose results exist
+    todo = []
+    for job in jobs:
+        model_name, conf, key = job
+        done = not args.force and is_done(model_name, conf.id)
+        if not done:
+            todo.append(job)
+        if args.dry_run:
+            print('{:10} {:12} {:8}  {}'.format(
+                model_name, key, 'exists' if done else 'todo',
+                ' '.join('{}={}'.format(opt, getattr(conf, opt))
+                         for opt in sorted(grid))
+            ))
+    print("{} jobs, {} to run".format(len(jobs), len(todo)))
+    if args.dry_run or not todo:
+        sys.exit(0)
+
+    if not os.path.exists(RES_PATH):
+        os.makedirs(RES_PATH)
+
+    # Number of parallel jobs and their cores
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    n_jobs = args.jobs
+    if n_jobs is None:
+        n_jobs = max(1, len(cpus) // args.cores)
+    n_jobs = min(n_jobs, len(todo))
+    if hasattr(os, 'sched_setaffinity') and n_jobs*args.cores <= len(cpus):
+        core_sets = [
+            cpus[i*args.cores:(i+1)*args.cores] for i in range(n_jobs)]
+    else:
+        core_sets = None
+    # The job processes inherit the thread limits from the environment
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(args.cores)
+
+    failed = 0
+    for i, (model_name, key, status, elapsed) in enumerate(
+            run_jobs(todo, n_jobs, core_sets)):
+        print("[{}/{}] {} {} {} in {:.1f} s".format(
+            i+1, len(todo), model_name, key, status, elapsed))
+        if status != 'done':
+            failed += 1
+
+    path, n_records = write_index()
+    print("Index of {} jobs written into {}".format(n_records, path))
+    if failed:
+        print("{} jobs failed, see the log files".format(failed))
+        sys.exit(1)
@@ -0,0 +1,95 @@
+"""Script for testing the dataset cache of the simulated data, see
+models.common.simulate_data_cached.
+
+Run with:
+    $ python test_data_cache.py
+
+The data of each model is simulated directly and through a temporary dataset
+cache, first simulated and saved and then loaded from the cache, and the
+resulting data are compared. An AssertionError is raised if they differ.
+
+The most recent version of the code can be found on GitHub:
+https://github.com/gelman/ep-stan
+
+"""
+
+# Licensed under the 3-clause BSD license.
+# http://opensource.org/licenses/BSD-3-Clause
+#
+# Copyright (C) 2014 Tuomas Sivula
+# All rights reserved.
+
+
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from models.common import simulate_data_cached, DATA_ARRAYS
+
+
+# ------------------------------------------------------------------------------
+#     Configurations
+# ------------------------------------------------------------------------------
+model_names = [                 # Tested models
+    'm1a', 'm1b', 'm2a', 'm2b', 'm3a', 'm3b', 'm4a', 'm4b', 'm5a', 'm5b']
+J = 12                          # Number of groups
+D = 3                           # Number of inputs
+npg = [5, 15]                   # Number of observations per group (min max)
+seed = 2                        # Seed of the simulation
+
+
+def equal_values(a, b):
+    """Compare nested dicts of arrays and scalars."""
+    if isinstance(a, dict):
+        return (
+            isinstance(b, dict) and sorted(a) == sorted(b)
+            and all(equal_values(a[key], b[key]) for key in a)
+        )
+    return np.array_equal(a, b)
+
+
+def equal_data(a, b):
+    return (
+        all(np.array_equal(getattr(a, name), getattr(b, name))
+            for name in DATA_ARRAYS)
+        and a.N == b.N and a.J == b.J
+        and equal_values(a.X_param, b.X_param)
+        and equal_values(a.true_values, b.true_values)
+    )
+
+
+cache_dir = tempfile.mkdtemp()
+try:
+    for model_name in model_names:
+        model_module = getattr(__import__('models.'+model_name), model_name)
+        for Sigma_x in (None, 'rand'):
+            model = model_module.model(J, D, npg)
+            direct = model.simulate_data(Sigma_x=Sigma_x, rng=seed)
+            saved = simulate_data_cached(
+                model, model_name, Sigma_x=Sigma_x, seed=seed,
+                cache_dir=cache_dir)
+            loaded = simulate_data_cached(
+                model, model_name, Sigma_x=Sigma_x, seed=seed,
+                cache_dir=cache_dir)
+            assert equal_data(saved, direct)
+            assert equal_data(loaded, direct)
+            assert isinstance(loaded.X, np.memmap)
+            assert not loaded.X.flags.writeable
+            for u_loaded, u_direct in zip(
+                    loaded.calc_uncertainty(), direct.calc_uncertainty()):
+                assert np.array_equal(u_loaded, u_direct)
+            print('{:4} Sigma_x={:5} ok'.format(model_name, str(Sigma_x)))
+
+    # Another seed is another dataset
+    n_before = len(os.listdir(cache_dir))
+    other = simulate_data_cached(
+        model, model_name, seed=seed+1, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == n_before + 1
+    assert not np.array_equal(other.X, direct.X)
+    print('{:18} ok'.format('other seed'))
+
+finally:
+    shutil.rmtree(cache_dir)
+
+print('All ok')
@@ -0,0 +1,118 @@
+"""Smoke test of the grid runner run_grid.py.
+
+Run with:
+    $ python test_run_grid.py
+
+A tiny grid of two jobs, which only simulate the data and save the true values
+(no method is run, so that Stan is not needed), is run end to end with
+run_grid.py in two parallel job processes. The records, the log files and the
+result files of the jobs are checked, and the grid is run again to check that
+the completed jobs are skipped. An AssertionError is raised if any check
+fails. The files of the test are removed from the folder results afterwards.
+
+The most recent version of the code can be found on GitHub:
+https://github.com/gelman/ep-stan
+
+"""
+
+# Licensed under the 3-clause BSD license.
+# http://opensource.org/licenses/BSD-3-Clause
+#
+# Copyright (C) 2014 Tuomas Sivula
+# All rights reserved.
+
+
+import os
+import sys
+import json
+import subprocess
+
+import run_grid
+from run_grid import RES_PATH, INDEX_FILE
+
+
+# ------------------------------------------------------------------------------
+#     Configurations
+# ------------------------------------------------------------------------------
+model_name = 'm1a'              # Tested model
+conf_id = 'smoke{}'.format(     # Prefix of the ids of the jobs
+    os.getpid())
+options = [                     # Command line of run_grid.py
+    model_name,
+    '--grid', 'seed_data=1,2',
+    '--set', 'J=4', 'D=2', 'K=2', 'npg=3', 'id='+conf_id,
+    '--jobs', '2',
+]
+
+
+def run(args):
+    """Run run_grid.py and return its output."""
+    proc = subprocess.run(
+        [sys.executable, os.path.join(run_grid.CUR_PATH, 'run_grid.py')]
+        + args,
+        stdout = subprocess.PIPE,
+        stderr = subprocess.STDOUT,
+        universal_newlines = True
+    )
+    print(proc.stdout)
+    assert proc.returncode == 0
+    return proc.stdout
+
+
+res_path_existed = os.path.isdir(RES_PATH)
+index_path = os.path.join(RES_PATH, INDEX_FILE)
+if os.path.isfile(index_path):
+    with open(index_path, 'r') as f:
+        index_orig = f.read()
+else:
+    index_orig = None
+
+try:
+    out = run(options)
+    assert "2 jobs, 2 to run" in out
+    assert out.count(' done in ') == 2
+
+    records = [
+        name for name in os.listdir(RES_PATH)
+        if name.startswith('grid_{}_{}_'.format(model_name, conf_id))
+        and name.endswith('.json')
+    ]
+    assert len(records) == 2
+    keys = []
+    for name in records:
+        with open(os.path.join(RES_PATH, name), 'r') as f:
+            record = json.load(f)
+        keys.append(record['key'])
+        job_id = record['conf']['id']
+        assert job_id == '{}_{}'.format(conf_id, record['key'])
+        assert record['files'] == [
+            'true_vals_{}_{}.npz'.format(model_name, job_id)]
+        assert run_grid.is_done(model_name, job_id)
+        with open(os.path.join(
+                RES_PATH, 'grid_{}_{}.log'.format(model_name, job_id))) as f:
+            assert "True values saved into results" in f.read()
+    with open(index_path, 'r') as f:
+        index_keys = [record['key'] for record in json.load(f)]
+    assert all(key in index_keys for key in keys)
+    print('{:28} ok'.format('run'))
+
+    # The completed jobs are skipped
+    out = run(options)
+    assert "2 jobs, 0 to run" in out
+    print('{:28} ok'.format('skip completed'))
+
+finally:
+    # Remove the files of the test and restore the index
+    if os.path.isdir(RES_PATH):
+        for name in os.listdir(RES_PATH):
+            if '_{}_{}_'.format(model_name, conf_id) in name:
+                os.remove(os.path.join(RES_PATH, name))
+        if index_orig is not None:
+            with open(index_path, 'w') as f:
+                f.write(index_orig)
+        elif os.path.isfile(index_path):
+            os.remove(index_path)
+        if not res_path_existed and not os.listdir(RES_PATH):
+            os.rmdir(RES_PATH)
+
+print('All ok')
@@ -3,13 +3,82 @@
 Compile with:
     $ python setup.py build_ext --inplace
 
+The module is compiled with OpenMP support for the parallel loops if the
+compiler supports it, which is tested by compiling a small test program. If
+not, e.g. with the default Apple clang, the module is compiled without it and
+the loops are run serially. Set the environment variable EPSTAN_NO_OPENMP to
+compile without OpenMP regardless.
+
 """
+import os
+import sys
+import shutil
+import tempfile
 from distutils.core import setup
+from distutils.extension import Extension
+from distutils.ccompiler import new_compiler
+from distutils.sysconfig import customize_compiler
+from distutils.errors import CompileError, LinkError
 from Cython.Build import cythonize
 import numpy as np
 
 
+OPENMP_TEST_CODE = r"""
+#include <omp.h>
+int main(void) {
+    #pragma omp parallel
+    omp_get_thread_num();
+    return 0;
+}
+"""
+
+
+def openmp_supported(compile_args, link_args):
+    """Test if a program using OpenMP compiles and links with the args."""
+    compiler = new_compiler()
+    customize_compiler(compiler)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        src = os.path.join(tmp_dir, 'test_openmp.c')
+        with open(src, 'w') as f:
+            f.write(OPENMP_TEST_CODE)
+        objects = compiler.compile(
+            [src], output_dir=tmp_dir, extra_postargs=compile_args)
+        compiler.link_executable(
+            objects, 'test_openmp', output_dir=tmp_dir,
+            extra_postargs=link_args)
+    except (CompileError, LinkError):
+        return False
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return True
+
+
+if sys.platform == 'win32':
+    openmp_compile_args = ['/openmp']
+    openmp_link_args = []
+else:
+    openmp_compile_args = ['-fopenmp']
+    openmp_link_args = ['-fopenmp']
+
+if os.environ.get('EPSTAN_NO_OPENMP'):
+    openmp_compile_args = []
+    openmp_link_args = []
+elif not openmp_supported(openmp_compile_args, openmp_link_args):
+    print("The compiler does not support OpenMP, compiling without it")
+    openmp_compile_args = []
+    openmp_link_args = []
+
+extensions = [
+    Extension(
+        'epstan.cython_util',
+        ['epstan/cython_util.pyx'],
+        extra_compile_args = openmp_compile_args,
+        extra_link_args = openmp_link_args
+    )
+]
+
 setup(
-    ext_modules = cythonize("epstan/cython_util.pyx"),
+    ext_modules = cythonize(extensions),
     include_dirs=[np.get_include()]
 )